@@ -1,11 +1,12 @@
 from requests.exceptions import HTTPError
 import cmd
+import json
 import os
 import requests
 import uuid
 from typing import Optional
 from app.auth import password_create
-from app.config import API_CREATE_USER, API_VALIDATE_USER, API_CONV_START, API_CONV_SEND, API_GET_HISTORY, API_FILE_INGEST, API_LOGOUT, API_CHANGECOLLECTION, USER_DB_PATH, MILVUS_URI, MILVUS_USER_ROLE,MILVUS_ROOT_ROLE,col_mod
+from app.config import API_CREATE_USER, API_VALIDATE_USER, API_CONV_START, API_CONV_STREAM, API_GET_HISTORY, API_FILE_INGEST, API_LOGOUT, API_CHANGECOLLECTION, USER_DB_PATH, MILVUS_URI, MILVUS_USER_ROLE,MILVUS_ROOT_ROLE,col_mod
 from app.Ingestion_workflows.milvus_RBAC import milvus_RBAC_manage
 from app.utils.utils_auth import load_json
 from rich import print
@@ -296,15 +297,27 @@ class ChatCLI(cmd.Cmd):
                 "conv_id": str(self.session_id),
                 "message":message
                }
-        response = requests.post(
-            API_CONV_SEND.format(session_id_user=str(self.session_id) + "$" + self.username_current),
+        with requests.post(
+            API_CONV_STREAM.format(session_id_user=str(self.session_id) + "$" + self.username_current),
             json=data,
             headers=self._auth_headers(),
-        )
-        if response.status_code == 200: 
-            print(str(response.json()))
-        else:
-            print("Error:", response.text)
+            stream=True,
+        ) as response:
+            if response.status_code != 200:
+                print("Error:", response.text)
+                return
+            # server-sent events: print tokens as they arrive
+            event= "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event= line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    payload= json.loads(line[len("data:"):].strip())
+                    if event in ("token", "citations"):
+                        print(payload, end="", flush=True)
+                    elif event == "error":
+                        print("Error:", payload)
+            print()
 
     # def do_get_history(self, arg):
     #     """ Retreive conversation history for current session """
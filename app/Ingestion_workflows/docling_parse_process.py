@@ -9,27 +9,31 @@ from docling.datamodel.pipeline_options import (
 from PIL import Image
 import sys
 sys.path.append("/home/sarvagya/tool_exploration/poc_apptainer/PoCs/")
-from app.config import DOC_NAME_METADATA, DOCLING_IMAGE_STORE, DOCLING_HASH_IMAGESTORE, BACKEND_FASTAPI_LOG, SECTIONS_TO_REMOVE
+from app.config import DOC_NAME_METADATA, DOCLING_IMAGE_STORE, BACKEND_FASTAPI_LOG, SECTIONS_TO_REMOVE, DOCLING_PAGE_IMAGES, DOCLING_PNG_WRITE_WORKERS
+from app.utils.utils_docling_index import docling_hash_index
 from app.utils.utils_logging import initialize_logging, logger
 from docling_core.transforms.serializer.html import HTMLTableSerializer
 from docling_core.transforms.serializer.markdown import MarkdownDocSerializer
 from docling_core.types.doc.document import SectionHeaderItem, TableItem
 from docling_core.types.doc import DoclingDocument
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from llama_index.core import Document
 from pathlib import Path
 from pypdf import PdfReader
 from rapidfuzz import fuzz
 from rapidfuzz import process
-from typing import Literal, List, Union
+from typing import Any, Dict, Iterable, Iterator, Literal, List, Optional, Tuple, Union
 import base64
 import hashlib
 import html
 import io
 import json
+import orjson
 import os
 import pickle
 import re
+import threading
 initialize_logging(BACKEND_FASTAPI_LOG)
 
 script_dir = os.path.abspath(os.getcwd())
@@ -255,14 +259,19 @@ class Docling_Process():
         return node
 
     def merge_nodes(self, doc_list: List):
+        """ Merge nodes, see iter_merged_nodes
+
+        Returns:
+            processed_doc (List[Document]): List of Documents with merged nodes as per identified section/subsections
+        """
+        return list(self.iter_merged_nodes(doc_list))
+
+    def iter_merged_nodes(self, doc_list: List) -> Iterator[Document]:
         """ Merge nodes by first extracting table of contents and then getting valid titles. 
-        Then it gets last index before subsequent section/subsection for each section and merges them. 
+        Then it gets last index before subsequent section/subsection for each section and merges them, yielding one merged node at a time. 
 
         Args:
             doc_list (List[Document]): List of Documents where merge is to take place
-
-        Returns:
-            processed_doc (List[Document]): List of Documents with merged nodes as per identified section/subsections
         """
         all_titles=[]
         metadata_title= []
@@ -276,34 +285,46 @@ class Docling_Process():
         for doc in doc_list: 
             all_titles.append(doc.metadata["headings"])
         titles= self.get_valid_titles(doc_list, content_table, all_titles, metadata_title)
-        processed_doc=[]
         for index, docs in enumerate(doc_list):
             if docs.metadata["headings"] in titles: 
                 last_index= self.get_last_index(index, doc_list, titles) # get last index of the node in the same section or subsection
                 node= self.copy_node_properties(doc_list=doc_list, start_index=index, last_index=last_index) # create new node preserving the desired properties specific to that node and concatenating text of same section
-                processed_doc.append(node)
-        return processed_doc
+                yield node
+
+    def iter_sections(self) -> Iterator[str]:
+        """ Sections of the serialized document (split on markdown level 2 headings) one at a time,
+            with unwanted text removed and html codes and \\_ fixed, without holding a list of all section texts
+        """
+        text= Docling_Process.remove_unwanted_text(self.doc_parsed.text)
+        start= 0
+        while True:
+            end= text.find("\n## ", start)
+            section= text[start:] if end == -1 else text[start:end]
+            yield re.sub(r'\\_', '_', html.unescape(section))
+            if end == -1:
+                break
+            start= end + len("\n## ")
 
     def process_doc(self):
+        """ Post processing of the whole document, see iter_processed
+
+        Returns:
+            final_processed_doc: Processed list of documents
+        """
+        return list(self.iter_processed())
+
+    def iter_processed(self) -> Iterator[Document]:
         """ Post processing orchestration function: 
         1. Fix the title format of the nodes to the desired: {title number} {title text} 
         2. Alter metadata to have the Document name, section position, page no as 3 elements
         3. Merge nodes into one to form a heirarchical structure where each node corresponds to a section/subsection and its text, at the same time preserving the relationships between nodes
-
-
-        Returns:
-            final_processed_doc: Processed list of documents
+        Sections are read one at a time and merged nodes are yielded as they are built.
         """
-        preprocessed_doc_list=[]
-        self.doc_parsed.text= Docling_Process.remove_unwanted_text(self.doc_parsed.text)
-        texts= self.doc_parsed.text.split("\n## ")
-        # text processing to remove html codes and \\_
-        texts= [html.unescape(i) for i in texts]
-        texts= [re.sub(r'\\_', '_', i)  for i in texts]
-        titles= [{(re.sub(r"^## ", "", i.split("\n")[0], flags=re.MULTILINE)).strip():i} for i in texts]
+        preprocessed_doc_list= [Document(text=text) for text in self.iter_sections()]
+        # only the titles are needed to get the page ranges
+        titles= [{re.sub(r"^## ", "", doc.text.partition("\n")[0]).strip(): None} for doc in preprocessed_doc_list]
         orig_head, titles= self.get_page_range(titles)
-        for ind,text in enumerate(texts):
-            preprocessed_doc= Document(text=text)
+        for ind, preprocessed_doc in enumerate(preprocessed_doc_list):
             orig_heading= list(titles[ind].keys())[0]
             preprocessed_doc.metadata["Orig_headings"]= orig_heading
             preprocessed_doc.metadata["headings"]=  Docling_Process.fix_title_format(orig_heading)
@@ -312,13 +333,55 @@ class Docling_Process():
                 orig_head[orig_heading]= orig_head[orig_heading][1:]
             except KeyError:
                 preprocessed_doc.metadata["page_no"]=[]
-            preprocessed_doc_list.append(preprocessed_doc) 
         if not preprocessed_doc_list[0].metadata["page_no"]:
             preprocessed_doc_list= preprocessed_doc_list[1:]
-        processed_doc_list = self.merge_nodes(preprocessed_doc_list)
-        return processed_doc_list
+        yield from self.iter_merged_nodes(preprocessed_doc_list)
+
+# warm DocumentConverters of this process keyed by their pipeline options, the layout and TableFormer models are loaded once per process
+_converters: Dict[str, DocumentConverter]= {}
+_converters_lock= threading.Lock()
 
 class Docling_parser():
+
+    @staticmethod
+    def pdf_pipeline_options() -> PdfPipelineOptions:
+        """ Pipeline options used to parse the ingested pdfs """
+        accelerator_options = AcceleratorOptions(
+            num_threads=16, device=AcceleratorDevice.CUDA)
+        pipeline_options_v1 = PdfPipelineOptions()
+        pipeline_options_v1.accelerator_options = accelerator_options
+        pipeline_options_v1.do_ocr = False
+        pipeline_options_v1.do_table_structure = True
+        pipeline_options_v1.table_structure_options.do_cell_matching = True
+        pipeline_options_v1.table_structure_options.mode = TableFormerMode.ACCURATE
+        pipeline_options_v1.generate_page_images= True
+        pipeline_options_v1.images_scale= 2.0
+        return pipeline_options_v1
+
+    @staticmethod
+    def get_converter(pipeline_options: Optional[PdfPipelineOptions]= None, warm: bool= False) -> DocumentConverter:
+        """ DocumentConverter of this process for the pipeline options, created once and reused for every document
+
+        Args:
+            pipeline_options (PdfPipelineOptions): Defaults to pdf_pipeline_options()
+            warm (bool): load the pipeline models now instead of on the first conversion
+        """
+        pipeline_options= pipeline_options or Docling_parser.pdf_pipeline_options()
+        key= hashlib.md5(pipeline_options.model_dump_json().encode("utf-8"), usedforsecurity=False).hexdigest()
+        with _converters_lock:
+            converter= _converters.get(key)
+            if converter is None:
+                converter= DocumentConverter(
+                    format_options={
+                        InputFormat.PDF: PdfFormatOption(
+                            pipeline_options=pipeline_options,
+                        )
+                    }
+                )
+                _converters[key]= converter
+            if warm:
+                converter.initialize_pipeline(InputFormat.PDF)
+        return converter
     
     @staticmethod
     def save_object(obj, file: str, filetype: Literal["pickle", "json"]= "pickle"):
@@ -355,6 +418,80 @@ class Docling_parser():
     def parse_docling(doc_converter, source: str):
         doc= doc_converter.convert(source=source).document
         return doc
+
+    @staticmethod
+    def page_ranges(file: str, shard_pages: int) -> List[Tuple[int, int]]:
+        """ Page ranges (1-based, inclusive) of at most shard_pages pages covering a pdf, for parsing it in parallel shards.
+            Empty if the pdf fits into one shard or its docling parse is already cached.
+
+        Args:
+            file (str): pdf file
+            shard_pages (int): pages per shard, 0 disables sharding
+        """
+        if shard_pages <= 0:
+            return []
+        page_count= len(PdfReader(file).pages)
+        if page_count <= shard_pages:
+            return []
+        file_hash= Docling_parser.create_file_hash(Path(file))
+        if file_hash in docling_hash_index and Path(DOCLING_IMAGE_STORE.format(filename=file_hash)).exists():
+            return []
+        return [(start, min(start + shard_pages - 1, page_count)) for start in range(1, page_count + 1, shard_pages)]
+
+    @staticmethod
+    def parse_docling_range(source: str, page_range: Tuple[int, int]) -> str:
+        """ Parse a page range of a pdf with the warm converter of this process, page numbers are the ones of the full pdf.
+            The exported document (with its page images) is written next to the pdf and only its path is returned,
+            so the fragment is not pickled back to the main process and on to the stitching worker.
+        """
+        fragment= Docling_parser.get_converter().convert(source=source, page_range=page_range).document.export_to_dict()
+        path= f"{source}.pages_{page_range[0]}-{page_range[1]}.json"
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(fragment))
+        return path
+
+    @staticmethod
+    def load_fragments(paths: List[str]) -> Iterator[Dict[str, Any]]:
+        """ Exported documents of parsed page ranges (parse_docling_range), read one at a time so only one fragment is held besides the stitched document """
+        for path in paths:
+            with open(path, "rb") as f:
+                yield orjson.loads(f.read())
+
+    @staticmethod
+    def stitch_docling(fragments: Iterable[Dict[str, Any]]) -> DoclingDocument:
+        """ Join the documents of consecutive page ranges of one pdf (parse_docling_range) into one DoclingDocument.
+            Items of every fragment are appended to the item lists of the first one, their json pointers (#/texts/3) are shifted by the
+            number of items already present, body and furniture children are appended in page order and pages are merged by page number.
+
+        Args:
+            fragments (Iterable[dict]): exported documents ordered by page range
+        """
+        item_lists= ("groups", "texts", "pictures", "tables", "key_value_items", "form_items")
+        fragments= iter(fragments)
+        merged= next(fragments)
+        for fragment in fragments:
+            offsets= {name: len(merged.get(name, [])) for name in item_lists}
+
+            def shift(ref: str) -> str:
+                parts= ref.split("/")
+                if len(parts) == 3 and parts[1] in offsets:
+                    return f"#/{parts[1]}/{int(parts[2]) + offsets[parts[1]]}"
+                return ref
+
+            def rewrite(node):
+                if isinstance(node, dict):
+                    return {key: shift(value) if key in ("$ref", "self_ref", "cref") and isinstance(value, str) else rewrite(value) for key, value in node.items()}
+                if isinstance(node, list):
+                    return [rewrite(value) for value in node]
+                return node
+
+            fragment= rewrite(fragment)
+            for name in item_lists:
+                merged.setdefault(name, []).extend(fragment.get(name, []))
+            for root in ("body", "furniture"):
+                merged[root]["children"].extend(fragment[root]["children"])
+            merged["pages"].update(fragment["pages"])
+        return DoclingDocument.model_validate(merged)
     
     @staticmethod
     def get_store(path: str):
@@ -377,26 +514,58 @@ class Docling_parser():
             imagestore = json.load(f)
         return imagestore
     
-    def save_doc_png(self, doc, folder: str, json_path: str):
-        """Saves json (of docling doc) and png for each base64 by compressing first and then saving as per page number in folder
+    @staticmethod
+    def decode_page_image(uri: str) -> bytes:
+        """ PNG bytes of a page image data uri. Docling embeds pages as PNG already, those bytes are used as they are """
+        header, base64_str= uri.split(",", 1)
+        image_data= base64.b64decode(base64_str)
+        if header.startswith("data:image/png"):
+            return image_data
+        output= io.BytesIO()
+        Image.open(io.BytesIO(image_data)).save(output, format="PNG", compress_level=1)
+        return output.getvalue()
+
+    @staticmethod
+    def write_page_image(uri: str, output_path: str):
+        with open(output_path, "wb") as f:
+            f.write(Docling_parser.decode_page_image(uri))
+
+    def save_doc_png(self, doc, folder: str, json_path: str, page_images: str= DOCLING_PAGE_IMAGES):
+        """Saves json (of docling doc) and a png per page number in folder.
+            Page images are written in parallel without recompressing them, with page_images "lazy" they are not written at all
+            and the doc store renders a page from the json on its first request.
 
         Args:
             doc (Docling_document): docling doc
             folder (str): file where page images for docling doc have to be saved
+            json_path (str): path of the docling json
+            page_images (str): "eager" or "lazy"
         """
         os.makedirs(folder, exist_ok=True)
         # save png
-        for page in doc.pages.keys():
-            uri= str(doc.pages[page].image.uri)
-            if uri.startswith("data:image"):
-                base64_str = uri.split(",")[1]
-            image_data= base64.b64decode(base64_str) 
-            image = Image.open(io.BytesIO(image_data))
-            output_path = folder + f"/{page}.png"
-            image.save(output_path, format="PNG", optimize=True, compress_level=9)
+        if page_images != "lazy":
+            uris= {page: str(doc.pages[page].image.uri) for page in doc.pages.keys() if doc.pages[page].image is not None}
+            with ThreadPoolExecutor(max_workers=DOCLING_PNG_WRITE_WORKERS) as pool:
+                list(pool.map(Docling_parser.write_page_image, uris.values(), [folder + f"/{page}.png" for page in uris.keys()]))
         # save docling doc in same folder
         doc.save_as_json(json_path)
     
+    @staticmethod
+    def drop_page_images(doc):
+        """ Release the embedded page images of a docling doc once they are written """
+        for page in doc.pages.values():
+            page.image= None
+        return doc
+
+    @staticmethod
+    def load_docling_json(path: str) -> DoclingDocument:
+        """ Load a saved docling doc without its embedded page images, which are served from the doc store """
+        with open(path, "rb") as f:
+            doc= orjson.loads(f.read())
+        for page in doc.get("pages", {}).values():
+            page["image"]= None
+        return DoclingDocument.model_validate(doc)
+
     @staticmethod
     def serialize_docling(doc):
         serializer = MarkdownDocSerializer(
@@ -413,6 +582,14 @@ class Docling_parser():
         Returns:
             sections: Docling parsed doc with sections metadata
         """
+        return list(self.iter_hierarchy(nodes))
+
+    def iter_hierarchy(self, nodes: Iterable) -> Iterator:
+        """ Builds a hierarchy of sections adding it to the metadata, yielding each node once its section path is set
+
+        Args:
+            nodes (Iterable[TextNode]): Docling parsed doc without sections metadata, in document order
+        """
         # Regex to extract the section number and title
         section_pattern = r"^(\d+(\.\d+)*)(?:\s+)?(.+)"
         hierarchy = []
@@ -435,7 +612,7 @@ class Docling_parser():
                 node.metadata["Section"]= current_heirarchy
             else:
                 node.metadata["Section"]= heading
-        return nodes
+            yield node
     
     @staticmethod
     def remove_sections(processed_doc: List):
@@ -454,15 +631,21 @@ class Docling_parser():
         return processed_doc_removed
 
     def post_process(self, doc_serialized, filename: str, date_extracted: str, binary_hash: str):
+        """ Post process the serialized document into nodes. Merged sections stream one at a time through the hierarchy building,
+            section removal and metadata, only the final list of nodes is built.
+        """
+        final_processed_doc= []
         try: 
             process_obj= Docling_Process(doc_parsed=doc_serialized, filename= filename)
-            processed_doc= process_obj.process_doc()
+            for node in self.iter_hierarchy(process_obj.iter_processed()):
+                if node.metadata["Section"].lower() in SECTIONS_TO_REMOVE:
+                    continue
+                node.metadata["Date"]= date_extracted
+                node.metadata["binary_hash"]= binary_hash
+                final_processed_doc.append(node)
         except Exception as e: 
             logger.error("Error while post processing the parsed file %s: %s", filename, str(e))
             raise Exception(f"Post processing of parsed file unsuccessful: {str(e)}")
-        hierarchical_processed_doc= self.build_hierarchy(processed_doc)
-        processed_doc= Docling_parser.add_metadata_docling(docling_parsed=hierarchical_processed_doc, date=date_extracted, binary_hash= binary_hash)
-        final_processed_doc= Docling_parser.remove_sections(processed_doc=processed_doc)
         return final_processed_doc
 
     @staticmethod
@@ -485,27 +668,17 @@ class Docling_parser():
             _hash_buf(path_or_stream)
         return hasher.hexdigest()
 
-    def docling_ingest(self, file: str, collection_name: str):
+    def docling_ingest(self, file: str, collection_name: str, fragment_paths: Optional[List[str]]= None):
+        """ Parse (or load the cached parse of) a pdf, save its page images and post process it into nodes
+
+        Args:
+            file (str): pdf file
+            collection_name (str): collection the file is ingested to
+            fragment_paths (List[str]): files of its page ranges parsed in parallel (parse_docling_range), stitched instead of parsing the file
+        """
         _, filename= os.path.split(file)
-        image_store= Docling_parser.get_store(DOCLING_HASH_IMAGESTORE) # get the image store dict which is stored as json
 
-        accelerator_options = AcceleratorOptions(
-            num_threads=16, device=AcceleratorDevice.CUDA)
-        pipeline_options_v1 = PdfPipelineOptions()
-        pipeline_options_v1.accelerator_options = accelerator_options
-        pipeline_options_v1.do_ocr = False
-        pipeline_options_v1.do_table_structure = True
-        pipeline_options_v1.table_structure_options.do_cell_matching = True
-        pipeline_options_v1.table_structure_options.mode = TableFormerMode.ACCURATE
-        pipeline_options_v1.generate_page_images= True
-        pipeline_options_v1.images_scale= 2.0
-        custom_accelerated_v1= DocumentConverter(
-                format_options={
-                    InputFormat.PDF: PdfFormatOption(
-                        pipeline_options=pipeline_options_v1,
-                    )
-                }
-            )
+        custom_accelerated_v1= Docling_parser.get_converter()
         # markitdown for date extraction
         try:
             # md = MarkItDown(enable_plugins=False)
@@ -519,29 +692,35 @@ class Docling_parser():
         file_hash= Docling_parser.create_file_hash(Path(file)) 
         image_folderpath= DOCLING_IMAGE_STORE.format(filename=file_hash) 
         image_folder_jsonpath= image_folderpath + f"/{file_hash}.json"
-        if file_hash in image_store.keys() and Path(image_folderpath).exists():
+        if file_hash in docling_hash_index and Path(image_folderpath).exists():
             logger.info("File %s already parsed by docling: using the cached file for downstream ingestion at collection %s", filename, collection_name)
-            doc_json= DoclingDocument.load_from_json(image_folder_jsonpath)
+            doc_json= Docling_parser.load_docling_json(image_folder_jsonpath)
         else: 
             logger.info("Cache not found for this file %s. Continuing with parsing.", filename)
             try:
-                doc_json= Docling_parser.parse_docling(doc_converter=custom_accelerated_v1, source=file)   
+                if fragment_paths:
+                    logger.info("Stitching %s parsed page ranges of file %s", len(fragment_paths), filename)
+                    doc_json= Docling_parser.stitch_docling(Docling_parser.load_fragments(fragment_paths))
+                else:
+                    doc_json= Docling_parser.parse_docling(doc_converter=custom_accelerated_v1, source=file)
                 doc_json.origin.binary_hash= file_hash   
             except Exception as e:
                 logger.error("Error with docling parsing for file %s : %s", file, str(e))
                 raise Exception(f"Docling parsing failed for file {file}")
-            image_store[doc_json.origin.binary_hash]= image_folderpath # store file path for that image using docling hash as key
             logger.info("Saving png for file %s, total pages: %s", filename, len(doc_json.pages))
             self.save_doc_png(doc=doc_json, folder=image_folderpath, json_path= image_folder_jsonpath)
-            Docling_parser.save_object(image_store, file=DOCLING_HASH_IMAGESTORE, filetype="json") # save the image store per binary hash as json
+            # page images are on disk and in the json now, post processing only needs the text
+            Docling_parser.drop_page_images(doc_json)
+            docling_hash_index.add(file_hash, image_folderpath) # recorded once the pages and json are written, marks the parse as cached
             logger.info("Docling parsing successful for file %s", filename)
         doc_json.origin.binary_hash= file_hash
         # serialize the parsed file 
         doc_ser_result= Docling_parser.serialize_docling(doc_json)
+        del doc_json
         # post process the serialized file and add new metadata
         final_processed_doc= self.post_process(doc_serialized=doc_ser_result, 
                                                filename=filename, date_extracted=date_extracted, 
-                                               binary_hash=str(doc_json.origin.binary_hash))
+                                               binary_hash=str(file_hash))
         return final_processed_doc
 
 if __name__ == "__main__":
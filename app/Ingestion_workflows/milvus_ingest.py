@@ -1,16 +1,25 @@
 from app.config import col_mod, batch_mod, dim_mod, port_vllm_col, model_len_model, mod_chunk, milvus_text_template, DOC_NAME_METADATA, BACKEND_FASTAPI_LOG, EMBED_BACKEND_URL, BACKEND, dummy_model
+from app.utils.utils_embed_scheduler import embedding_scheduler, BULK
+from app.utils.utils_http import get_http_client
 from app.utils.utils_logging import initialize_logging, logger
+from app.utils.utils_milvus import pooled_client, pooled_async_client
 from datasets import Dataset
+from functools import lru_cache
 from llama_index.core.node_parser import SentenceSplitter
 from pymilvus import MilvusClient, AsyncMilvusClient, DataType, Function, FunctionType
-from typing import Optional, List
+from typing import Dict, Optional, List, Sequence
 import tiktoken
 import asyncio
-import httpx
 import copy
+import hashlib
 import re
 initialize_logging(BACKEND_FASTAPI_LOG)
 
+# collection property set once the text_hash of all chunks of a collection created before the text_hash field is backfilled
+TEXT_HASH_BACKFILLED= "text_hash_backfilled"
+# one backfill per collection at a time in this process
+_backfill_locks: Dict[str, asyncio.Lock]= {}
+
 class ingest2milvus():
     bm25_function = Function(
         name="text_bm25_emb", # Function name
@@ -20,18 +29,22 @@ class ingest2milvus():
     )
     
     @staticmethod
-    async def get_embedding(url:str, payload: dict):
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, timeout=10000)
+    async def get_embedding(url:str, payload: dict, priority: int= BULK):
+        """ Post to the embedding backend through the scheduler, which bounds concurrent requests per backend and retries transient errors """
+        async def request():
+            client= get_http_client(url)
+            response = await client.post(url, json=payload)
             response.raise_for_status()
             return response.json()
+        return await embedding_scheduler.run(url, request, priority=priority)
 
     @staticmethod
-    async def encode_text(batch, model, backend_url=EMBED_BACKEND_URL, backend= BACKEND, instruct: str= None):
+    async def encode_text(batch, model, backend_url=EMBED_BACKEND_URL, backend= BACKEND, instruct: str= None, priority: int= BULK):
         if backend=="vllm":
             backend_url= backend_url.format(PORT=port_vllm_col[model])
             if instruct and "qwen3" in model:
-                input= f'Instruct: {instruct}\nQuery:{batch["text_concat"]}'
+                texts= batch["text_concat"]
+                input= [f'Instruct: {instruct}\nQuery:{text}' for text in texts] if isinstance(texts, list) else f'Instruct: {instruct}\nQuery:{texts}'
             else:
                 input= batch["text_concat"]
             payload={
@@ -49,7 +62,8 @@ class ingest2milvus():
             }
         embeddings = await ingest2milvus.get_embedding(
             url=backend_url,
-            payload=payload
+            payload=payload,
+            priority=priority
             )
         if backend=="vllm":
             batch["dense_embedding"]= [emb["embedding"] for emb in embeddings["data"]]
@@ -74,21 +88,39 @@ class ingest2milvus():
         data = dataset.map(remove_columns=['metadata_template', 'metadata_separator', 'text_template'],)
         return data
     
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """ Content hash of a chunk text, stored in the text_hash field to look up duplicates """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_encoding(dummy_model: str) -> tiktoken.Encoding:
+        """ tiktoken encoding of a model, built once per process and shared by all callers (tiktoken encodings are thread safe) """
+        return tiktoken.encoding_for_model(dummy_model)
+
     @staticmethod
     def get_token_len(dummy_model: str, text: str):
-        encoding = tiktoken.encoding_for_model(dummy_model)
-        return len(encoding.encode(text))
+        return len(ingest2milvus.get_encoding(dummy_model).encode(text))
+
+    @staticmethod
+    def get_token_lens(dummy_model: str, texts: Sequence[str]) -> List[int]:
+        """ Token counts of many texts, encoded as one batch by tiktoken's thread pool """
+        return [len(tokens) for tokens in ingest2milvus.get_encoding(dummy_model).encode_batch(list(texts))]
 
     @staticmethod
     def clean_metadata(parsed_docs: List, dummy_model: str):
-        for doc in parsed_docs: 
-            if ingest2milvus.get_token_len(dummy_model=dummy_model, text=doc.metadata["Section"])>256: 
+        section_lens= ingest2milvus.get_token_lens(dummy_model=dummy_model, texts=[doc.metadata["Section"] for doc in parsed_docs])
+        for doc, section_len in zip(parsed_docs, section_lens): 
+            if section_len>256: 
                 doc.metadata["Section"] =  doc.metadata["Section"].split()[0]
         return parsed_docs
 
     @staticmethod
     def merge_small(docs: List, chunk_size: int, dummy_model: str):
-        """ Do small to big chunking of any chunk which is small
+        """ Do small to big chunking of any chunk which is small.
+            Every chunk is encoded once (as a batch), the token count of a merged node is kept as a running sum
+            of its parts and the separator instead of encoding the growing combined text for each pair.
 
         Args:
             docs (list): list of nodes post chunking and making into a dict
@@ -99,37 +131,36 @@ class ingest2milvus():
             merged_nodes: merged node names
         """
         merged_nodes = []
+        if not docs:
+            return merged_nodes
+        token_lens= ingest2milvus.get_token_lens(dummy_model=dummy_model, texts=[doc["text_concat"] for doc in docs])
+        separator_len= ingest2milvus.get_token_len(dummy_model=dummy_model, text="\n\n")
         current_node = docs[0].copy()
+        current_tokens= token_lens[0]
         numbered_pattern= r"^(?:\d+(?:\.\d+){0,4})(?!\s*[);])(?:\s+.+)?$"  # should be same as the pattern in get_valid_titles
         for i in range(1, len(docs)):
             next_node = docs[i]
-            # Calculate the number of tokens if we merge
-            combined_text = current_node["text_concat"] + "\n\n" + next_node["text_concat"]
-            num_tokens_combined = ingest2milvus.get_token_len(dummy_model=dummy_model, text=combined_text)
+            # Number of tokens if we merge, BPE merges across the joint can only make the combined text shorter so the sum is an upper bound
+            num_tokens_combined = current_tokens + separator_len + token_lens[i]
             if re.search(pattern=numbered_pattern, string=current_node["metadata"]["Section"].split("AND")[0].strip()):
                 # merge for numbered sections nodes
                 # TODO: see that merges to same sublevel (9.2.3.4 should stick to 9.2.4 but not 9.3)
-                if next_node["metadata"]["Section"].split()[0].strip()==current_node["metadata"]["Section"].split()[0].strip() and num_tokens_combined < int(1/2* chunk_size):
-                    current_node["text_concat"] = combined_text
-                    current_node["text"] = current_node["text"] + "\n" + next_node["text"]
-                    current_node["metadata"]["Section"] = current_node["metadata"]["Section"] + " AND " + next_node["metadata"]["Section"]
-                    current_node["metadata"]["page_no"][0].extend(next_node["metadata"]["page_no"][0])
-                else: 
-                    merged_nodes.append(current_node)
-                    # Start a new current_node with the next_node
-                    current_node = next_node.copy()
-            elif num_tokens_combined < int(1/2* chunk_size):
-                # merge for non numbered sections nodes
-                # If it fits, merge the next_node into the current_node
-                current_node["text_concat"] = combined_text
+                merge= next_node["metadata"]["Section"].split()[0].strip()==current_node["metadata"]["Section"].split()[0].strip() and num_tokens_combined < int(1/2* chunk_size)
+            else:
+                # merge for non numbered sections nodes if the next_node fits into the current_node
+                merge= num_tokens_combined < int(1/2* chunk_size)
+            if merge:
+                current_node["text_concat"] = current_node["text_concat"] + "\n\n" + next_node["text_concat"]
                 current_node["text"] = current_node["text"] + "\n" + next_node["text"]
                 current_node["metadata"]["Section"] = current_node["metadata"]["Section"] + " AND " + next_node["metadata"]["Section"]
                 current_node["metadata"]["page_no"][0].extend(next_node["metadata"]["page_no"][0])
+                current_tokens= num_tokens_combined
             else:
                 # If it doesn't fit, add the current_node to our list of merged nodes
                 merged_nodes.append(current_node)
                 # Start a new current_node with the next_node
                 current_node = next_node.copy()
+                current_tokens= token_lens[i]
         merged_nodes.append(current_node)
         return merged_nodes
 
@@ -165,47 +196,46 @@ class ingest2milvus():
         for nodes in merged_nodes_json:
             nodes["text_concat"]= milvus_text_template.format(metadata_str= f"{DOC_NAME_METADATA}:{nodes['metadata'][DOC_NAME_METADATA]}", content= nodes["text_concat"])
             nodes["metadata"]["page_no"][0]= sorted(list(set(nodes["metadata"]["page_no"][0])))
+            nodes["text_hash"]= ingest2milvus.text_hash(nodes["text"])
         return Dataset.from_list(merged_nodes_json)
     
-    def check_chunks(self, chunk, old_data:list) -> tuple:
+    def check_chunks(self, chunk, old_data:dict) -> tuple:
         """ Checks for each chunk if its content is present in existing chunks in the collection. 
-            Has 2 distinct loops:
+            Only existing chunks with the same text hash are compared, has 2 distinct loops:
             Loop 1: checks if text is same and the if chunk is from the same document.
             Loop 2: For a different document, check if chunk is same, (upsertion with appended metadata will be performed downstream)
         Args:
             chunk : chunk which is being checked for duplicates
-            old_data (list): chunks from existing collection
-            client (AsyncMilvusClient): to upsert into milvus if same chunk content but differnt document
+            old_data (dict): chunks from existing collection grouped by text_hash
 
         Returns:
             1/0: 1 if chunk content is already present in collection, otherweise 0
             list: updated_chunk_batch if same chunk but different document
         """
-        exact_text_flag= 0
-        for old_chunk in old_data:
-            # check if any exact text exists with the name of file-to-be-ingested also present in already inserted data's metadata, then skip entirely
-            if chunk["text"]==old_chunk["text"]:
-                exact_text_flag=1
-                if chunk["metadata"][DOC_NAME_METADATA] in old_chunk["metadata"][DOC_NAME_METADATA]:
-                    return 1, {}
+        candidates= [old_chunk for old_chunk in old_data.get(chunk["text_hash"], []) if chunk["text"]==old_chunk["text"]]
+        for old_chunk in candidates:
+            # exact text exists with the name of file-to-be-ingested also present in already inserted data's metadata, then skip entirely
+            if chunk["metadata"][DOC_NAME_METADATA] in old_chunk["metadata"][DOC_NAME_METADATA]:
+                return 1, {}
         # this loop only gets executed if there are exact matches in texts but document name of the chunk is not present in existing data in collection
-        if exact_text_flag==1:
-            for old_chunk in old_data:
-                # 2 different documents contain the same text: update metadata to contain new document name as well + upsert.
-                # remove the document name line at the start from text concat before comparing
-                new_text= '\n'.join(chunk["text_concat"].split('\n')[1:])
-                old_text= '\n'.join(old_chunk["text_concat"].split('\n')[1:])
-                if new_text.lower()==old_text.lower():
-                        old_chunk["metadata"][DOC_NAME_METADATA]=old_chunk["metadata"][DOC_NAME_METADATA]+ " AND "+ str(chunk["metadata"][DOC_NAME_METADATA])
-                        old_chunk["metadata"]["Date"]=old_chunk["metadata"]["Date"]+ " AND "+ str(chunk["metadata"]["Date"])
-                        old_chunk["metadata"]["binary_hash"]=old_chunk["metadata"]["binary_hash"]+ " AND "+ str(chunk["metadata"]["binary_hash"])
-                        old_chunk["metadata"]["page_no"].extend(chunk["metadata"]["page_no"])
-                        metadata_str=""
-                        for key,value in old_chunk["metadata"].items():
-                            if key==DOC_NAME_METADATA or key=="header_path":
-                                metadata_str= metadata_str + f"{key}:{value}\n"
-                        old_chunk["text_concat"]= milvus_text_template.format(metadata_str= metadata_str,content= old_text)
-                        return 1, old_chunk
+        for old_chunk in candidates:
+            # 2 different documents contain the same text: update metadata to contain new document name as well + upsert.
+            # remove the document name line at the start from text concat before comparing
+            new_text= '\n'.join(chunk["text_concat"].split('\n')[1:])
+            old_text= '\n'.join(old_chunk["text_concat"].split('\n')[1:])
+            if new_text.lower()==old_text.lower():
+                    old_chunk["metadata"][DOC_NAME_METADATA]=old_chunk["metadata"][DOC_NAME_METADATA]+ " AND "+ str(chunk["metadata"][DOC_NAME_METADATA])
+                    old_chunk["metadata"]["Date"]=old_chunk["metadata"]["Date"]+ " AND "+ str(chunk["metadata"]["Date"])
+                    old_chunk["metadata"]["binary_hash"]=old_chunk["metadata"]["binary_hash"]+ " AND "+ str(chunk["metadata"]["binary_hash"])
+                    old_chunk["metadata"]["page_no"].extend(chunk["metadata"]["page_no"])
+                    metadata_str=""
+                    for key,value in old_chunk["metadata"].items():
+                        if key==DOC_NAME_METADATA or key=="header_path":
+                            metadata_str= metadata_str + f"{key}:{value}\n"
+                    old_chunk["text_concat"]= milvus_text_template.format(metadata_str= metadata_str,content= old_text)
+                    # chunks of collections created before the text_hash field get it on upsert
+                    old_chunk["text_hash"]= chunk["text_hash"]
+                    return 1, old_chunk
         return 0, {}
     
     async def embed_torch(self, embed_dataset, batch_size: int, model: str):
@@ -215,14 +245,71 @@ class ingest2milvus():
         dataset = Dataset.from_dict({key: sum([batch[key] for batch in dataset], []) for key in dataset[0]})
         return dataset.to_list()
 
+    @staticmethod
+    async def find_existing(milvus_client: MilvusClient, async_client: AsyncMilvusClient, collection_name: str, data: list, batch_size: int= 1000) -> List[dict]:
+        """ Existing chunks of the collection whose text hash matches one of the new chunks, filtered on the text_hash field.
+            Collections created before the text_hash field get it backfilled as dynamic field once (see backfill_text_hash).
+
+        Args:
+            milvus_client (MilvusClient): client used for the schema and the query iterator
+            async_client (AsyncMilvusClient): client used for the filtered queries
+            collection_name (str): collection to check
+            data (list): new chunks with text_hash
+            batch_size (int): rows per batch of the backfill of older collections
+
+        Returns:
+            list: existing chunks with id, metadata, text, text_concat and text_hash
+        """
+        description= milvus_client.describe_collection(collection_name=collection_name)
+        if "text_hash" not in [field["name"] for field in description["fields"]] and description.get("properties", {}).get(TEXT_HASH_BACKFILLED) != "true":
+            await ingest2milvus.backfill_text_hash(milvus_client=milvus_client, async_client=async_client, collection_name=collection_name, batch_size=batch_size)
+        hashes= list({chunk["text_hash"] for chunk in data})
+        return await async_client.query(collection_name=collection_name, filter="text_hash in {hashes}", filter_params={"hashes": hashes},
+                                        output_fields=["id", "metadata", "text", "text_concat", "text_hash"])
+
+    @staticmethod
+    async def backfill_text_hash(milvus_client: MilvusClient, async_client: AsyncMilvusClient, collection_name: str, batch_size: int= 1000):
+        """ Store the text hash of every chunk of a collection created before the text_hash field in its dynamic field text_hash, once per collection.
+            The ids are streamed first and the chunks are then upserted in batches, so the collection is never loaded into memory as a whole.
+            Completion is recorded in the collection properties, chunks inserted later carry their text_hash already.
+        """
+        async with _backfill_locks.setdefault(collection_name, asyncio.Lock()):
+            properties= milvus_client.describe_collection(collection_name=collection_name).get("properties", {})
+            if properties.get(TEXT_HASH_BACKFILLED) == "true":
+                return
+            def scan() -> List[int]:
+                ids= []
+                iterator= milvus_client.query_iterator(collection_name=collection_name, batch_size=batch_size, filter="id >= 0", output_fields=["id"])
+                try:
+                    while batch := iterator.next():
+                        ids.extend(row["id"] for row in batch)
+                finally:
+                    iterator.close()
+                return ids
+            ids= await asyncio.to_thread(scan)
+            logger.info("Backfilling text_hash of %s chunks in collection %s", len(ids), collection_name)
+            for start in range(0, len(ids), batch_size):
+                rows= await async_client.query(collection_name=collection_name, ids=ids[start:start + batch_size], output_fields=["*"])
+                for row in rows:
+                    # the sparse embedding is the output of the BM25 function and is regenerated on upsert
+                    row.pop("sparse_embedding", None)
+                    row["text_hash"]= ingest2milvus.text_hash(row["text"])
+                if rows:
+                    await async_client.upsert(collection_name=collection_name, data=rows)
+            milvus_client.alter_collection_properties(collection_name=collection_name, properties={TEXT_HASH_BACKFILLED: "true"})
+            logger.info("Backfilled text_hash of collection %s", collection_name)
+
     async def deduplicate(self, data: list, old_data: list, client: AsyncMilvusClient, collection_name: str, model: str, batch_size: int):
         """ Removes a chunk from insertion data if its content is already present in the collection (exact match)
         """
+        old_data_by_hash= {}
+        for old_chunk in old_data:
+            old_data_by_hash.setdefault(old_chunk["text_hash"], []).append(old_chunk)
         new_data= []
         upsert_chunk_batch=[]
         upsert_dataset=[]
         for chunk in data: 
-            flag, upsert_chunk= self.check_chunks(chunk=chunk, old_data=old_data)
+            flag, upsert_chunk= self.check_chunks(chunk=chunk, old_data=old_data_by_hash)
             if flag==0:
                 # flag is 0 only if the chunk to be inserted is not present in the db. These chunks are carried forward for insertion
                 new_data.append(chunk)
@@ -251,6 +338,7 @@ class ingest2milvus():
         schema.add_field(field_name="dense_embedding", datatype=DataType.FLOAT_VECTOR, dim=dim)
         schema.add_field(field_name="text", datatype=DataType.VARCHAR, enable_analyzer=True, max_length=60535, default_value="")
         schema.add_field(field_name="text_concat", datatype=DataType.VARCHAR, enable_analyzer=True, max_length=60535)
+        schema.add_field(field_name="text_hash", datatype=DataType.VARCHAR, max_length=64, default_value="")
         schema.add_field(field_name="sparse_embedding", datatype=DataType.SPARSE_FLOAT_VECTOR)
         schema.add_function(sparse_function)
 
@@ -278,6 +366,12 @@ class ingest2milvus():
         metric_type="BM25",
         params={"inverted_index_algo": "DAAT_MAXSCORE"}
         )
+        # Add an index on the text hash for deduplication lookups
+        index_params.add_index(
+            field_name="text_hash",
+            index_type="INVERTED",
+            index_name="text_hash_index"
+        )
         milvus_client.create_index(
             collection_name=collection_name,
             index_params=index_params,
@@ -287,7 +381,7 @@ class ingest2milvus():
         logger.info("Created collection %s", collection_name)
         return milvus_client
 
-    async def milvus_ingest(self, uri: str, token: str, data, collection_name: str):
+    async def milvus_ingest(self, uri: str, token: str, data, collection_name: str, milvus_pool= None):
         """ Ingest documents into milvus after creating a schema and indices for dense and sparse embeddings 
 
         Args:
@@ -297,6 +391,7 @@ class ingest2milvus():
             collection_name (str): Collection name to be created. Defaults to COLLECTION_NAME.
             dim (int): Dimension of dense embeddings. Defaults to DIMENSION.
             sparse_function: Sparse embedding funciton to be integrated into schema of milvus collection. Defaults to bm25_function.
+            milvus_pool (MilvusClientPool): app wide client pool, short lived clients are opened if not given
 
         Returns:
             milvus_client: Instantiated milvus client
@@ -305,31 +400,29 @@ class ingest2milvus():
         batch_size= batch_mod[model]
         dim= dim_mod[model]
         data= data.to_list()
-        # Instantiate client and insert to collection
-        milvus_client = MilvusClient(uri, token= token)
-        async_client= AsyncMilvusClient(uri, token= token)
         try: 
-            if milvus_client.has_collection(collection_name=collection_name):
-                # check if duplicates exist in collection, and filter the duplocates out
-                existing_data= await async_client.query(collection_name=collection_name, filter="id >=0", output_fields=["id","metadata", "text", "text_concat"])
-                new_data= await self.deduplicate(data=data, old_data= existing_data, client= async_client, collection_name= collection_name, model=model, batch_size=batch_size)
-                if not new_data:
-                    return False, "File already exists in DB"
-                # end of deduplication feature
+            # Borrow clients for the user credential and insert to collection
+            async with pooled_client(milvus_pool, token=token, uri=uri) as milvus_client, pooled_async_client(milvus_pool, token=token, uri=uri) as async_client:
+                if milvus_client.has_collection(collection_name=collection_name):
+                    # check if duplicates exist in collection, and filter the duplocates out
+                    for chunk in data:
+                        if not chunk.get("text_hash"):
+                            chunk["text_hash"]= ingest2milvus.text_hash(chunk["text"])
+                    existing_data= await ingest2milvus.find_existing(milvus_client=milvus_client, async_client=async_client, collection_name=collection_name, data=data)
+                    new_data= await self.deduplicate(data=data, old_data= existing_data, client= async_client, collection_name= collection_name, model=model, batch_size=batch_size)
+                    if not new_data:
+                        return False, "File already exists in DB"
+                    # end of deduplication feature
+                    await async_client.insert(collection_name=collection_name, data=new_data)
+                    return True, "Ingestion Successful"
+                milvus_client = await ingest2milvus.create_new_collection(milvus_client=milvus_client, dim= dim, collection_name=collection_name)
+                # Embed dataset
+                new_data= await self.embed_torch(embed_dataset=data, batch_size=batch_size, model=model)
+                # Ingest document into the collection and load it 
                 await async_client.insert(collection_name=collection_name, data=new_data)
-                await async_client.close()
-                milvus_client.close()
-                return True, "Ingestion Successful"
-            milvus_client = await ingest2milvus.create_new_collection(milvus_client=milvus_client, dim= dim, collection_name=collection_name)
-            # Embed dataset
-            new_data= await self.embed_torch(embed_dataset=data, batch_size=batch_size, model=model)
-            # Ingest document into the collection and load it 
-            await async_client.insert(collection_name=collection_name, data=new_data)
-            await async_client.load_collection(
-                collection_name=collection_name
-            )
-            await async_client.close()
-            milvus_client.close()
+                await async_client.load_collection(
+                    collection_name=collection_name
+                )
         except Exception as e: 
             logger.error("Unsuccessful ingestion into %s", collection_name)
             return False, str(e)
@@ -46,9 +46,11 @@ DEFAULT_CITATION_CHUNK_SIZE = 512
 DEFAULT_CITATION_CHUNK_OVERLAP = 40
 
 class CitationQueryEngineWorkflow(Workflow):
-    def __init__(self, LLM: LLM, memory: BaseMemory, prefix_messages: List[ChatMessage]= [], timeout = 180, disable_validation = False, verbose = False, service_manager = None, num_concurrent_runs = None, system_prompt= None):
+    def __init__(self, LLM: LLM, memory: BaseMemory, prefix_messages: List[ChatMessage]= [], timeout = 180, disable_validation = False, verbose = False, service_manager = None, num_concurrent_runs = None, system_prompt= None, streaming: bool= False):
         super().__init__(timeout, disable_validation, verbose, service_manager, num_concurrent_runs)
         self.system_prompt= system_prompt
+        # if streaming, run() returns an AsyncStreamingResponse and the caller puts the turn into memory once the stream is consumed
+        self.streaming= streaming
         self._LLM= LLM
         self.memory= memory
         self._prefix_messages = prefix_messages
@@ -75,7 +77,7 @@ class CitationQueryEngineWorkflow(Workflow):
             return None
         nodes= []
         for retrieval in retrievals:
-            node= NodeWithScore(node= Node(text=retrieval["Document"], id_= retrieval["Doc_id"]), score=retrieval["score"])
+            node= NodeWithScore(node= Node(text=retrieval.text, id_= retrieval.doc_id), score=retrieval.score)
             nodes.append(node)
         print(f"Retrieved {len(nodes)} nodes.")
         return RetrieverEvent(nodes=nodes)
@@ -157,10 +159,13 @@ class CitationQueryEngineWorkflow(Workflow):
             refine_template=refine_messages_chatprompt,
             response_mode=ResponseMode.COMPACT,
             use_async=True,
+            streaming=self.streaming,
             verbose=True
         )
         response = await synthesizer.asynthesize(query, nodes=ev.nodes)
         #response= response_artificial
+        if self.streaming:
+            return StopEvent(result=response)
         user_message = ChatMessage(content=query, role=MessageRole.USER)
         ai_message = ChatMessage(content=str(response), role=MessageRole.ASSISTANT)
         self.memory.put(user_message)
@@ -15,12 +15,15 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES",
 
 # Session specific Databases
 USER_HISTORY = parent_dir+ os.environ.get("USER_HISTORY")
+USER_HISTORY_SNAPSHOT_DELAY= float(os.environ.get("USER_HISTORY_SNAPSHOT_DELAY", "5")) # seconds to batch conversation changes before USER_HISTORY is rewritten
 CHAT_STORE_PATH = parent_dir + os.environ.get("CHAT_STORE_PATH")
+CHAT_HISTORY_WINDOW= int(os.environ.get("CHAT_HISTORY_WINDOW", "20")) # latest messages of a conversation loaded into the chat memory per request
 USER_DB_PATH = parent_dir + os.environ.get("USER_DB_PATH")
 USER_COLLECTION_MAPPING= parent_dir + os.environ.get("USER_COLLECTION_MAPPING")
 
 # Observability Databases
-RETRIEVAL_LOG_PATH= parent_dir + os.environ.get("RETRIEVAL_LOG_PATH")
+RETRIEVAL_LOG_PATH= parent_dir + os.environ.get("RETRIEVAL_LOG_PATH") # excel export layout per user
+RETRIEVAL_LOG_DB= parent_dir + os.environ.get("RETRIEVAL_LOG_DB", "/user_data/retrieval_log.sqlite") # append-only store of all users
 BACKEND_FASTAPI_LOG= parent_dir + os.environ.get("BACKEND_FASTAPI_LOG")
 
 # API URLS
@@ -28,6 +31,7 @@ FASTAPI_PORT= os.environ.get("FASTAPI_PORT")
 FASTAPI_URL= f"http://127.0.0.1:{FASTAPI_PORT}"
 API_CONV_START = os.environ.get("API_CONV_START") # initialize conversation
 API_CONV_SEND = os.environ.get("API_CONV_SEND") # send message to bot
+API_CONV_STREAM = os.environ.get("API_CONV_STREAM", (API_CONV_SEND or "") + "/stream") # send message to bot, reply as server-sent events
 API_GET_HISTORY = os.environ.get("API_GET_HISTORY") # get history of a conversation id
 API_CREATE_USER = os.environ.get("API_CREATE_USER") # create new user
 API_VALIDATE_USER = os.environ.get("API_VALIDATE_USER") # validate auth
@@ -48,10 +52,29 @@ MILVUS_ROOT_ROLE= os.environ.get("MILVUS_ROOT_ROLE")
 TOKEN= os.environ.get("TOKEN")
 VECTOR_TOP_K=  int(os.environ.get("VECTOR_TOP_K"))
 DOCLING_IMAGE_STORE= parent_dir + os.environ.get("DOCLING_IMAGE_STORE")
-DOCLING_HASH_IMAGESTORE= parent_dir + os.environ.get("DOCLING_HASH_IMAGESTORE")
+DOCLING_HASH_IMAGESTORE= parent_dir + os.environ.get("DOCLING_HASH_IMAGESTORE") # legacy json store of parsed documents, imported into DOCLING_HASH_INDEX_DB once
+DOCLING_HASH_INDEX_DB= (parent_dir + os.environ["DOCLING_HASH_INDEX_DB"]) if "DOCLING_HASH_INDEX_DB" in os.environ else (os.path.splitext(DOCLING_HASH_IMAGESTORE)[0] + ".sqlite") # doc store folder per binary hash of parsed documents
 FILES_DB = parent_dir + os.environ.get("FILES_DB")
 DOC_NAME_METADATA= os.environ.get("DOC_NAME_METADATA")
 
+# staged ingestion pipeline: docling parsing in processes, chunking in threads, embedding + insertion as async tasks
+INGEST_PARSE_WORKERS= int(os.environ.get("INGEST_PARSE_WORKERS", "2"))
+INGEST_CHUNK_WORKERS= int(os.environ.get("INGEST_CHUNK_WORKERS", "4"))
+INGEST_STORE_WORKERS= int(os.environ.get("INGEST_STORE_WORKERS", "2"))
+INGEST_STAGE_QUEUE_SIZE= int(os.environ.get("INGEST_STAGE_QUEUE_SIZE", "4")) # documents waiting between two stages
+INGEST_JOB_STATUS_TTL= int(os.environ.get("INGEST_JOB_STATUS_TTL", "604800")) # seconds the status of a finished batch job is kept
+INGEST_JOB_CLAIM_IDLE= float(os.environ.get("INGEST_JOB_CLAIM_IDLE", "60")) # seconds before a job of a crashed backend is picked up again
+INGEST_JOB_MAX_ATTEMPTS= int(os.environ.get("INGEST_JOB_MAX_ATTEMPTS", "3"))
+DOCLING_SHARD_PAGES= int(os.environ.get("DOCLING_SHARD_PAGES", "0")) # pdfs with more pages are parsed as page ranges of this size in parallel, 0 disables
+DOCLING_PAGE_IMAGES= os.environ.get("DOCLING_PAGE_IMAGES", "eager") # eager: write page pngs while parsing, lazy: render them on the first request to /doc_store
+DOCLING_PNG_WRITE_WORKERS= int(os.environ.get("DOCLING_PNG_WRITE_WORKERS", "8"))
+DOC_STORE_RENDER_CACHE_MB= int(os.environ.get("DOC_STORE_RENDER_CACHE_MB", "256")) # page images rendered from docling json kept in memory
+DOCLING_PREWARM= os.environ.get("DOCLING_PREWARM", "true").lower() == "true" # start the parse workers and load the docling models on startup
+
+# Milvus connection pool (one entry per credential, root TOKEN always kept)
+MILVUS_POOL_MAX_CLIENTS= int(os.environ.get("MILVUS_POOL_MAX_CLIENTS", "16"))
+MILVUS_POOL_HEALTH_INTERVAL= float(os.environ.get("MILVUS_POOL_HEALTH_INTERVAL", "60"))
+
 # choose llm serving backend
 BACKEND= os.getenv("BACKEND")
 EMBED_BACKEND_URL= ""
@@ -63,6 +86,21 @@ if BACKEND=="ollama":
 elif BACKEND=="vllm":
   EMBED_BACKEND_URL= os.environ.get("VLLM_EMBED_URL")
 
+# shared http clients towards the embedding and rerank backends (per backend port)
+HTTP_MAX_CONNECTIONS= int(os.environ.get("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE= int(os.environ.get("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_KEEPALIVE_EXPIRY= float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT= float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT= float(os.environ.get("HTTP_READ_TIMEOUT", "300"))
+HTTP_POOL_TIMEOUT= float(os.environ.get("HTTP_POOL_TIMEOUT", "60"))
+HTTP2_ENABLED= os.environ.get("HTTP2_ENABLED", "false").lower() == "true"
+
+# embedding scheduler per embedding backend (vLLM port), query embeddings are served before ingestion batches
+EMBED_MAX_CONCURRENCY= int(os.environ.get("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_QUERY_RESERVED= int(os.environ.get("EMBED_QUERY_RESERVED", "1")) # slots ingestion can not take
+EMBED_MAX_RETRIES= int(os.environ.get("EMBED_MAX_RETRIES", "3"))
+EMBED_RETRY_BACKOFF= float(os.environ.get("EMBED_RETRY_BACKOFF", "0.5")) # seconds, doubled per retry
+
 MODEL_EMBED_SMALL= os.environ.get("MODEL_EMBED_SMALL")
 MODEL_EMBED_BIG= os.environ.get("MODEL_EMBED_BIG")
 EMBEDDING_GEMMA_DIM = int(os.environ.get("EMBEDDING_GEMMA_DIM", "768"))
@@ -70,6 +108,27 @@ EMBEDDING_GEMMA_BATCH = int(os.environ.get("EMBEDDING_GEMMA_BATCH", "8"))
 EMBEDDING_GEMMA_TOPK = int(os.environ.get("EMBEDDING_GEMMA_TOPK", "3"))
 MODEL_RERANK= os.getenv("MODEL_RERANK")
 
+# query embedding cache (in-process LRU, optional redis tier shared by all workers)
+EMBED_CACHE_SIZE= int(os.environ.get("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_TTL= float(os.environ.get("EMBED_CACHE_TTL", "86400"))
+EMBED_CACHE_REDIS= os.environ.get("EMBED_CACHE_REDIS", "true").lower() == "true"
+
+# semantic answer cache per collection (invalidated on ingestion into the collection)
+ANSWER_CACHE_ENABLED= os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIZE= int(os.environ.get("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL= float(os.environ.get("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_THRESHOLD= float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.97"))
+
+# federated retrieval of one question over several collections
+FEDERATED_LATENCY_BUDGET= float(os.environ.get("FEDERATED_LATENCY_BUDGET", "8")) # seconds for embedding, search and merge, collections answering later are left out
+FEDERATED_MERGE= os.environ.get("FEDERATED_MERGE", "rerank") # rerank: rerank the RRF fused candidates of all collections, rrf: keep the RRF order
+FEDERATED_RRF_K= int(os.environ.get("FEDERATED_RRF_K", "60"))
+
+# stateless batch queries (offline evaluation, bulk Q&A)
+BATCH_QUERY_MAX_QUESTIONS= int(os.environ.get("BATCH_QUERY_MAX_QUESTIONS", "256"))
+BATCH_QUERY_SEARCH_SIZE= int(os.environ.get("BATCH_QUERY_SEARCH_SIZE", "16")) # questions per multi-vector hybrid search
+BATCH_QUERY_CONCURRENCY= int(os.environ.get("BATCH_QUERY_CONCURRENCY", "4")) # concurrent reranks and answer generations of one batch
+
 valid_embedding_models = {"snowflake-arctic-embed2", "nomic-embed-text", "qwen3_embed", "embeddinggemma"}
 
 if MODEL_EMBED_BIG not in valid_embedding_models:
@@ -155,6 +214,7 @@ milvus_text_template="{metadata_str} \n{content}"
 SECTIONS_TO_REMOVE=["index"]
 
 citation_header= "\n\n" + "## Citations:"
+CITATION_TTL= int(os.environ.get("CITATION_TTL", "10800")) # seconds the structured citations of an answer are served by /citations/{interaction_id}
 
 # tokenizer default for sentence splitter (use as a proxy for actual tokenizer to get token length of a string)
 dummy_model= 'gpt-3.5-turbo' 
@@ -2,10 +2,10 @@ from app.Ingestion_workflows.docling_parse_process import Docling_parser
 from app.Ingestion_workflows.milvus_ingest import ingest2milvus
 from app.RAG_workflows.citation_engine import CitationQueryEngineWorkflow
 from app.auth import password_verify
-from app.config import (USER_DB_PATH, USER_COLLECTION_MAPPING, MILVUS_URI, TOKEN,BACKEND_FASTAPI_LOG, RETRIEVAL_LOG_PATH, USER_HISTORY, CHAT_STORE_PATH,
+from app.config import (USER_DB_PATH, USER_COLLECTION_MAPPING, MILVUS_URI, TOKEN,BACKEND_FASTAPI_LOG, CHAT_STORE_PATH,
                          MILVUS_ROOT_ROLE, BACKEND, VLLM_GEN_URL, GEN_CONTEXT_WINDOW, FILES_DB, FASTAPI_URL, col_mod, topk_mod, dim_mod, collection_type,
-                           systemprompt, citation_header)
-from app.utils.utils_LLM import milvus_hybrid_retrieve, cite, log_retrievals 
+                           systemprompt, citation_header, EMBED_CACHE_REDIS, ANSWER_CACHE_ENABLED, CITATION_TTL, BATCH_QUERY_MAX_QUESTIONS, BATCH_QUERY_CONCURRENCY)
+from app.utils.utils_LLM import milvus_hybrid_retrieve, federated_retrieve, batch_retrieve, embed_query, cite, log_retrievals 
 from app.utils.utils_auth import (
     user_auth_format,
     write_json,
@@ -15,14 +15,25 @@ from app.utils.utils_auth import (
     decode_jwt_token,
     AuthenticatedUser,
 )
-from app.utils.utils_backend import deserialize, cleanup_expired_sessions, check_chat_history_db, check_empty_chats
+from app.utils.utils_backend import cleanup_expired_sessions, check_chat_history_db, check_empty_chats
 from app.utils.utils_ingestion import FileUploadValidator, milvus_db_as_excel, ingest, get_doc_in_collection, check_admin
+from app.utils.utils_ingestion_jobs import ingestion_jobs, INGEST_STATUS_QUEUED
+from app.utils.utils_ingestion_pipeline import ingestion_pipeline
+from app.utils.utils_cache import embedding_cache, answer_cache
+from app.utils.utils_chat_history import chat_history_store
+from app.utils.utils_conversations import conversation_index
+from app.utils.utils_doc_store import DocStoreFiles
+from app.utils.utils_embed_scheduler import embedding_scheduler
+from app.utils.utils_http import close_http_clients
 from app.utils.utils_logging import initialize_logging, logger
+from app.utils.utils_milvus import MilvusClientPool
+from app.utils.utils_retrieval_log import retrieval_log_store
 from app.utils.utils_req_templates import (
     session_start_req,
     Message_request,
     Ingest_req,
     BatchIngestReq,
+    BatchQueryReq,
     change_col,
     Logout_req,
     change_session,
@@ -30,28 +41,26 @@ from app.utils.utils_req_templates import (
 )
 from contextlib import asynccontextmanager
 from fastapi import Depends
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi_utils.timing import add_timing_middleware
 from llama_index.core import Settings
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.storage.chat_store import SimpleChatStore
 from llama_index.llms.ollama import Ollama
 from llama_index.llms.openai_like import OpenAILike
-from pymilvus import MilvusClient
 from redis.asyncio import Redis
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Dict, List, Optional
 from uuid import uuid4
 import asyncio
 import copy
+import dataclasses
 import httpx
 import json
 import os
-import pickle
 import shutil
-import pandas as pd
 
 DOC_STORE_DIR = "/doc_store"
 import jwt
@@ -62,121 +71,8 @@ initialize_logging(BACKEND_FASTAPI_LOG)
 #global variables
 MODEL = os.getenv("MODEL", "llama3.2")
 validator = FileUploadValidator(max_size_mb=50)
-
-INGEST_STATUS_QUEUED = "queued"
-INGEST_STATUS_PROCESSING = "processing"
-INGEST_STATUS_COMPLETED = "completed"
-INGEST_STATUS_FAILED = "failed"
-
-
-async def _register_ingestion_job(
-    app: FastAPI, job_id: str, filename: str, conv_id: str, ingest_collection: str
-) -> None:
-    """Store initial queued status for a new ingestion job"""
-    async with app.state.ingestion_status_lock:
-        app.state.ingestion_status.append(
-            {
-                "job_id": job_id,
-                "filename": filename,
-                "conv_id": conv_id,
-                "ingest_collection": ingest_collection,
-                "status": INGEST_STATUS_QUEUED,
-                "message": "Waiting",
-            }
-        )
-
-
-async def _update_ingestion_job(app: FastAPI, job_id: str, **updates: Any) -> None:
-    """Update status data for a specific job"""
-    async with app.state.ingestion_status_lock:
-        for job in app.state.ingestion_status:
-            if job["job_id"] == job_id:
-                job.update(updates)
-                break
-
-
-async def process_ingestion_job(app: FastAPI, job: Dict[str, Any]) -> str:
-    """Process a single ingestion job sequentially"""
-    file_path: str = job["file"]
-    ingest_collection: str = job["ingest_collection"]
-    user_name: str = job["user_name"]
-    conv_id: str = job["conv_id"]
-    milvus_password: str = job["milvus_password"]
-
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-
-    is_valid, message = validator.validate_file(file_path)
-    if not is_valid:
-        raise ValueError(message)
-
-    if not os.path.exists(FILES_DB):
-        os.mkdir(FILES_DB)
-
-    filename = os.path.basename(file_path)
-    destination = os.path.join(FILES_DB, filename)
-    if os.path.exists(destination):
-        base, ext = os.path.splitext(filename)
-        destination = os.path.join(FILES_DB, f"{base}_{uuid4().hex}{ext}")
-
-    shutil.copy(file_path, destination)
-    parsing_obj = Docling_parser()
-    parsed_doc = parsing_obj.docling_ingest(file=destination, collection_name=ingest_collection)
-    response, ingest_message = await ingest(
-        parsed_doc=parsed_doc,
-        file=destination,
-        user_name=user_name,
-        ingest_collection=ingest_collection,
-        user_milvus_pass=milvus_password,
-        conv_id=conv_id,
-    )
-    if not response:
-        raise RuntimeError(ingest_message)
-    return ingest_message
-
-
-async def ingestion_worker(app: FastAPI) -> None:
-    """Background worker that consumes ingestion jobs one at a time"""
-    while True:
-        job: Dict[str, Any] = await app.state.ingestion_queue.get()
-        job_id = job["job_id"]
-        try:
-            await _update_ingestion_job(app, job_id, status=INGEST_STATUS_PROCESSING, message="Processing")
-            result_message = await process_ingestion_job(app, job)
-            await _update_ingestion_job(
-                app,
-                job_id,
-                status=INGEST_STATUS_COMPLETED,
-                message=result_message or "Ingestion successful",
-            )
-        except Exception as exc:
-            logger.error(
-                "Batch ingestion failed for %s in conversation %s: %s",
-                job.get("filename"),
-                job.get("conv_id"),
-                str(exc),
-                exc_info=True,
-            )
-            await _update_ingestion_job(
-                app,
-                job_id,
-                status=INGEST_STATUS_FAILED,
-                message=str(exc),
-            )
-        finally:
-            app.state.ingestion_queue.task_done()
-
-
-async def enqueue_ingestion_job(app: FastAPI, job: Dict[str, Any]) -> None:
-    """Add a job to the queue and initialize its status"""
-    await _register_ingestion_job(
-        app,
-        job["job_id"],
-        job["filename"],
-        job["conv_id"],
-        job["ingest_collection"],
-    )
-    await app.state.ingestion_queue.put(job)
+# latest persistence task of every conversation, answered turns are written after the response
+_persisting: Dict[str, asyncio.Task] = {}
 
 # Security dependency
 bearer_scheme = HTTPBearer(auto_error=False)
@@ -200,25 +96,33 @@ async def lifespan(app: FastAPI):
     logger.info(f" Initializing {BACKEND} and Redis")
     # decode responses is False as manual decoding is necessary for some of the redis "get" commands
     app.state.redis = Redis(host='localhost', port=6379, db=0, decode_responses=False)
-    app.state.ingestion_queue = asyncio.Queue()
-    app.state.ingestion_status = []
-    app.state.ingestion_status_lock = asyncio.Lock()
-    app.state.ingestion_worker = asyncio.create_task(ingestion_worker(app))
+    # long lived Milvus connections for the root token and every user credential
+    app.state.milvus_pool = MilvusClientPool(uri=MILVUS_URI, root_token=TOKEN)
+    retrieval_log_store.start()
+    if EMBED_CACHE_REDIS:
+        embedding_cache.attach_redis(app.state.redis)
+    answer_cache.attach_redis(app.state.redis)
+    # batch ingestion jobs persist in redis, jobs of a previous run are resumed by the pipeline
+    await ingestion_jobs.start(app.state.redis)
+    ingestion_pipeline.start(ingestion_jobs, milvus_pool=app.state.milvus_pool)
     if BACKEND=="ollama":
         Settings.llm = Ollama(model=MODEL, request_timeout=300.0, temperature=0)
     elif BACKEND=="vllm":
         Settings.llm = OpenAILike(model=MODEL, api_base=VLLM_GEN_URL, api_key="random", temperature=0.1, timeout=180.0, context_window=GEN_CONTEXT_WINDOW, is_chat_model=True)
-    user_history_db= Docling_parser.get_store(path=USER_HISTORY)
     # set chat store path and user-session tracker
     await app.state.redis.set("chat_store_path", CHAT_STORE_PATH)
-    await app.state.redis.set("conversations", json.dumps(user_history_db))
+    await conversation_index.load(app.state.redis)
+    conversation_index.start(app.state.redis)
     asyncio.create_task(cleanup_expired_sessions(app.state.redis))
     yield
-    app.state.ingestion_worker.cancel()
-    try:
-        await app.state.ingestion_worker
-    except asyncio.CancelledError:
-        pass
+    # turns answered right before shutdown are still written
+    await asyncio.gather(*_persisting.values(), return_exceptions=True)
+    await ingestion_pipeline.close()
+    await ingestion_jobs.close()
+    await retrieval_log_store.close()
+    await conversation_index.close(app.state.redis)
+    await app.state.milvus_pool.close()
+    await close_http_clients()
     await app.state.redis.aclose()
 
 app = FastAPI(
@@ -240,8 +144,10 @@ app.add_middleware(
 
 add_timing_middleware(app, record=logger.info, prefix="timing")
 if os.path.isdir(DOC_STORE_DIR):
-    app.mount("/doc_store", StaticFiles(directory=DOC_STORE_DIR), name="doc_store")
+    doc_store_files = DocStoreFiles(directory=DOC_STORE_DIR)
+    app.mount("/doc_store", doc_store_files, name="doc_store")
 else:
+    doc_store_files = None
     logger.warning("Doc store directory %s not found; static mount disabled", DOC_STORE_DIR)
 
 @app.get("/")
@@ -257,6 +163,16 @@ def health() -> Dict[str, str]:
     return {"health": "ok"}
 
 
+@app.get("/cache_stats")
+def cache_stats(current_user: AuthenticatedUser = Depends(get_current_user)) -> Dict[str, Any]:
+    """ Hit/miss counters of the in-process caches and embedding scheduler load of this worker
+    """
+    if not current_user.admin:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return {"embedding_cache": embedding_cache.stats(), "answer_cache": answer_cache.stats(), "embedding_scheduler": embedding_scheduler.stats(),
+            "doc_store_render_cache": doc_store_files.cache.stats() if doc_store_files else {}}
+
+
 @app.post("/create_user")
 async def create_user(
     request: user_auth_format,
@@ -314,108 +230,191 @@ async def start_conversation(
         raise HTTPException(status_code=403, detail="Cannot start session for another user")
 
     logger.info(" Initializing session: %s for user %s", request.conv_id, request.username)
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
     user_collection_db= Docling_parser.get_store(path=USER_COLLECTION_MAPPING)
-    list_of_conversations=[conv_id for conversations in conversations_dict.values() for conv_id in conversations]
-    if request.conv_id in list_of_conversations:
+    # register the conversation for the user, atomic so concurrent logins can not take the same id or lose an update
+    if not await conversation_index.add(redis, request.username, request.conv_id):
         logger.error(f"Invalid session: {request.conv_id}.  Already present in DB")
         raise HTTPException(status_code=401, detail="Invalid conv id. Already present in DB.")
-    # Initialize the chat store 
-    chat_store = SimpleChatStore()
-    # initialise memory buffer and serialise it
-    memory = ChatMemoryBuffer.from_defaults(
-        token_limit=14000,
-        chat_store=chat_store,
-        chat_store_key=request.conv_id,
-    )
-    serialized_memory = pickle.dumps(memory)
-    # store for each session, the username, password, chatstore and memory in redis
+    # store for each session, the username, password and collections in redis, the chat history is kept in the chat:{conv_id} list
     # TODO password encryption to make it secure
     session_data= {
         "user_id": request.username,
         "password": request.password,
-        "memory": serialized_memory,
         "read_collection": user_collection_db[request.username],
         "ingest_collection": ""
     }
     await redis.hset(f"session:{request.conv_id}",mapping= session_data)
     await redis.expire(f"session:{request.conv_id}", 10800)
     logger.info("Successfully set up session variables in Redis for session: %s ", request.conv_id)
-    # persist the new chat store for the user in the appropriate directory with name as conv id
-    deserialized_chat_store= deserialize(serialized_memory)
-    deserialized_chat_store= deserialized_chat_store.chat_store
-    chat_store_path= await redis.get("chat_store_path")
-    chat_store_path= chat_store_path.decode('utf-8')
-    deserialized_chat_store.persist(persist_path=chat_store_path.format(user= request.username, conv_id= request.conv_id))
-    # check if new user, then create new entry in conversations dict and finally append the new session id
-    if request.username not in conversations_dict:
-        conversations_dict[request.username]=[]
-    conversations_dict[request.username].append(request.conv_id)
-    await redis.set("conversations", json.dumps(conversations_dict))
-    # persist the conversation tracker
-    with open(USER_HISTORY, 'w') as fp:
-        json.dump(conversations_dict, fp)
+    # create the empty chat history file for the user in the appropriate directory with name as conv id
+    chat_history_store.create(request.username, request.conv_id)
     logger.info("Started session: %s", request.conv_id)
     return {"message": f"Conversation {request.conv_id} started", "user_collection": user_collection_db[request.username]}
 
+async def check_conversation_access(session_id_user: str, request: Message_request, redis: Redis, current_user: AuthenticatedUser) -> str:
+    """ Check that the current user may write to the conversation of the request and that it exists, returns the user of the session
+    """
+    user_name_current= session_id_user.split("$")[1]
+    if user_name_current != current_user.username and not current_user.admin:
+        raise HTTPException(status_code=403, detail="Unauthorized session access")
+    if not await conversation_index.contains(redis, user_name_current, request.conv_id):
+        logger.error(f"Conversation not found for session: {request.conv_id}", exc_info=True)
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return user_name_current
+
+def check_collection_access(current_user: AuthenticatedUser, collections: Optional[List[str]]):
+    """ Check that the current user was granted every requested collection (collections claim of the JWT), admins may read all collections
+    """
+    if not collections or current_user.admin:
+        return
+    denied= [name for name in dict.fromkeys(collections) if name not in current_user.collections]
+    if denied:
+        logger.warning("User %s denied access to collections: %s", current_user.username, ", ".join(denied))
+        raise HTTPException(status_code=403, detail=f"No access to collections: {', '.join(denied)}")
+
+async def load_session(conv_id: str, user_name_current: str, redis: Redis, current_user: AuthenticatedUser, question: Optional[str]= None, collections: Optional[List[str]]= None):
+    """ Get read collections, top k and chat memory of a session. The memory and the embeddings of the question (if given, once per embedding model
+        of the read collections) are loaded concurrently
+
+    Args:
+        current_user: user of the request, must be granted every collection of collections
+        collections: collections to read for this message (federated retrieval), the read collection of the session if not given
+
+    Returns:
+        read collections, top_k, memory, number of messages loaded into memory, question embeddings by embedding model (empty without question)
+    """
+    # note: change TOKEN to password from user to login into milvus client
+    collection= await redis.hget(f"session:{conv_id}", "read_collection")
+    if not collection:
+        logger.error(f"Invalid or expired session: {conv_id}")
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+    # access first, so users can not probe which collections exist
+    check_collection_access(current_user, collections)
+    read_collections= list(dict.fromkeys(collections)) if collections else [collection.decode('utf-8')]
+    unknown= [name for name in read_collections if name not in col_mod]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown collections: {', '.join(unknown)}")
+    top_k= max(topk_mod[col_mod[name]] for name in read_collections)
+    models= list(dict.fromkeys(col_mod[name] for name in read_collections)) if question is not None else []
+    # get responses after initialising engine with the latest messages of the session
+    await wait_for_persisted(conv_id)
+    (memory, loaded_count), *question_embeddings= await asyncio.gather(chat_history_store.load_memory(redis, user_name_current, conv_id),
+                                                                       *(embed_query(question=question, model=model) for model in models))
+    return read_collections, top_k, memory, loaded_count, dict(zip(models, question_embeddings))
+
+async def retrieve(question: str, read_collections: List[str], top_k: int, question_embeddings: Dict[str, List[List[float]]]):
+    """ Retrieve and rerank the sources of a question from the read collections of a session, fanned out if there are several """
+    if len(read_collections) > 1:
+        return await federated_retrieve(uri=MILVUS_URI, token=TOKEN, question=question, collections=read_collections, k=top_k,
+                                        milvus_pool=app.state.milvus_pool, question_embeddings=question_embeddings)
+    collection= read_collections[0]
+    return await milvus_hybrid_retrieve(uri=MILVUS_URI,token=TOKEN, question=question, collection_name=collection, model= col_mod[collection], k=top_k,
+                                        milvus_pool=app.state.milvus_pool, question_dense_embeddings=question_embeddings.get(col_mod[collection]))
+
+async def store_citations(redis: Redis, interaction_id: str, user: str, conv_id: str, citations: List[Dict[str, Any]]):
+    """ Keep the citation records of an interaction for CITATION_TTL seconds, served by /citations/{interaction_id} """
+    await redis.set(f"citations:{interaction_id}", json.dumps({"user": user, "conv_id": conv_id, "citations": citations}), ex=CITATION_TTL)
+
+async def record_interaction(redis: Redis, interaction_id: str, user: str, conv_id: str, question: str, collection: str, response_text: str,
+                             retrievals: List, results: List, match: List[int], citations: List[Dict[str, Any]]):
+    """ Store the citations of an answer and log its retrievals, failures are logged and do not fail the answer """
+    try:
+        await store_citations(redis, interaction_id, user, conv_id, citations)
+        # log current retrieval into the retrieval log store for observability
+        await log_retrievals(retrievals= retrievals, question=question, user= user, session_id=conv_id, collection_name= collection, LLM_response=response_text, citations= match, reranked_results=results, interaction_id=interaction_id)
+    except Exception as e:
+        logger.error(f"error on retrieval logging: {str(e)} for session: {conv_id}",exc_info=True)
+
+def answer_cacheable(read_collections: List[str], memory: ChatMemoryBuffer) -> bool:
+    """ Answers are cached per single collection and only for questions without chat history,
+        the prompt of a follow up question includes the latest messages of its session so its answer is not reusable
+    """
+    return ANSWER_CACHE_ENABLED and len(read_collections) == 1 and not memory.get_all()
+
+def persist_in_background(conv_id: str, *writes: Awaitable):
+    """ Write an answered turn (chat history, citations, retrieval log) without keeping the response waiting for it.
+        Writes of one conversation run in order, failures are logged
+    """
+    previous= _persisting.get(conv_id)
+
+    async def run():
+        if previous is not None:
+            await asyncio.wait([previous])
+        for result in await asyncio.gather(*writes, return_exceptions=True):
+            if isinstance(result, BaseException):
+                logger.error("Persisting turn of session %s failed: %s", conv_id, str(result), exc_info=result)
+    task= asyncio.create_task(run())
+    _persisting[conv_id]= task
+    task.add_done_callback(lambda done: _persisting.pop(conv_id) if _persisting.get(conv_id) is done else None)
+
+async def wait_for_persisted(conv_id: str):
+    """ Wait until the previous turn of a conversation is written, so a quick follow up sees it in its memory """
+    task= _persisting.get(conv_id)
+    if task is not None:
+        await asyncio.wait([task])
+
+def sse_event(event: str, data: Any) -> str:
+    """ Format one server-sent event, data is json encoded so tokens with line breaks stay in one event """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/conversation/{session_id_user}/message")
 async def add_message(
     session_id_user: str,
     request: Message_request,
     redis: Redis = Depends(lambda: app.state.redis),
     current_user: AuthenticatedUser = Depends(get_current_user),
+    response: Response = None,
 ) -> str:
     """ This function for a particular conversation id, sends the message to the "Chat engine" LLM object which generates the response and updates the chat memory.
-        Then it returns the response back to API and saves the updated chat store locally. 
+        Then it returns the response back to API, the updated chat store is saved in the background (persist_in_background).
+        The id of the logged interaction is returned in the X-Interaction-Id header, clients send it back with feedback.
+        With several collections in the request, the question is answered from all of them at once (see federated_retrieve).
     """
     logger.info(" User message to bot for session: %s, message:%s", request.conv_id, request.message)
-    user_name_current= session_id_user.split("$")[1]
-    if user_name_current != current_user.username and not current_user.admin:
-        raise HTTPException(status_code=403, detail="Unauthorized session access")
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
-    if request.conv_id not in conversations_dict[user_name_current]:
-        logger.error(f"Conversation not found for session: {request.conv_id}", exc_info=True)
-        raise HTTPException(status_code=404, detail="Conversation not found")
+    user_name_current= await check_conversation_access(session_id_user, request, redis, current_user)
     try:
-        # note: change TOKEN to password from user to login into milvus client
-        collection= await redis.hget(f"session:{request.conv_id}", "read_collection")
-        collection= collection.decode('utf-8')
-        top_k= topk_mod[col_mod[collection]]
-        retrievals, results = await milvus_hybrid_retrieve(uri=MILVUS_URI,token=TOKEN, question=request.message, collection_name=collection, model= col_mod[collection], k=top_k)
-        logger.info("For session: %s and collection: %s, %s relevant sources found", request.conv_id, collection, len(results))
-        # get responses after initialising engine with latest memory for the session
-        memory= await redis.hget(f"session:{request.conv_id}", "memory")
-        if not memory:
-            logger.error(f"Invalid or expired session: {request.conv_id}")
-            raise HTTPException(status_code=401, detail="Invalid or expired session")
-        memory= deserialize(memory)
-        model = CitationQueryEngineWorkflow(LLM=Settings.llm, memory=memory, system_prompt=systemprompt[collection])
-        response = await model.run(query=request.message, results=results)
-        logger.debug("For session: %s, model responded : %s", request.conv_id, str(response))
-        # serialise latest momory and chat store objects and store them per session to update session variables
-        re_serialized_memory= pickle.dumps(model.memory)
-        await redis.hset(f"session:{request.conv_id}", "memory", re_serialized_memory)
-        # persist updated chatstore with latest user and bot message
-        chat_store_path= await redis.get("chat_store_path")
-        chat_store_path= chat_store_path.decode('utf-8')
-        deserialized_chat_store= deserialize(re_serialized_memory)
-        deserialized_chat_store= deserialized_chat_store.chat_store
-        deserialized_chat_store.persist(persist_path=chat_store_path.format(user= user_name_current, conv_id= request.conv_id))
-        try: 
-            final_response, match= cite(response, top_k=top_k, conv_id=request.conv_id, reranked_list=results)
-        except Exception as e: 
-            logger.error("Error while creating citations for session: %s. Error: : %s", request.conv_id, str(e))
-            match=[]
-            final_response= response.response
-        try:
-            # log current retrieval into csv for observability
-            await log_retrievals(retrievals= retrievals, question=request.message, user= user_name_current, session_id=request.conv_id, collection_name= collection, LLM_response=response.response, citations= match, reranked_results=results)
-        except Exception as e:
-            logger.error(f"error on retrieval logging: {str(e)} for session: {request.conv_id}",exc_info=True)
-            pass
+        read_collections, top_k, memory, loaded_count, question_embeddings= await load_session(request.conv_id, user_name_current, redis, current_user, question=request.message, collections=request.collections)
+        collection= "+".join(read_collections)
+        cacheable= answer_cacheable(read_collections, memory)
+        question_embedding= question_embeddings[col_mod[read_collections[0]]]
+        cached_answer= await answer_cache.get(collection, question_embedding) if cacheable else None
+        if cached_answer:
+            # near identical question already answered on this collection version: skip retrieval and generation
+            logger.info("For session: %s and collection: %s, serving cached answer", request.conv_id, collection)
+            retrievals, results= cached_answer["retrievals"], cached_answer["results"]
+            response_text, final_response, match= cached_answer["response"], cached_answer["final_response"], cached_answer["citations"]
+            citations= cached_answer.get("citation_records", [])
+            memory.put(ChatMessage(content=request.message, role=MessageRole.USER))
+            memory.put(ChatMessage(content=response_text, role=MessageRole.ASSISTANT))
+        else:
+            retrievals, results = await retrieve(request.message, read_collections, top_k, question_embeddings)
+            logger.info("For session: %s and collection: %s, %s relevant sources found", request.conv_id, collection, len(results))
+            model = CitationQueryEngineWorkflow(LLM=Settings.llm, memory=memory, system_prompt=systemprompt[read_collections[0]])
+            llm_response = await model.run(query=request.message, results=results)
+            logger.debug("For session: %s, model responded : %s", request.conv_id, str(llm_response))
+            memory= model.memory
+            response_text= llm_response.response
+            try: 
+                final_response, match, citations= cite(llm_response, top_k=top_k, conv_id=request.conv_id, reranked_list=results)
+            except Exception as e: 
+                logger.error("Error while creating citations for session: %s. Error: : %s", request.conv_id, str(e))
+                match, citations= [], []
+                final_response= llm_response.response
+            if cacheable and match:
+                # only grounded answers with citations are reused for other sessions
+                await answer_cache.set(collection, question_embedding, {"retrievals": retrievals, "results": results, "response": response_text, "final_response": final_response, "citations": match, "citation_records": citations})
+        interaction_id= str(uuid4())
+        if response is not None:
+            response.headers["X-Interaction-Id"]= interaction_id
+        # append the new user and bot message to the session history and record the interaction after responding
+        persist_in_background(
+            request.conv_id,
+            chat_history_store.save_turn(redis, user_name_current, request.conv_id, memory, loaded_count),
+            record_interaction(redis, interaction_id, user_name_current, request.conv_id, request.message, collection, response_text, retrievals, results, match, citations),
+        )
         return final_response
+    except HTTPException:
+        raise
     except httpx.ConnectError as e:
         logger.error(str(e)+ f" for session: {request.conv_id}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error communicating with Ollama, make sure it is running in the background: {str(e)}")
@@ -424,13 +423,142 @@ async def add_message(
         raise Exception(f"Error: {str(e)}, please try again later")
 
 
+@app.post("/conversation/{session_id_user}/message/stream")
+async def add_message_stream(
+    session_id_user: str,
+    request: Message_request,
+    redis: Redis = Depends(lambda: app.state.redis),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> StreamingResponse:
+    """ Streaming variant of add_message as server-sent events.
+        "token" events carry the LLM output while it is generated, then a "citations" event carries the citation block appended by cite()
+        and a final "done" event the interaction id (also in the X-Interaction-Id header) and the structured citation records. Errors after the stream started are sent as "error" event.
+        Memory and chat store of the session are persisted in the background once the stream completed.
+    """
+    logger.info(" User message to bot (streaming) for session: %s, message:%s", request.conv_id, request.message)
+    user_name_current= await check_conversation_access(session_id_user, request, redis, current_user)
+    read_collections, top_k, memory, loaded_count, question_embeddings= await load_session(request.conv_id, user_name_current, redis, current_user, question=request.message, collections=request.collections)
+    collection= "+".join(read_collections)
+    cacheable= answer_cacheable(read_collections, memory)
+    question_embedding= question_embeddings[col_mod[read_collections[0]]]
+    interaction_id= str(uuid4())
+
+    async def event_stream():
+        try:
+            cached_answer= await answer_cache.get(collection, question_embedding) if cacheable else None
+            if cached_answer:
+                logger.info("For session: %s and collection: %s, serving cached answer", request.conv_id, collection)
+                retrievals, results= cached_answer["retrievals"], cached_answer["results"]
+                response_text, final_response, match= cached_answer["response"], cached_answer["final_response"], cached_answer["citations"]
+                citations= cached_answer.get("citation_records", [])
+                yield sse_event("token", response_text)
+            else:
+                retrievals, results = await retrieve(request.message, read_collections, top_k, question_embeddings)
+                logger.info("For session: %s and collection: %s, %s relevant sources found", request.conv_id, collection, len(results))
+                model = CitationQueryEngineWorkflow(LLM=Settings.llm, memory=memory, system_prompt=systemprompt[read_collections[0]], streaming=True)
+                stream = await model.run(query=request.message, results=results)
+                async for token in stream.async_response_gen():
+                    yield sse_event("token", token)
+                llm_response= await stream.get_response()
+                response_text= llm_response.response
+                try: 
+                    final_response, match, citations= cite(llm_response, top_k=top_k, conv_id=request.conv_id, reranked_list=results)
+                except Exception as e: 
+                    logger.error("Error while creating citations for session: %s. Error: : %s", request.conv_id, str(e))
+                    match, citations= [], []
+                    final_response= response_text
+                if cacheable and match:
+                    await answer_cache.set(collection, question_embedding, {"retrievals": retrievals, "results": results, "response": response_text, "final_response": final_response, "citations": match, "citation_records": citations})
+            # cite() only appends to the generated text
+            yield sse_event("citations", final_response[len(response_text):])
+            memory.put(ChatMessage(content=request.message, role=MessageRole.USER))
+            memory.put(ChatMessage(content=response_text, role=MessageRole.ASSISTANT))
+            # scheduled before the last event so a client closing the stream on "done" does not cancel it
+            persist_in_background(
+                request.conv_id,
+                chat_history_store.save_turn(redis, user_name_current, request.conv_id, memory, loaded_count),
+                record_interaction(redis, interaction_id, user_name_current, request.conv_id, request.message, collection, response_text, retrievals, results, match, citations),
+            )
+            yield sse_event("done", {"interaction_id": interaction_id, "citations": citations})
+        except Exception as e:
+            logger.error(str(e)+ f" for session: {request.conv_id}", exc_info=True)
+            yield sse_event("error", f"Error: {str(e)}, please try again later")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"X-Interaction-Id": interaction_id, "Cache-Control": "no-cache"})
+
+
+@app.post("/batch_query")
+async def batch_query(
+    request: BatchQueryReq,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> List[Dict[str, Any]]:
+    """ Stateless batch of questions to one collection for offline evaluation and bulk Q&A, no chat memory, chat store or retrieval log is touched.
+        Questions are embedded in one request, searched with multi-vector hybrid searches and reranked concurrently (see batch_retrieve).
+        With generate, cited answers are generated concurrently (at most BATCH_QUERY_CONCURRENCY at once), each without chat history.
+
+    Returns:
+        per question: question, results (reranked chunks), answer and citations (None and [] without generate, error if generation failed)
+    """
+    # access first, so users can not probe which collections exist
+    check_collection_access(current_user, [request.collection])
+    if request.collection not in col_mod:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {request.collection}")
+    if not request.questions or len(request.questions) > BATCH_QUERY_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"A batch takes 1 to {BATCH_QUERY_MAX_QUESTIONS} questions")
+    logger.info("Batch query of %s questions to collection %s by user %s", len(request.questions), request.collection, current_user.username)
+    top_k= topk_mod[col_mod[request.collection]]
+    retrieved= await batch_retrieve(uri=MILVUS_URI, token=TOKEN, questions=request.questions, collection_name=request.collection, model=col_mod[request.collection],
+                                    k=top_k, milvus_pool=app.state.milvus_pool)
+    answers= [{"question": question, "results": [dataclasses.asdict(result) for result in results], "answer": None, "citations": []}
+              for question, (_, results) in zip(request.questions, retrieved)]
+    if not request.generate:
+        return answers
+    semaphore= asyncio.Semaphore(max(1, BATCH_QUERY_CONCURRENCY))
+
+    async def generate(answer: Dict[str, Any], results: List):
+        async with semaphore:
+            try:
+                model = CitationQueryEngineWorkflow(LLM=Settings.llm, memory=ChatMemoryBuffer.from_defaults(token_limit=14000), system_prompt=systemprompt[request.collection])
+                llm_response = await model.run(query=answer["question"], results=results)
+                _, _, answer["citations"]= cite(llm_response, top_k=top_k, conv_id="batch_query", reranked_list=results)
+                answer["answer"]= llm_response.response
+            except Exception as e:
+                logger.error("Batch query generation failed for question %s: %s", answer["question"], str(e), exc_info=True)
+                answer["error"]= str(e)
+
+    await asyncio.gather(*(generate(answer, results) for answer, (_, results) in zip(answers, retrieved)))
+    return answers
+
+
+@app.get("/citations/{interaction_id}")
+async def get_interaction_citations(
+    interaction_id: str,
+    redis: Redis = Depends(lambda: app.state.redis),
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> List[Dict[str, Any]]:
+    """ Structured citations of an answer by the interaction id returned with it: source, binary_hash, pages, section, document
+        and gallery, the url of the cited pages gallery on /doc_store (null if the document is not in the doc store)
+    """
+    stored= await redis.get(f"citations:{interaction_id}")
+    if stored is None and _persisting:
+        # the answer may have been sent before its citations were stored
+        await asyncio.wait(list(_persisting.values()))
+        stored= await redis.get(f"citations:{interaction_id}")
+    if stored is None:
+        raise HTTPException(status_code=404, detail="No citations for this interaction")
+    stored= json.loads(stored)
+    if stored["user"] != current_user.username and not current_user.admin:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+    return stored["citations"]
+
+
 @app.post("/log_feedback/")
 async def log_feedback(
     request: feedback_model,
     redis: Redis = Depends(lambda: app.state.redis),
     current_user: AuthenticatedUser = Depends(get_current_user),
 ):
-    """ Log feedback for each LLM response in the correponding user log excel
+    """ Log feedback for each LLM response in the retrieval log store of the user
 
     Args:
         session_id_user (str): contains conv id and username merged
@@ -442,21 +570,34 @@ async def log_feedback(
     if user_name_current != current_user.username and not current_user.admin:
         raise HTTPException(status_code=403, detail="Unauthorized access")
     logger.info("Logging user: %s feedback for session: %s", user_name_current, conv_id)
-    retrieval_path= RETRIEVAL_LOG_PATH.format(user= user_name_current)
-    # filter citation from llm response to match it with the LLM response in the logs
-    frontend_LLM_response= request.LLM_response.split(citation_header)[0]
-    if os.path.exists(retrieval_path):
-        try: 
-            df= pd.read_excel(retrieval_path, dtype={"Feedback (like/dislike)": "string", "Feedback (Comments)": "string"})
-            df.loc[(df['chat_session'] == conv_id) & (df['LLM_response'] == frontend_LLM_response), "Feedback (like/dislike)"] = request.feedback
-            df.loc[(df['chat_session'] == conv_id) & (df['LLM_response'] == frontend_LLM_response), "Feedback (Comments)"] = request.feedback_comment
-            df.to_excel(retrieval_path, index=False)
-        except Exception as e: 
-            logger.error("Error: %s while logging feedback for session: %s", str(e), conv_id)
-            return False
-    else: 
+    try: 
+        if request.interaction_id:
+            # single keyed upsert, does not wait for the log writer
+            await retrieval_log_store.set_feedback(interaction_id=request.interaction_id, user=user_name_current,
+                                                   feedback=request.feedback, feedback_comment=request.feedback_comment)
+            return True
+        # older clients without interaction id: filter citation from llm response to match it with the LLM response in the logs
+        frontend_LLM_response= request.LLM_response.split(citation_header)[0]
+        updated= await retrieval_log_store.update_feedback(user=user_name_current, conv_id=conv_id, llm_response=frontend_LLM_response,
+                                                           feedback=request.feedback, feedback_comment=request.feedback_comment)
+    except Exception as e: 
+        logger.error("Error: %s while logging feedback for session: %s", str(e), conv_id)
         return False
-    return True
+    return updated > 0
+
+
+@app.get("/export_retrieval_log/{user}")
+async def export_retrieval_log(
+    user: str,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> Dict[str, str]:
+    """ Write the retrieval log of a user as excel (retrieval_observe_columns layout) to RETRIEVAL_LOG_PATH and return the path
+    """
+    if user != current_user.username and not current_user.admin:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+    path= await retrieval_log_store.export_excel(user=user)
+    logger.info("Exported retrieval log of user %s to %s", user, path)
+    return {"path": path}
 
 
 @app.get("/get_existing_conv_ids/{session_id_user}")
@@ -471,14 +612,11 @@ async def get_existing_conv_id(
     user= session_id_user.split("$")[1]
     if user != current_user.username and not current_user.admin:
         raise HTTPException(status_code=403, detail="Unauthorized session access")
-    init_conversation_list= await redis.get("conversations")
-    init_conversation_list= json.loads(init_conversation_list)
-    if new_conv_id not in init_conversation_list[user]:
+    if not await conversation_index.contains(redis, user, new_conv_id):
         logger.error(f"Conversation not found for session: {new_conv_id}", exc_info=True)
         raise HTTPException(status_code=404, detail="Conversation not found")
     logger.info("Getting existing conversation ids for user: %s on user login", user)
-    user_conv_id=[]
-    user_conv_id=init_conversation_list[user]
+    user_conv_id= await conversation_index.user_conversations(redis, user)
     if not user_conv_id:
         return []
     db_details=await redis.get("chat_store_path")
@@ -508,8 +646,8 @@ async def get_docs(
     read_collection = await redis.hget(f"session:{conv_id}", "read_collection")
     read_collection = read_collection.decode('utf-8')
     logger.info(" Getting available documents to chat for session: %s and collection %s", conv_id, read_collection)
-    doc_in_collection = await get_doc_in_collection(read_collection=read_collection)
-    admin_access = await check_admin(user)
+    doc_in_collection = await get_doc_in_collection(read_collection=read_collection, milvus_pool=app.state.milvus_pool)
+    admin_access = await check_admin(user, milvus_pool=app.state.milvus_pool)
     col_type= collection_type[read_collection]
     return doc_in_collection, admin_access, col_type
 
@@ -540,33 +678,20 @@ async def get_conversation(
         raise HTTPException(status_code=403, detail="Unauthorized session access")
     old_conv_id= request.old_conv_id
     logger.info("User %s toggled to session id: %s", user_name_current, new_conv_id)
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
-    chat_store_path= await redis.get("chat_store_path")
-    chat_store_path= chat_store_path.decode('utf-8')
-    if user_name_current not in conversations_dict:
-        logger.error("404 ERROR: User %s not found. Error in logic", user_name_current)
-        raise HTTPException(status_code=404, detail="User not found")
     # keeping track that the current conv_id is being updated in session tracker
-    if new_conv_id not in conversations_dict[user_name_current]:
+    if not await conversation_index.contains(redis, user_name_current, new_conv_id):
         logger.error("404 ERROR: selected session %s not found", new_conv_id)
         raise HTTPException(status_code=404, detail="Conversation not found")
     key_redis_flag= await redis.exists(f"session:{old_conv_id}")
     if key_redis_flag==0:
         logger.error("404 ERROR: existing session %s not found in redis", old_conv_id)
         raise HTTPException(status_code=404, detail="Existing session not found")
-    chat_store= SimpleChatStore.from_persist_path(persist_path=chat_store_path.format(user= user_name_current, conv_id= new_conv_id))
-    memory = ChatMemoryBuffer.from_defaults(
-        token_limit=14000,
-        chat_store=chat_store,
-        chat_store_key=request.new_conv_id,
-    )
-    serialized_memory = pickle.dumps(memory)
+    # load the selected conversation into its redis history list
+    messages= await chat_history_store.seed(redis, user_name_current, new_conv_id)
     # update redis session state key with the session_id in request header
     # TODO possibly only allow toggling conv ids which are related to the current collection
     await redis.renamenx(f"session:{old_conv_id}", f"session:{new_conv_id}")
-    await redis.hset(f"session:{new_conv_id}", "memory", serialized_memory)
-    return chat_store.json()
+    return chat_history_store.as_chat_store_json(new_conv_id, messages)
 
 @app.post("/ingest_doc_frontend/{session_id_user}/file_name")
 async def ingest_file_frontend(
@@ -580,8 +705,6 @@ async def ingest_file_frontend(
         raise HTTPException(status_code=403, detail="Unauthorized session access")
     logger.info("User: %s ingesting file: %s to collection: %s", user_name, request.file, request.ingest_collection)
     await redis.hset(f"session:{request.conv_id}", "ingest_collection", request.ingest_collection)
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
 
     milvus_username= await redis.hget(f"session:{request.conv_id}", "user_id")
     milvus_password_p2= await redis.hget(f"session:{request.conv_id}", "password")
@@ -591,7 +714,7 @@ async def ingest_file_frontend(
     milvus_username= milvus_username.decode('utf-8')
     milvus_password_p2= milvus_password_p2.decode('utf-8')
     milvus_password= f"{milvus_username}:{milvus_password_p2}"
-    if request.conv_id not in conversations_dict[user_name]:
+    if not await conversation_index.contains(redis, user_name, request.conv_id):
         logger.error("Conversation not found for session: %s", request.conv_id)
         raise HTTPException(status_code=404, detail="Conversation not found")
     is_valid, message = validator.validate_file(request.file)
@@ -609,7 +732,7 @@ async def ingest_file_frontend(
     try:
         parsing_obj= Docling_parser()
         parsed_doc= parsing_obj.docling_ingest(file=new_file, collection_name=request.ingest_collection)
-        response, message= await ingest(parsed_doc=parsed_doc, file=new_file, user_name=user_name, ingest_collection=request.ingest_collection, user_milvus_pass=milvus_password, conv_id=request.conv_id)
+        response, message= await ingest(parsed_doc=parsed_doc, file=new_file, user_name=user_name, ingest_collection=request.ingest_collection, user_milvus_pass=milvus_password, conv_id=request.conv_id, milvus_pool=app.state.milvus_pool)
     except Exception as e: 
         response=False
         message=f"Ingestion unsuccesful: {str(e)} "
@@ -630,9 +753,7 @@ async def change_collection(
     if user_name_current != current_user.username and not current_user.admin:
         raise HTTPException(status_code=403, detail="Unauthorized session access")
     logger.info(" Changing collection name for session: %s to: %s", conv_id, request.read_collection_name)
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
-    if request.conv_id not in conversations_dict[user_name_current]:
+    if not await conversation_index.contains(redis, user_name_current, request.conv_id):
         logger.error(f"Conversation not found for session: {request.conv_id}", exc_info=True)
         raise HTTPException(status_code=404, detail="Conversation not found")
     
@@ -663,8 +784,6 @@ async def ingest_file(
     if user_name != current_user.username and not current_user.admin:
         raise HTTPException(status_code=403, detail="Unauthorized session access")
     await redis.hset(f"session:{request.conv_id}", "ingest_collection", request.ingest_collection)
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
 
     milvus_username= await redis.hget(f"session:{request.conv_id}", "user_id")
     milvus_password_p2= await redis.hget(f"session:{request.conv_id}", "password")
@@ -674,7 +793,7 @@ async def ingest_file(
     milvus_username= milvus_username.decode('utf-8')
     milvus_password_p2= milvus_password_p2.decode('utf-8')
     milvus_password= f"{milvus_username}:{milvus_password_p2}"
-    if request.conv_id not in conversations_dict[user_name]:
+    if not await conversation_index.contains(redis, user_name, request.conv_id):
         logger.error("Conversation not found for session: %s", request.conv_id)
         raise HTTPException(status_code=404, detail="Conversation not found")
     # check user privileges
@@ -726,10 +845,7 @@ async def ingest_batch(
         raise HTTPException(status_code=400, detail="No files provided for ingestion")
 
     await redis.hset(f"session:{request.conv_id}", "ingest_collection", request.ingest_collection)
-    conversations = await redis.get("conversations")
-    conversations_dict = json.loads(conversations)
-
-    if user_name not in conversations_dict or request.conv_id not in conversations_dict[user_name]:
+    if not await conversation_index.contains(redis, user_name, request.conv_id):
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     milvus_username = await redis.hget(f"session:{request.conv_id}", "user_id")
@@ -742,18 +858,16 @@ async def ingest_batch(
     milvus_password_str = milvus_password_p2.decode('utf-8')
     milvus_password = f"{milvus_username_str}:{milvus_password_str}"
 
-    client = MilvusClient(uri=MILVUS_URI, token=TOKEN)
-    try:
-        if MILVUS_ROOT_ROLE not in client.describe_user(user_name=milvus_username_str)["roles"]:
-            logger.error(
-                "Unauthorized ingestion attempted for session: %s and user: %s for collection: %s",
-                request.conv_id,
-                user_name,
-                request.ingest_collection,
-            )
-            raise HTTPException(status_code=401, detail="You are not authorized to ingest documents")
-    finally:
-        client.close()
+    async with app.state.milvus_pool.client(TOKEN) as client:
+        user_description = await asyncio.to_thread(client.describe_user, user_name=milvus_username_str)
+    if MILVUS_ROOT_ROLE not in user_description["roles"]:
+        logger.error(
+            "Unauthorized ingestion attempted for session: %s and user: %s for collection: %s",
+            request.conv_id,
+            user_name,
+            request.ingest_collection,
+        )
+        raise HTTPException(status_code=401, detail="You are not authorized to ingest documents")
 
     queued_jobs: List[Dict[str, str]] = []
     for file_path in request.files:
@@ -775,7 +889,7 @@ async def ingest_batch(
             "ingest_collection": request.ingest_collection,
             "milvus_password": milvus_password,
         }
-        await enqueue_ingestion_job(app, job_payload)
+        await ingestion_jobs.enqueue(job_payload)
         queued_jobs.append({"job_id": job_id, "filename": filename, "status": INGEST_STATUS_QUEUED})
 
     return {"queued_jobs": queued_jobs}
@@ -789,13 +903,7 @@ async def get_ingest_batch_status(
     if not current_user.admin:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
 
-    async with app.state.ingestion_status_lock:
-        status_snapshot = copy.deepcopy(app.state.ingestion_status)
-
-    if conv_id:
-        status_snapshot = [job for job in status_snapshot if job["conv_id"] == conv_id]
-
-    return status_snapshot
+    return await ingestion_jobs.status(conv_id)
 
 @app.post("/create_collection/{collection_name}")
 async def create_collection(
@@ -817,13 +925,12 @@ async def create_collection(
 
     model= col_mod[collection_name]
     dim= dim_mod[model]
-    milvus_client = MilvusClient(uri=MILVUS_URI,token=TOKEN)
-    milvus_client= await ingest2milvus.create_new_collection(milvus_client=milvus_client, dim=dim, collection_name=collection_name)
-    if collection_name in milvus_client.list_collections(): 
-        response= True
-    else: 
-        response= False
-    milvus_client.close()
+    async with app.state.milvus_pool.client(TOKEN) as milvus_client:
+        milvus_client= await ingest2milvus.create_new_collection(milvus_client=milvus_client, dim=dim, collection_name=collection_name)
+        if collection_name in milvus_client.list_collections(): 
+            response= True
+        else: 
+            response= False
     return response
 
 @app.get("/internal_get_vectordb/{collection}")
@@ -833,7 +940,7 @@ async def get_vector_db(
 ):
     if not current_user.admin:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
-    return await milvus_db_as_excel(collection)
+    return await milvus_db_as_excel(collection, milvus_pool=app.state.milvus_pool)
 
 
 @app.post("/logout")
@@ -861,23 +968,20 @@ async def logout(
     # delete session key from redis on logout
     session_data = await redis.hgetall(f"session:{conv_id}")
     if session_data:
-        await redis.delete(f"session:{conv_id}")
+        await redis.delete(f"session:{conv_id}", chat_history_store.prefix + conv_id)
     # if session chat store is empty, remove from conversations and delete chat store entry
     chat_store_path= await redis.get("chat_store_path")
     chat_store_path= chat_store_path.decode('utf-8')
-    conversations= await redis.get("conversations")
-    conversations_dict= json.loads(conversations)
-    conversation_id_list= copy.deepcopy(conversations_dict[username])
+    conversation_id_list= await conversation_index.user_conversations(redis, username)
     try:
+        empty_conv_ids= []
         for id in conversation_id_list:
             chat_store= chat_store_path.format(user= username, conv_id= id)
             empty_chat= check_empty_chats(username=username, chat_store=chat_store, id=id)
             if empty_chat:
-                conversations_dict[username].remove(id)
-        # persist the updated conversation tracker
-        await redis.set("conversations", json.dumps(conversations_dict))
-        with open(USER_HISTORY, 'w') as fp:
-            json.dump(conversations_dict, fp)
+                empty_conv_ids.append(id)
+        # the conversation tracker snapshot on disk is written behind
+        await conversation_index.remove(redis, username, empty_conv_ids)
     except Exception as e:
         logger.error("Error during logging out %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,25 +1,25 @@
-from app.Ingestion_workflows.docling_parse_process import Docling_parser
 from app.Ingestion_workflows.milvus_ingest import ingest2milvus
-from app.config import RETRIEVAL_LOG_PATH, BACKEND_FASTAPI_LOG, BACKEND, VLLM_RERANK_URL, MODEL_RERANK, DOCLING_HASH_IMAGESTORE, FASTAPI_URL, retrieval_observe_columns, citation_header, reranked_articial
+from app.config import (BACKEND_FASTAPI_LOG, BACKEND, VLLM_RERANK_URL, MODEL_RERANK, FASTAPI_URL, citation_header, reranked_articial, col_mod,
+                        FEDERATED_LATENCY_BUDGET, FEDERATED_MERGE, FEDERATED_RRF_K, BATCH_QUERY_SEARCH_SIZE, BATCH_QUERY_CONCURRENCY)
+from app.utils.utils_cache import embedding_cache
+from app.utils.utils_docling_index import docling_hash_index
+from app.utils.utils_embed_scheduler import QUERY, BULK
+from app.utils.utils_http import get_http_client
 from app.utils.utils_logging import initialize_logging, logger
-from app.utils.utils_req_templates import RerankResult
+from app.utils.utils_req_templates import RerankResult, RetrievedChunk
+from app.utils.utils_retrieval_log import retrieval_log_store
 from app.utils.utils_LLM_process_inputs import qwen_rerank_preprocess
+from app.utils.utils_milvus import MilvusClientPool, pooled_async_client
 from app.prompt_config import RETRIEVE_INSTRUCTION
 from datetime import datetime
 from llama_index.core import Response
-from pymilvus import AnnSearchRequest, RRFRanker , AsyncMilvusClient
+from pymilvus import AnnSearchRequest, RRFRanker
 from pymilvus.model.reranker import BGERerankFunction  # type: ignore
-from typing import Dict, List, Tuple
-import ast
+from typing import Any, Dict, List, Optional, Tuple
 import asyncio
-import copy
-import httpx
-import os
-import pandas as pd
 import re
 # logging config
 initialize_logging(BACKEND_FASTAPI_LOG)
-lock = asyncio.Lock()
 
 _RERANKER_CACHE: Dict[Tuple[str, str], BGERerankFunction] = {}
 _reranker_cache_lock = asyncio.Lock()
@@ -50,47 +50,24 @@ async def _invalidate_bge_reranker(model_name: str, device: str) -> None:
     async with _reranker_cache_lock:
         _RERANKER_CACHE.pop(cache_key, None)
 
-async def thread_safe_deep_copy(lst):
-    """Avoid corrupting data incase of multiconcurrency
+async def log_retrievals(retrievals: List[RetrievedChunk], question: str, user: str, session_id: str, collection_name: str, LLM_response: str, citations= [], reranked_results: List[RetrievedChunk]= [], interaction_id: str= None):
+    """ For each retrieval in any session for any user, it appends the retrievals to the retrieval log store: chat session > question > retrieval > reranked results > LLM_response
     """
-    async with lock:
-        return copy.deepcopy(lst)
-
-async def log_retrievals(retrievals,question: str, user: str, session_id: str, collection_name: str, LLM_response: str, citations= [], reranked_results= []):
-    """ For each retrieval in any session for any user, it logs the retrievals into user data in data folder of the user: chat session > question > retrieval > reranked results > LLM_response
-    """
-    retrieval_path= RETRIEVAL_LOG_PATH.format(user= user)
-    retrieval_string= reranked_string= citation_string= ""
-    reranked_results_copy= await thread_safe_deep_copy(reranked_results)
     time= str(datetime.now())
-    if citations:
-        for citation in citations:
-            citation_string+=str(citation-1)+ ", "
-        citation_string= citation_string.strip(", ")
-    for retrieval in retrievals:
-        retrieval_string+=str(retrieval)+ "\n\n"
-    for results in reranked_results_copy:
-        del results["Document"]
-        reranked_string+=str(results)+ "\n\n"
-    if os.path.exists(retrieval_path):
-        df= pd.read_excel(retrieval_path)
-        for col in retrieval_observe_columns:
-            if col not in df.columns:
-                df[col]=""
-        df.loc[len(df)] = [time, session_id, question, retrieval_string, reranked_string, collection_name, LLM_response, citation_string, "N/A", "N/A"]
-    else:
-        df= pd.DataFrame(columns=retrieval_observe_columns)
-        df.loc[len(df)] = [time, session_id, question, retrieval_string, reranked_string, collection_name, LLM_response, citation_string, "N/A", "N/A"]
-    df.to_excel(retrieval_path, index=False)
+    citation_string= ", ".join(str(citation-1) for citation in citations)
+    retrieval_string= "".join(retrieval.log_entry() + "\n\n" for retrieval in retrievals)
+    reranked_string= "".join(result.log_entry() + "\n\n" for result in reranked_results)
+    await retrieval_log_store.log({"user": user, "interaction_id": interaction_id, "time": time, "chat_session": session_id, "question": question, "retrievals": retrieval_string,
+                                   "reranked_results": reranked_string, "collection": collection_name, "llm_response": LLM_response, "citations": citation_string})
 
 async def get_rerank(url:str, payload: dict):
     results=[]
-    async with httpx.AsyncClient() as client:
-        responses = await client.post(url, json=payload, timeout=10000)
-        if responses.status_code==200:
-            responses=responses.json()["results"]
-            results = [RerankResult(text=d["document"]["text"], score=d["relevance_score"],index= d["index"]) for d in responses]
-        return results
+    client= get_http_client(url)
+    responses = await client.post(url, json=payload)
+    if responses.status_code==200:
+        responses=responses.json()["results"]
+        results = [RerankResult(text=d["document"]["text"], score=d["relevance_score"],index= d["index"]) for d in responses]
+    return results
 
 async def rerank_documents(query, documents, model_name, device="cuda", top_k=4):
     """
@@ -108,7 +85,7 @@ async def rerank_documents(query, documents, model_name, device="cuda", top_k=4)
     - top_k (int): Number of top results to return.
 
     Returns:
-    - list of dict: Reranked documents sorted by relevance.
+    - list of RetrievedChunk: Reranked documents sorted by relevance.
     """
     # Extract only the texts for reranking
     if not model_name:
@@ -138,84 +115,199 @@ async def rerank_documents(query, documents, model_name, device="cuda", top_k=4)
             results= await get_rerank(url=VLLM_RERANK_URL, payload=payload)
         except Exception as e:
             logger.error(f"VLLM Backend did not work, try again: {str(e)}")
-            results={}
+            results=[]
     else:
         logger.error("Wrong backend used, check startup script, should be 'ollama' or 'vllm'")
         raise AssertionError("Wrong backend")
-    #Map reranked results back to original documents
-    reranked_docs = []
-    for result in results:
-        for doc in documents:
-            if doc['entity']['text_concat'] == result.text:
-                reranked_doc = {
-                    "id": doc['id'],
-                    "similarity_score": result.score,  # Update with new score
-                    "text": result.text,
-                    "metadata": doc['entity']['metadata']
-                }
-                reranked_docs.append(reranked_doc)
-                break
+    # Map reranked results back to original documents by their position in the reranked texts, duplicate texts keep their own ids
+    reranked_docs = [RetrievedChunk(doc_id=str(documents[result.index]['id']), score=result.score, metadata=documents[result.index]['entity']['metadata'],
+                                    text=documents[result.index]['entity']['text_concat']) for result in results]
     #Sort documents by new similarity score (descending)
-    return sorted(reranked_docs, key=lambda x: x['similarity_score'], reverse=True)
+    return sorted(reranked_docs, key=lambda x: x.score, reverse=True)
 
-async def milvus_hybrid_retrieve(uri: str, token: str,question:str, collection_name:str, model, k=5, vector_k= 20):
-    """ Hybrid retreival using sparse and dense embeddings 
+async def embed_query(question: str, model: str) -> List[List[float]]:
+    """ Dense embedding of a question with the retrieval instruction, served from the embedding cache when possible
+    """
+    question_dense_embeddings= await embedding_cache.get(model, RETRIEVE_INSTRUCTION, question)
+    if question_dense_embeddings is None:
+        question_dict= {"text_concat": question}
+        quetion_embedding= await ingest2milvus.encode_text(question_dict, model=model, instruct=RETRIEVE_INSTRUCTION, priority=QUERY)
+        question_dense_embeddings = [v for v in quetion_embedding["dense_embedding"]]
+        await embedding_cache.set(model, RETRIEVE_INSTRUCTION, question, question_dense_embeddings)
+    return question_dense_embeddings
+
+async def embed_queries(questions: List[str], model: str, priority: int= BULK) -> List[List[List[float]]]:
+    """ Dense embeddings of many questions with the retrieval instruction, questions missing in the embedding cache are encoded in one request
+    """
+    embeddings= await embedding_cache.get_many(model, RETRIEVE_INSTRUCTION, questions)
+    missing= list(dict.fromkeys(question for question, embedding in zip(questions, embeddings) if embedding is None))
+    if missing:
+        encoded= await ingest2milvus.encode_text({"text_concat": missing}, model=model, instruct=RETRIEVE_INSTRUCTION, priority=priority)
+        new= {question: [vector] for question, vector in zip(missing, encoded["dense_embedding"])}
+        await embedding_cache.set_many(model, RETRIEVE_INSTRUCTION, new)
+        embeddings= [embedding if embedding is not None else new[question] for question, embedding in zip(questions, embeddings)]
+    return embeddings
+
+async def milvus_hybrid_search(uri: str, token: str, question: str, collection_name: str, model, vector_k= 20, milvus_pool: Optional[MilvusClientPool]= None, question_dense_embeddings: Optional[List[List[float]]]= None):
+    """ Hybrid search using sparse and dense embeddings fused with RRF, returns the milvus search results (one list of hits)
 
     Args:
         question (str): question for which to retrieve nodes 
         collection_name (str): collection name to search in
         model: Embedding model
-        tokenizer: Corresponding tokenizer
-        k (int): number of reranked results. Defaults to 5.
-        vector_k: number of retrievals pre reranking. 
+        vector_k: number of retrievals
+        milvus_pool: app wide client pool, a short lived client is opened for uri and token if not given
+        question_dense_embeddings: precomputed query embedding (see embed_query), computed here if not given
     """
-    milvus_client = AsyncMilvusClient(uri, token= token)
     # Prepare ANNS field for bm25 search (sparse)
     full_text_search_params = {"metric_type": "BM25", "params": {"drop_ratio_build": 0.1}}
     full_text_search_req = AnnSearchRequest(data=[question], anns_field="sparse_embedding", param=full_text_search_params, limit=vector_k)
     # Prepare ANNS field for semantic search (dense)
-    question_dict= {"text_concat": question}
-    quetion_embedding= await ingest2milvus.encode_text(question_dict, model=model, instruct=RETRIEVE_INSTRUCTION)
-    question_dense_embeddings = [v for v in quetion_embedding["dense_embedding"]]
+    # the query embedding is computed while a milvus client is checked out
+    embedding= asyncio.ensure_future(embed_query(question=question, model=model)) if question_dense_embeddings is None else None
     dense_search_params = {"metric_type": "COSINE", "params": {"ef": 25}}
-    dense_req = AnnSearchRequest(
-        data=question_dense_embeddings, anns_field="dense_embedding", param=dense_search_params, limit=vector_k,
-    )
     
     # Search topK docs based on dense and sparse vectors and rerank with RRF.
-    search_results = await milvus_client.hybrid_search(collection_name=collection_name,
-        reqs= [full_text_search_req, dense_req], ranker=RRFRanker(), limit=vector_k, output_fields=["id", "text_concat", "metadata"]
-    )
+    try:
+        async with pooled_async_client(milvus_pool, token=token, uri=uri) as milvus_client:
+            if embedding is not None:
+                question_dense_embeddings= await embedding
+            dense_req = AnnSearchRequest(
+                data=question_dense_embeddings, anns_field="dense_embedding", param=dense_search_params, limit=vector_k,
+            )
+            return await milvus_client.hybrid_search(collection_name=collection_name,
+                reqs= [full_text_search_req, dense_req], ranker=RRFRanker(), limit=vector_k, output_fields=["id", "text_concat", "metadata"]
+            )
+    finally:
+        if embedding is not None and not embedding.done():
+            embedding.cancel()
+
+async def milvus_hybrid_retrieve(uri: str, token: str,question:str, collection_name:str, model, k=5, vector_k= 20, milvus_pool: Optional[MilvusClientPool]= None, question_dense_embeddings: Optional[List[List[float]]]= None):
+    """ Hybrid retreival using sparse and dense embeddings 
+
+    Args:
+        question (str): question for which to retrieve nodes 
+        collection_name (str): collection name to search in
+        model: Embedding model
+        tokenizer: Corresponding tokenizer
+        k (int): number of reranked results. Defaults to 5.
+        vector_k: number of retrievals pre reranking. 
+        milvus_pool: app wide client pool, a short lived client is opened for uri and token if not given
+        question_dense_embeddings: precomputed query embedding (see embed_query), computed here if not given
+    """
+    search_results= await milvus_hybrid_search(uri=uri, token=token, question=question, collection_name=collection_name, model=model, vector_k=vector_k,
+                                               milvus_pool=milvus_pool, question_dense_embeddings=question_dense_embeddings)
     logger.info("Retrieval completed, reranking now.")
-    reranked_results = await rerank_documents(query=question_dict["text_concat"], documents= search_results, device="cuda", top_k=k, model_name=MODEL_RERANK)
-    await milvus_client.close()
-    # store vector db retrievals as list of dict (only useful for retrieval observability after reranker)
-    retrievals_list= []
-    for res in search_results:
-        for retrieval in res:
-            retrieved_doc= {}
-            retrieved_doc["Doc_id"]= str(retrieval["id"])
-            retrieved_doc["Metadata"]= str(retrieval["entity"]["metadata"])
-            retrieved_doc["score"]= retrieval["distance"]
-            retrievals_list.append(retrieved_doc)
-    # Store reranked results as list of dict
-    reranked_list= []
-    for result in reranked_results:
-        retrieved_doc= {}
-        retrieved_doc["Doc_id"]= str(result["id"])
-        retrieved_doc["Document"]= str(result["text"])
-        retrieved_doc["Metadata"]= str(result["metadata"])
-        retrieved_doc["score"]= result["similarity_score"]
-        reranked_list.append(retrieved_doc)
+    reranked_results = await rerank_documents(query=question, documents= search_results, device="cuda", top_k=k, model_name=MODEL_RERANK)
+    # vector db retrievals before reranking (only useful for retrieval observability after reranker)
+    retrievals_list= [RetrievedChunk(doc_id=str(retrieval["id"]), score=retrieval["distance"], metadata=retrieval["entity"]["metadata"]) for res in search_results for retrieval in res]
     logger.info("Reranking done.")
-    return retrievals_list, reranked_list
+    return retrievals_list, reranked_results
+
+async def federated_retrieve(uri: str, token: str, question: str, collections: List[str], k=5, vector_k= 20, milvus_pool: Optional[MilvusClientPool]= None,
+                             question_embeddings: Optional[Dict[str, List[List[float]]]]= None, budget: float= FEDERATED_LATENCY_BUDGET, merge: str= FEDERATED_MERGE):
+    """ Hybrid retrieval of one question from several collections at once.
+        The question is embedded once per embedding model, all collections are searched concurrently and their hits are fused with a global RRF,
+        then the fused candidates are reranked (merge="rerank") or kept in RRF order (merge="rrf").
+        Collections which did not answer within budget seconds are left out, a rerank which would exceed the budget falls back to the RRF order.
+        Doc ids are prefixed with their collection as ids of different collections can collide.
+
+    Args:
+        question (str): question for which to retrieve nodes
+        collections (List[str]): collections to search in
+        k (int): number of results after merging
+        vector_k: number of retrievals per collection and of fused candidates
+        milvus_pool: app wide client pool
+        question_embeddings: precomputed query embeddings by embedding model (see embed_query), missing ones are computed here
+        budget (float): latency budget in seconds
+        merge (str): "rerank" or "rrf"
+    """
+    loop= asyncio.get_running_loop()
+    deadline= loop.time() + budget
+    question_embeddings= dict(question_embeddings or {})
+    models= list({col_mod[collection] for collection in collections} - question_embeddings.keys())
+    if models:
+        question_embeddings.update(zip(models, await asyncio.gather(*(embed_query(question=question, model=model) for model in models))))
+    searches= {asyncio.ensure_future(milvus_hybrid_search(uri=uri, token=token, question=question, collection_name=collection, model=col_mod[collection], vector_k=vector_k,
+                                                          milvus_pool=milvus_pool, question_dense_embeddings=question_embeddings[col_mod[collection]])): collection
+               for collection in collections}
+    done, pending= await asyncio.wait(searches.keys(), timeout=max(0.0, deadline - loop.time()))
+    for search in pending:
+        search.cancel()
+        logger.warning("Collection %s did not answer within the federated retrieval budget of %ss", searches[search], budget)
+    # global RRF over the ranked hits of every collection
+    fused= {}
+    for search in done:
+        collection= searches[search]
+        if search.exception() is not None:
+            logger.error("Federated retrieval from collection %s failed: %s", collection, str(search.exception()))
+            continue
+        for rank, hit in enumerate(search.result()[0]):
+            doc_id= f"{collection}:{hit['id']}"
+            candidate= fused.setdefault(doc_id, {"id": doc_id, "entity": hit["entity"], "rrf": 0.0})
+            candidate["rrf"]+= 1 / (FEDERATED_RRF_K + rank + 1)
+    if not fused and not any(search.exception() is None for search in done):
+        raise RuntimeError(f"None of the collections {collections} answered within {budget}s")
+    candidates= sorted(fused.values(), key=lambda candidate: candidate["rrf"], reverse=True)[:vector_k]
+    retrievals_list= [RetrievedChunk(doc_id=candidate["id"], score=candidate["rrf"], metadata=candidate["entity"]["metadata"]) for candidate in candidates]
+    logger.info("Federated retrieval from %s collections completed with %s candidates", len(done), len(candidates))
+    remaining= deadline - loop.time()
+    if merge == "rerank" and candidates and remaining > 0:
+        try:
+            reranked_results= await asyncio.wait_for(rerank_documents(query=question, documents=[candidates], device="cuda", top_k=k, model_name=MODEL_RERANK), timeout=remaining)
+            return retrievals_list, reranked_results
+        except asyncio.TimeoutError:
+            logger.warning("Federated rerank exceeded the latency budget of %ss, keeping the RRF order", budget)
+    reranked_results= [RetrievedChunk(doc_id=candidate["id"], score=candidate["rrf"], metadata=candidate["entity"]["metadata"], text=candidate["entity"]["text_concat"])
+                       for candidate in candidates[:k]]
+    return retrievals_list, reranked_results
+
+async def batch_retrieve(uri: str, token: str, questions: List[str], collection_name: str, model, k=5, vector_k= 20, milvus_pool: Optional[MilvusClientPool]= None,
+                         search_size: int= BATCH_QUERY_SEARCH_SIZE, concurrency: int= BATCH_QUERY_CONCURRENCY) -> List[Tuple[List[RetrievedChunk], List[RetrievedChunk]]]:
+    """ Hybrid retrieval of many questions from one collection without touching any session.
+        All questions are embedded in one request, every search_size questions share one multi-vector hybrid search (searches run concurrently)
+        and the hits of every question are reranked with at most concurrency reranks running at once.
+
+    Args:
+        questions (List[str]): questions to retrieve nodes for
+        collection_name (str): collection name to search in
+        model: Embedding model of the collection
+        k (int): number of reranked results per question
+        vector_k: number of retrievals per question pre reranking
+        milvus_pool: app wide client pool
+
+    Returns:
+        (retrievals, reranked results) per question, in the order of the questions
+    """
+    embeddings= await embed_queries(questions, model=model)
+    full_text_search_params = {"metric_type": "BM25", "params": {"drop_ratio_build": 0.1}}
+    dense_search_params = {"metric_type": "COSINE", "params": {"ef": 25}}
+
+    async def search(start: int):
+        batch= questions[start:start + search_size]
+        reqs= [AnnSearchRequest(data=batch, anns_field="sparse_embedding", param=full_text_search_params, limit=vector_k),
+               AnnSearchRequest(data=[embedding[0] for embedding in embeddings[start:start + search_size]], anns_field="dense_embedding", param=dense_search_params, limit=vector_k)]
+        async with pooled_async_client(milvus_pool, token=token, uri=uri) as milvus_client:
+            return await milvus_client.hybrid_search(collection_name=collection_name, reqs=reqs, ranker=RRFRanker(), limit=vector_k, output_fields=["id", "text_concat", "metadata"])
+
+    search_results= [hits for batch in await asyncio.gather(*(search(start) for start in range(0, len(questions), search_size))) for hits in batch]
+    logger.info("Batch retrieval of %s questions from %s completed, reranking now.", len(questions), collection_name)
+    semaphore= asyncio.Semaphore(max(1, concurrency))
+
+    async def rerank(question: str, hits):
+        async with semaphore:
+            return await rerank_documents(query=question, documents=[hits], device="cuda", top_k=k, model_name=MODEL_RERANK)
+
+    reranked_results= await asyncio.gather(*(rerank(question, hits) for question, hits in zip(questions, search_results)))
+    return [([RetrievedChunk(doc_id=str(hit["id"]), score=hit["distance"], metadata=hit["entity"]["metadata"]) for hit in hits], reranked)
+            for hits, reranked in zip(search_results, reranked_results)]
 
 '''Citation modules'''
 
-def get_page_from_reranked(reranked_list: List, node_id: List):
+def get_page_from_reranked(reranked_list: List[RetrievedChunk], node_id: List):
     """ Get a tuple of chunk info for each node id corresponding to sources mentioned by llm
     """
-    doc_lookup = {retrieval["Doc_id"]: retrieval for retrieval in reranked_list}
+    doc_lookup = {retrieval.doc_id: retrieval for retrieval in reranked_list}
     
     citation_dict = {}
     for id_pair in node_id:
@@ -223,7 +315,7 @@ def get_page_from_reranked(reranked_list: List, node_id: List):
         retrieval = doc_lookup.get(doc_id)
         
         if retrieval:
-            metadata = ast.literal_eval(retrieval["Metadata"])
+            metadata = retrieval.metadata
             binary_hash = metadata["binary_hash"].split("AND")[0].strip()
             page_no = metadata["page_no"][0]
             section = metadata["Section"]
@@ -232,78 +324,68 @@ def get_page_from_reranked(reranked_list: List, node_id: List):
     return citation_dict
 
 
-def image_to_html(images):
-    """
-    Returns an HTML link. When clicked, opens a new window with a gallery of the cited PNG images.
-    Each image is clickable and opens at full size in a new tab/window.
-    """
-    # Construct full URLs for JavaScript
-    js_images = [f"'{FASTAPI_URL}{url}'" for url in images]
-    js_array = "[" + ",".join(js_images) + "]"
-    js_code = f"""
-        var imgs = {js_array};
-        var html = "<div style='display:flex;flex-wrap:wrap;gap:12px;padding:24px;background:#222;'>";
-        for (var i=0; i<imgs.length; i++) {{
-            html += "<img src='" + imgs[i] + "' style='width:240px;max-width:100%;margin:5px;border:1px solid #ccc;cursor:zoom-in;background:#fff;' onclick=\\"window.open('" + imgs[i] + "', '_blank', 'width=900,height=1200');\\" title='Click to zoom'/>";
-        }}
-        html += "</div>";
-        var w = window.open('', 'gallery', 'width=1200,height=900');
-        w.document.write('<html><head><title>Cited Pages</title></head><body style=\\'margin:0;\\'>' + html + '</body></html>');
-        w.document.title = 'Cited Pages';
-        return false;
+def gallery_url(binary_hash: str, pages: List[int]) -> Optional[str]:
+    """ Url of the cited pages gallery of a document on the /doc_store mount, None if the document is not in the doc store
+
+    Args:
+        binary_hash (str): binary hash of the document
+        pages (List[int]): cited page numbers
     """
-    safe_js = js_code.replace('"', '&quot;').replace('\n', ' ')
-    link_html = f"<a href='#' onclick=\"{safe_js}\">View cited pages</a>"
-    return link_html
+    file_path= docling_hash_index.get(binary_hash)
+    if not file_path:
+        return None
+    return "/doc_store/" + file_path.split("/")[-1] + "/gallery.html?pages=" + ",".join(str(page_no) for page_no in pages)
 
-def get_image_by_page(citation_tuple):
-    """ For each source, get the Docling document and its base64 image by page number range. Embed is html tag and return. 
+def get_citations(result: Response, top_k: int, conv_id: str, reranked_list: List[RetrievedChunk]) -> Tuple[List[int], List[Dict[str, Any]]]:
+    """ For each "source" mentioned in llm response, get the match number and match it to the source nodes provided in context.
+        Then get the page, binary hash, section and document name of all matched nodes as citation records
 
     Args:
-        citation_tuple (tuple):  tuple of file hash, pageno, section, document_name
+        result (Response object): Response from llm without citation
+        top_k (int): Max no reranked chunks
+        conv_id (str): session id
+        reranked_list (List): list of reranked chunks to get metadata from
+
+    Returns:
+        match: source numbers cited by the llm
+        citations: one record per cited source with source, binary_hash, pages, section, document and gallery (url of the cited pages)
     """
-    image_store= Docling_parser.get_store(DOCLING_HASH_IMAGESTORE)
-    file_path= image_store.get(citation_tuple[0])
-    imgs= ["/doc_store/"+ file_path.split("/")[-1] + f"/{page_no}.png" for page_no in citation_tuple[1]]
-    return image_to_html(images=imgs)
-
-def cite(result: Response, top_k: int, conv_id: str, reranked_list: List):
-    """ For each "source" mentioned in llm response, get the match number and match it to the source nodes provided in context. 
-        Then get the page, binary hash and document name for all matched nodes and get image by hash and page number embedding them as citation
+    match= [int(x) for x in set(re.findall(r"Source\s+(\d+)", result.response))]
+    match= sorted(i for i in match if 0 < i <= top_k)
+    if not match:
+        return [], []
+    logger.info("Creating citations for session: %s", conv_id)
+    node_id= [{f"Source {i}": result.source_nodes[i-1].node.node_id} for i in match]
+    citation_dict= get_page_from_reranked(reranked_list=reranked_list, node_id=node_id)
+    logger.info("Citation dict for the response: %s", citation_dict)
+    citations= [{"source": source, "binary_hash": binary_hash, "pages": list(page_no), "section": section, "document": document_name,
+                 "gallery": gallery_url(binary_hash, page_no)}
+                for source, (binary_hash, page_no, section, document_name) in citation_dict.items()]
+    return match, citations
+
+def format_citations(response: str, citations: List[Dict[str, Any]]) -> str:
+    """ Append the citation block for the citation records to the llm response """
+    if not citations:
+        return response
+    response= response + citation_header
+    for citation in citations:
+        link= f"<a href='{FASTAPI_URL}{citation['gallery']}' target='_blank'>View cited pages</a>" if citation["gallery"] else ""
+        response= response + "\n\n" + f"**{citation['source']}**" + "\nDocument Name: " + citation["document"] + "\nSection: " +  citation["section"] + "\n" + link
+    return response
+
+def cite(result: Response, top_k: int, conv_id: str, reranked_list: List[RetrievedChunk]):
+    """ Cite the sources mentioned in the llm response (see get_citations), appending a citation block with a link to the
+        gallery of the cited pages of each source
     Args:
         result (Response object): Response from llm without citation
         top_k (int): Max no reranked chunks
         conv_id (str): session id
         reranked_list (List): list of reranked chunks to get metadata from
+
+    Returns:
+        response: llm response with the citation block
+        match: source numbers cited by the llm
+        citations: structured citation records
     """
-    def get_next_words(text, target_word):
-        pattern = f"{target_word}\\s+(\\d+)"
-        matches = re.finditer(pattern, text)
-        return [match.group(1) for match in matches]
-    node_id=[]
-    if "Source" in result.response:
-        match= get_next_words(result.response, "Source")
-    else:
-        return result.response, []
-    match= list(set(match))
-    match= [int(x) for x in match]
-    match= sorted(match)
-    try:
-        match= [i for i in match if i <= top_k]
-    except Exception as e:
-        logger.error("Citation function error for session: %s. Error: %s", conv_id, str(e))
-        return result.response, []
-    if match:
-        logger.info("Creating citations for session: %s", conv_id)
-        # if match is found, make citation
-        response= result.response + citation_header
-        for i in match:
-            node_id.append({f"Source {i}":result.source_nodes[i-1].node.node_id})
-        citation_dict= get_page_from_reranked(reranked_list=reranked_list, node_id=node_id)
-        logger.info("Citation dict for the response: %s", citation_dict)
-        for source, citation in citation_dict.items():
-            image_by_source= get_image_by_page(citation)
-            response= response + "\n\n" + f"**{source}**" + "\nDocument Name: " + citation[3] + "\nSection: " +  citation[2] + "\n" + image_by_source       
-        return response, match
-    else:
-        return result.response, []
+    match, citations= get_citations(result, top_k=top_k, conv_id=conv_id, reranked_list=reranked_list)
+    return format_citations(result.response, citations), match, citations
@@ -2,10 +2,11 @@ import asyncio
 from redis.asyncio import Redis
 import pickle
 from app.config import BACKEND_FASTAPI_LOG, dummy_model
+from app.utils.utils_chat_history import ChatHistoryStore
 from app.utils.utils_logging import initialize_logging, logger
+from llama_index.core.base.llms.types import ChatMessage
 from app.Ingestion_workflows.milvus_ingest import ingest2milvus
 import os
-import orjson
 # logging config
 initialize_logging(BACKEND_FASTAPI_LOG)
 
@@ -41,18 +42,13 @@ def load_object(file):
     except Exception as e:
         print("Error during unpickling object (Possibly unsupported):", e)
 
-def session_id_get_question(chat_history, conv_id) -> tuple:
-    """For a chat store of a conv_id, return a tuple of 1st question:convid to the frontend
+def session_id_get_question(first_message: ChatMessage, conv_id) -> tuple:
+    """For the first message of a conv_id, return a tuple of 1st question:convid to the frontend
     """
-    conversation=chat_history.get("store", {})
-    for chat_id, messages in conversation.items():
-        user_blocks=messages[0].get("blocks", [])
-        if not user_blocks:
-            logger.warning("%s conv_id has an empty chat stored in db", conv_id)
-            return ("ERROR, empty chat", conv_id)
-        for user_text in user_blocks:
-            if user_text.get("block_type") == "text":
-                user_content = user_text.get("text", "")
+    user_content= first_message.content or ""
+    if not user_content:
+        logger.warning("%s conv_id has an empty chat stored in db", conv_id)
+        return ("ERROR, empty chat", conv_id)
     if ingest2milvus.get_token_len(dummy_model= dummy_model, text=user_content)>20: 
         try:
             user_content= (" ").join(user_content.split()[:9])+ "..."
@@ -78,13 +74,13 @@ def check_chat_history_db(db: str, user: str, user_conv_id: list, new_conv_id: s
     for conv_id in user_conv_id:
         user_history= db.format(user=user, conv_id=conv_id)
         if os.path.exists(user_history):            
-            with open(user_history, 'rb') as f:
-                chat_history = orjson.loads(f.read())
-            if chat_history["store"]:
-                final_conv_id_list.append(session_id_get_question(chat_history=chat_history, conv_id=conv_id))
+            # only the first message is needed for the title
+            chat_history= ChatHistoryStore.read_file(user_history, conv_id, limit=1)
+            if chat_history:
+                final_conv_id_list.append(session_id_get_question(first_message=chat_history[0], conv_id=conv_id))
             elif conv_id==new_conv_id:
                 final_conv_id_list.append(("New Chat", conv_id))
-            elif not chat_history["store"]:
+            else:
                 logger.warning("%s is empty", user_history)
     return final_conv_id_list
 
@@ -101,9 +97,7 @@ def check_empty_chats(username: str, chat_store: str, id: str):
         bool: Returns True if the current session id is empty chat or does not have a chat store present
     """
     if os.path.exists(chat_store):  
-        with open(chat_store, 'rb') as f:
-            chat_history = orjson.loads(f.read())
-        if not chat_history["store"]:
+        if not ChatHistoryStore.read_file(chat_store, id, limit=1):
             os.remove(chat_store)
             logger.info("User %s had an empty session id: %s. Removing entry as logout initiated.", username, id)
             return True
@@ -0,0 +1,221 @@
+from app.config import BACKEND_FASTAPI_LOG, EMBED_CACHE_SIZE, EMBED_CACHE_TTL, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+from app.utils.utils_logging import initialize_logging, logger
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import hashlib
+import numpy as np
+import orjson
+import time
+import unicodedata
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+
+def normalize_text(text: str) -> str:
+    """ Unicode normalize and collapse whitespace so trivially different spellings of a question share a cache key """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class TTLCache:
+    """ Bounded in-process LRU cache whose entries expire ttl seconds after insertion """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size= max_size
+        self.ttl= ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]"= OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item= self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value= item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key]= (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class EmbeddingCache:
+    """ Query embedding cache keyed by (model, instruct, normalized text).
+        Lookups hit the in-process LRU first and then an optional Redis tier shared by all backend workers.
+    """
+    def __init__(self, max_size: int= EMBED_CACHE_SIZE, ttl: float= EMBED_CACHE_TTL, prefix: str= "embcache:"):
+        self.local= TTLCache(max_size=max_size, ttl=ttl)
+        self.ttl= ttl
+        self.prefix= prefix
+        self.redis= None
+        self.hits= 0
+        self.redis_hits= 0
+        self.misses= 0
+
+    def attach_redis(self, redis):
+        """ Enable the shared tier with an async redis client (set by the FastAPI lifespan) """
+        self.redis= redis
+
+    @staticmethod
+    def make_key(model: str, instruct: Optional[str], text: str) -> Tuple[str, str, str]:
+        return (model, instruct or "", normalize_text(text))
+
+    def _redis_key(self, key: Tuple[str, str, str]) -> str:
+        return self.prefix + hashlib.sha256("\x1f".join(key).encode("utf-8")).hexdigest()
+
+    async def get(self, model: str, instruct: Optional[str], text: str) -> Optional[List[List[float]]]:
+        key= EmbeddingCache.make_key(model, instruct, text)
+        embedding= self.local.get(key)
+        if embedding is not None:
+            self.hits+=1
+            return embedding
+        if self.redis is not None:
+            try:
+                cached= await self.redis.get(self._redis_key(key))
+            except Exception as e:
+                logger.warning("Embedding cache redis lookup failed: %s", str(e))
+                cached= None
+            if cached:
+                embedding= orjson.loads(cached)
+                self.local.set(key, embedding)
+                self.redis_hits+=1
+                return embedding
+        self.misses+=1
+        return None
+
+    async def set(self, model: str, instruct: Optional[str], text: str, embedding: List[List[float]]):
+        key= EmbeddingCache.make_key(model, instruct, text)
+        self.local.set(key, embedding)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._redis_key(key), orjson.dumps(embedding), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning("Embedding cache redis write failed: %s", str(e))
+
+    async def get_many(self, model: str, instruct: Optional[str], texts: List[str]) -> List[Optional[List[List[float]]]]:
+        """ Embeddings of many texts (None for misses), local misses are looked up in redis with one MGET """
+        keys= [EmbeddingCache.make_key(model, instruct, text) for text in texts]
+        embeddings= [self.local.get(key) for key in keys]
+        missing= [i for i, embedding in enumerate(embeddings) if embedding is None]
+        self.hits+= len(keys) - len(missing)
+        if missing and self.redis is not None:
+            try:
+                cached= await self.redis.mget([self._redis_key(keys[i]) for i in missing])
+            except Exception as e:
+                logger.warning("Embedding cache redis lookup failed: %s", str(e))
+                cached= [None] * len(missing)
+            for i, value in zip(missing, cached):
+                if value:
+                    embeddings[i]= orjson.loads(value)
+                    self.local.set(keys[i], embeddings[i])
+                    self.redis_hits+=1
+        self.misses+= sum(embedding is None for embedding in embeddings)
+        return embeddings
+
+    async def set_many(self, model: str, instruct: Optional[str], items: Dict[str, List[List[float]]]):
+        """ Cache the embeddings of many texts, written to redis in one pipeline """
+        keys= {text: EmbeddingCache.make_key(model, instruct, text) for text in items}
+        for text, embedding in items.items():
+            self.local.set(keys[text], embedding)
+        if self.redis is not None and items:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for text, embedding in items.items():
+                        pipe.set(self._redis_key(keys[text]), orjson.dumps(embedding), ex=int(self.ttl))
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("Embedding cache redis write failed: %s", str(e))
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "redis_hits": self.redis_hits, "misses": self.misses, "size": len(self.local)}
+
+
+class AnswerCache:
+    """ Semantic cache of cited answers per collection.
+        A lookup hits if a cached question of the same collection version has a cosine similarity of at least threshold.
+        The collection version lives in redis (shared by all workers) and is bumped by every ingestion, which invalidates all answers of that collection.
+    """
+    def __init__(self, max_size: int= ANSWER_CACHE_SIZE, ttl: float= ANSWER_CACHE_TTL, threshold: float= ANSWER_CACHE_THRESHOLD, prefix: str= "collection_version:"):
+        self.max_size= max_size
+        self.ttl= ttl
+        self.threshold= threshold
+        self.prefix= prefix
+        self.redis= None
+        self._local_versions: Dict[str, int]= {}
+        # collection -> list of (expires_at, version, unit query vector, payload), oldest first
+        self._entries: Dict[str, List[Tuple[float, int, np.ndarray, Dict[str, Any]]]]= {}
+        self.hits= 0
+        self.misses= 0
+
+    def attach_redis(self, redis):
+        """ Share collection versions between workers through an async redis client (set by the FastAPI lifespan) """
+        self.redis= redis
+
+    async def get_version(self, collection: str) -> int:
+        if self.redis is not None:
+            try:
+                version= await self.redis.get(self.prefix + collection)
+                return int(version) if version else 0
+            except Exception as e:
+                logger.warning("Answer cache version lookup failed for %s: %s", collection, str(e))
+        return self._local_versions.get(collection, 0)
+
+    async def bump_version(self, collection: str):
+        """ Invalidate every cached answer of collection, called after an ingestion into it """
+        self._local_versions[collection]= self._local_versions.get(collection, 0) + 1
+        self._entries.pop(collection, None)
+        if self.redis is not None:
+            try:
+                await self.redis.incr(self.prefix + collection)
+            except Exception as e:
+                logger.warning("Answer cache version bump failed for %s: %s", collection, str(e))
+        logger.info("Answer cache invalidated for collection %s", collection)
+
+    @staticmethod
+    def _unit_vector(query_embedding: List[List[float]]) -> np.ndarray:
+        vector= np.asarray(query_embedding[0], dtype=np.float32)
+        norm= np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def get(self, collection: str, query_embedding: List[List[float]]) -> Optional[Dict[str, Any]]:
+        version= await self.get_version(collection)
+        now= time.monotonic()
+        entries= [entry for entry in self._entries.get(collection, []) if entry[0] >= now and entry[1] == version]
+        self._entries[collection]= entries
+        if not entries:
+            self.misses+=1
+            return None
+        similarities= np.stack([entry[2] for entry in entries]) @ AnswerCache._unit_vector(query_embedding)
+        best= int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses+=1
+            return None
+        self.hits+=1
+        logger.info("Answer cache hit for collection %s with similarity %.4f", collection, float(similarities[best]))
+        return entries[best][3]
+
+    async def set(self, collection: str, query_embedding: List[List[float]], payload: Dict[str, Any]):
+        version= await self.get_version(collection)
+        entries= self._entries.setdefault(collection, [])
+        entries.append((time.monotonic() + self.ttl, version, AnswerCache._unit_vector(query_embedding), payload))
+        if len(entries) > self.max_size:
+            del entries[:len(entries) - self.max_size]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": sum(len(entries) for entries in self._entries.values())}
+
+
+# process wide instances, the redis tiers are attached on startup
+embedding_cache= EmbeddingCache()
+answer_cache= AnswerCache()
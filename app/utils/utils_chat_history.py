@@ -0,0 +1,140 @@
+from app.config import BACKEND_FASTAPI_LOG, CHAT_STORE_PATH, CHAT_HISTORY_WINDOW
+from app.utils.utils_logging import initialize_logging, logger
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.storage.chat_store import SimpleChatStore
+from redis.asyncio import Redis
+from typing import List, Optional, Tuple
+import asyncio
+import orjson
+import os
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+
+class ChatHistoryStore:
+    """ Chat history of each conversation as append-only message records {"role", "content"}.
+        Redis holds the list chat:{conv_id} for open sessions, on disk every conversation is a json lines file at CHAT_STORE_PATH.
+        A turn only appends its new messages to both, nothing is rewritten or pickled.
+        Files in the old SimpleChatStore json format are still read and converted on their first append.
+    """
+    def __init__(self, path: str= CHAT_STORE_PATH, window: int= CHAT_HISTORY_WINDOW, ttl: int= 10800, prefix: str= "chat:"):
+        self.path= path
+        self.window= window
+        # same expiry as the session hash
+        self.ttl= ttl
+        self.prefix= prefix
+
+    @staticmethod
+    def to_record(message: ChatMessage) -> bytes:
+        return orjson.dumps({"role": message.role.value, "content": message.content or ""})
+
+    @staticmethod
+    def from_record(record: bytes) -> ChatMessage:
+        data= orjson.loads(record)
+        return ChatMessage(role=MessageRole(data["role"]), content=data["content"])
+
+    def _file(self, user: str, conv_id: str) -> str:
+        return self.path.format(user=user, conv_id=conv_id)
+
+    def exists(self, user: str, conv_id: str) -> bool:
+        return os.path.exists(self._file(user, conv_id))
+
+    def read_disk(self, user: str, conv_id: str, limit: Optional[int]= None) -> List[ChatMessage]:
+        """ All messages of a conversation (or the first limit ones), empty if it has no history file """
+        return ChatHistoryStore.read_file(self._file(user, conv_id), conv_id, limit=limit)
+
+    @staticmethod
+    def read_file(path: str, conv_id: str, limit: Optional[int]= None) -> List[ChatMessage]:
+        """ Messages of a history file in json lines or old SimpleChatStore format, empty if the file does not exist """
+        if not os.path.exists(path):
+            return []
+        messages= []
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data= orjson.loads(line)
+                if "store" in data:
+                    # old SimpleChatStore file, one json object holding the whole conversation
+                    return SimpleChatStore.model_validate(data).get_messages(conv_id)[:limit]
+                messages.append(ChatMessage(role=MessageRole(data["role"]), content=data["content"]))
+                if limit is not None and len(messages) >= limit:
+                    break
+        return messages
+
+    @staticmethod
+    def _is_legacy(path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            first_line= f.readline().strip()
+        return bool(first_line) and "store" in orjson.loads(first_line)
+
+    def _append_disk(self, user: str, conv_id: str, messages: List[ChatMessage]):
+        path= self._file(user, conv_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if ChatHistoryStore._is_legacy(path):
+            # rewrite an old SimpleChatStore file once as json lines
+            messages= self.read_disk(user, conv_id) + messages
+            with open(path, "wb") as f:
+                f.writelines(ChatHistoryStore.to_record(message) + b"\n" for message in messages)
+            logger.info("Converted chat store of session %s to json lines", conv_id)
+            return
+        with open(path, "ab") as f:
+            f.writelines(ChatHistoryStore.to_record(message) + b"\n" for message in messages)
+
+    def create(self, user: str, conv_id: str):
+        """ Create the empty history file of a new conversation """
+        path= self._file(user, conv_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "ab").close()
+
+    async def seed(self, redis: Redis, user: str, conv_id: str) -> List[ChatMessage]:
+        """ Load a conversation from disk into its redis list (on toggling to an existing conversation), returns all messages """
+        messages= await asyncio.to_thread(self.read_disk, user, conv_id)
+        key= self.prefix + conv_id
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if messages:
+                pipe.rpush(key, *[ChatHistoryStore.to_record(message) for message in messages])
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+        return messages
+
+    async def load_memory(self, redis: Redis, user: str, conv_id: str) -> Tuple[ChatMemoryBuffer, int]:
+        """ Chat memory with the latest window messages of a conversation and the number of loaded messages.
+            Messages put into the memory after the loaded ones are the new turn passed to save_turn.
+        """
+        records= await redis.lrange(self.prefix + conv_id, -self.window, -1)
+        if records:
+            messages= [ChatHistoryStore.from_record(record) for record in records]
+        else:
+            # redis list expired or never filled, fall back to the disk copy
+            messages= (await self.seed(redis, user, conv_id))[-self.window:]
+        memory= ChatMemoryBuffer.from_defaults(token_limit=14000, chat_history=messages, chat_store_key=conv_id)
+        return memory, len(messages)
+
+    async def append(self, redis: Redis, user: str, conv_id: str, messages: List[ChatMessage]):
+        """ Append new messages of a conversation to its redis list and history file """
+        if not messages:
+            return
+        key= self.prefix + conv_id
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *[ChatHistoryStore.to_record(message) for message in messages])
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        await asyncio.to_thread(self._append_disk, user, conv_id, messages)
+
+    async def save_turn(self, redis: Redis, user: str, conv_id: str, memory: ChatMemoryBuffer, loaded_count: int):
+        """ Append the messages put into memory since load_memory """
+        await self.append(redis, user, conv_id, memory.get_all()[loaded_count:])
+
+    @staticmethod
+    def as_chat_store_json(conv_id: str, messages: List[ChatMessage]) -> str:
+        """ Conversation in the SimpleChatStore json format the frontend reads """
+        return SimpleChatStore(store={conv_id: messages}).json()
+
+
+# process wide instance
+chat_history_store= ChatHistoryStore()
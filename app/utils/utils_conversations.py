@@ -0,0 +1,134 @@
+from app.config import BACKEND_FASTAPI_LOG, USER_HISTORY, USER_HISTORY_SNAPSHOT_DELAY
+from app.utils.utils_logging import initialize_logging, logger
+from redis.asyncio import Redis
+from typing import Dict, List, Optional
+import asyncio
+import json
+import os
+import threading
+import time
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+
+# claim a conversation id and add it to the index of its user in one step, so an id is never owned without being listed
+_ADD_SCRIPT= """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+
+
+class ConversationIndex:
+    """ Conversation ids of every user in redis.
+        Each user has a sorted set conv_index:{user} (score = creation time, keeps the listing order) for O(1) membership checks,
+        the hash conv_owner maps every conversation id to its user so ids stay unique across users with an atomic HSETNX.
+        USER_HISTORY on disk is a write-behind snapshot in the old {user: [conv_id, ...]} format, rewritten once per batch of changes.
+    """
+    def __init__(self, path: str= USER_HISTORY, snapshot_delay: float= USER_HISTORY_SNAPSHOT_DELAY, prefix: str= "conv_index:", owner_key: str= "conv_owner"):
+        self.path= path
+        self.snapshot_delay= snapshot_delay
+        self.prefix= prefix
+        self.owner_key= owner_key
+        self._dirty= asyncio.Event()
+        self._writer: Optional[asyncio.Task]= None
+        self._add_script= None
+
+    async def load(self, redis: Redis):
+        """ Merge the USER_HISTORY snapshot into redis, called on startup """
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "r") as f:
+                user_history= json.load(f)
+            async with redis.pipeline(transaction=False) as pipe:
+                for user, conv_ids in user_history.items():
+                    if conv_ids:
+                        # positions as score keep the snapshot order ahead of newly created conversations
+                        pipe.zadd(self.prefix + user, {conv_id: position for position, conv_id in enumerate(conv_ids)}, nx=True)
+                        pipe.hset(self.owner_key, mapping={conv_id: user for conv_id in conv_ids})
+                await pipe.execute()
+            logger.info("Loaded conversations of %s users from %s", len(user_history), self.path)
+
+    async def add(self, redis: Redis, user: str, conv_id: str) -> bool:
+        """ Register a new conversation of user, False if the id is already taken by any user """
+        if self._add_script is None or self._add_script.registered_client is not redis:
+            self._add_script= redis.register_script(_ADD_SCRIPT)
+        if not await self._add_script(keys=[self.owner_key, self.prefix + user], args=[conv_id, user, time.time()]):
+            return False
+        self._dirty.set()
+        return True
+
+    async def contains(self, redis: Redis, user: str, conv_id: str) -> bool:
+        return await redis.zscore(self.prefix + user, conv_id) is not None
+
+    async def user_conversations(self, redis: Redis, user: str) -> List[str]:
+        """ Conversation ids of user, oldest first """
+        return [conv_id.decode("utf-8") for conv_id in await redis.zrange(self.prefix + user, 0, -1)]
+
+    async def remove(self, redis: Redis, user: str, conv_ids: List[str]):
+        if not conv_ids:
+            return
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.prefix + user, *conv_ids)
+            pipe.hdel(self.owner_key, *conv_ids)
+            await pipe.execute()
+        self._dirty.set()
+
+    async def _read_all(self, redis: Redis) -> Dict[str, List[str]]:
+        user_history= {}
+        async for key in redis.scan_iter(match=self.prefix + "*", count=100):
+            key= key.decode("utf-8")
+            user= key[len(self.prefix):]
+            user_history[user]= await self.user_conversations(redis, user)
+        return user_history
+
+    async def snapshot(self, redis: Redis):
+        """ Write the index of all users to USER_HISTORY, replacing the file atomically """
+        user_history= await self._read_all(redis)
+
+        def write():
+            # temp file unique per process and thread, several workers may snapshot at the same time
+            tmp_path= f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w") as fp:
+                    json.dump(user_history, fp)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        await asyncio.to_thread(write)
+
+    async def _writer_loop(self, redis: Redis):
+        while True:
+            await self._dirty.wait()
+            # collect the changes of the next few seconds into one snapshot
+            await asyncio.sleep(self.snapshot_delay)
+            self._dirty.clear()
+            try:
+                await self.snapshot(redis)
+            except Exception as e:
+                logger.error("Writing conversation snapshot %s failed: %s", self.path, str(e), exc_info=True)
+                self._dirty.set()
+
+    def start(self, redis: Redis):
+        """ Start the write-behind snapshot task, called by the FastAPI lifespan """
+        self._dirty= asyncio.Event()
+        self._writer= asyncio.create_task(self._writer_loop(redis))
+
+    async def close(self, redis: Redis):
+        """ Stop the snapshot task and write pending changes """
+        if self._writer is None:
+            return
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer= None
+        await self.snapshot(redis)
+
+
+# process wide instance, the snapshot task is started by the FastAPI lifespan
+conversation_index= ConversationIndex()
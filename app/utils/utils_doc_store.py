@@ -0,0 +1,157 @@
+from app.config import BACKEND_FASTAPI_LOG, DOC_STORE_RENDER_CACHE_MB
+from app.utils.utils_logging import initialize_logging, logger
+from collections import OrderedDict
+from fastapi.staticfiles import StaticFiles
+from functools import lru_cache
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import HTMLResponse, Response
+from starlette.types import Scope
+from typing import Dict, Hashable, Optional, Tuple
+import asyncio
+import base64
+import hashlib
+import orjson
+import os
+import re
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+# doc store folders are named by the binary hash of their document, so their pages never change
+_IMMUTABLE= "public, max-age=86400"
+
+
+@lru_cache(maxsize=1024)
+def gallery_html(pages: Tuple[int, ...]) -> Tuple[str, str]:
+    """ Html of a cited pages gallery and its ETag. Page urls are relative to the document folder,
+        thumbnails load lazily and open at full size on click
+    """
+    images= "".join(f"<a href='{page}.png' target='_blank' title='Page {page}'><img src='{page}.png' loading='lazy' alt='Page {page}' "
+                     f"style='width:240px;max-width:100%;margin:5px;border:1px solid #ccc;background:#fff;'/></a>" for page in pages)
+    body= (f"<html><head><title>Cited Pages</title></head><body style='margin:0;'>"
+           f"<div style='display:flex;flex-wrap:wrap;gap:12px;padding:24px;background:#222;'>{images}</div></body></html>")
+    etag= '"' + hashlib.md5(body.encode("utf-8")).hexdigest() + '"'
+    return body, etag
+
+
+class PageImageCache:
+    """ In-process LRU of rendered page images bounded by their total size in bytes """
+    def __init__(self, max_bytes: int= DOC_STORE_RENDER_CACHE_MB * 1024 * 1024):
+        self.max_bytes= max_bytes
+        self.size= 0
+        self.hits= 0
+        self.misses= 0
+        self._data: "OrderedDict[Hashable, bytes]"= OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        data= self._data.get(key)
+        if data is None:
+            self.misses+=1
+            return None
+        self.hits+=1
+        self._data.move_to_end(key)
+        return data
+
+    def set(self, key: Hashable, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old= self._data.pop(key, None)
+        if old is not None:
+            self.size-= len(old)
+        self._data[key]= data
+        self.size+= len(data)
+        while self.size > self.max_bytes:
+            _, evicted= self._data.popitem(last=False)
+            self.size-= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pages": len(self._data), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+class DocStoreFiles(StaticFiles):
+    """ Static files of /doc_store. A page image {folder}/{page_no}.png which is not on disk (DOCLING_PAGE_IMAGES=lazy, or documents parsed
+        before their pages were written) is rendered from the docling json in the same folder on its first request.
+        A miss decodes all pages of the document once, the rendered pages are kept in a size bounded PageImageCache.
+        {folder}/gallery.html?pages=3,4 is the gallery of cited pages of a document, cached and answered with 304 for a matching If-None-Match.
+    """
+    page_pattern= re.compile(r"^([^/\\]+)[/\\](\d+)\.png$")
+    gallery_pattern= re.compile(r"^([^/\\]+)[/\\]gallery\.html$")
+
+    def __init__(self, *args, cache: Optional[PageImageCache]= None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache= cache or PageImageCache()
+        self._locks: Dict[str, asyncio.Lock]= {}
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        gallery= self.gallery_pattern.match(path)
+        if gallery is not None:
+            return self.gallery_response(gallery.group(1), scope)
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            match= self.page_pattern.match(path)
+            if e.status_code != 404 or match is None:
+                raise
+            data= await self.render_page(match.group(1), int(match.group(2)))
+            if data is None:
+                raise
+            headers= {"Cache-Control": _IMMUTABLE, "ETag": f'"{match.group(1)}-{match.group(2)}"'}
+            if Headers(scope=scope).get("if-none-match") == headers["ETag"]:
+                return Response(status_code=304, headers=headers)
+            return Response(data, media_type="image/png", headers=headers)
+
+    def gallery_response(self, folder: str, scope: Scope) -> Response:
+        if self._folder_path(folder) is None:
+            raise HTTPException(status_code=404)
+        try:
+            pages= tuple(dict.fromkeys(int(page) for page in QueryParams(scope["query_string"]).get("pages", "").split(",") if page.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="pages must be a comma separated list of page numbers")
+        body, etag= gallery_html(pages)
+        headers= {"Cache-Control": _IMMUTABLE, "ETag": etag}
+        if Headers(scope=scope).get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(body, headers=headers)
+
+    def _folder_path(self, folder: str) -> Optional[str]:
+        """ Path of a doc store folder, None if it does not exist or is outside of the doc store """
+        root= os.path.realpath(str(self.directory))
+        folder_path= os.path.realpath(os.path.join(root, folder))
+        if os.path.dirname(folder_path) != root or not os.path.isdir(folder_path):
+            return None
+        return folder_path
+
+    async def render_page(self, folder: str, page_no: int) -> Optional[bytes]:
+        data= self.cache.get((folder, page_no))
+        if data is not None:
+            return data
+        # concurrent requests for pages of one document (the citation gallery) wait for a single load of its json
+        lock= self._locks.setdefault(folder, asyncio.Lock())
+        async with lock:
+            data= self.cache.get((folder, page_no))
+            if data is None:
+                pages= await asyncio.to_thread(self._load_pages, folder)
+                # requested page last so it is the most recently used one
+                for page, image in sorted(pages.items(), key=lambda item: item[0] == page_no):
+                    self.cache.set((folder, page), image)
+                data= pages.get(page_no)
+        self._locks.pop(folder, None)
+        return data
+
+    def _load_pages(self, folder: str) -> Dict[int, bytes]:
+        """ Page images of the docling json in a doc store folder by page number, empty if there is none """
+        folder_path= self._folder_path(folder)
+        if folder_path is None:
+            return {}
+        json_files= [file for file in os.listdir(folder_path) if file.endswith(".json")]
+        if not json_files:
+            return {}
+        with open(os.path.join(folder_path, json_files[0]), "rb") as f:
+            doc= orjson.loads(f.read())
+        pages= {}
+        for page_no, page in doc.get("pages", {}).items():
+            uri= (page.get("image") or {}).get("uri", "")
+            if uri.startswith("data:image/png"):
+                pages[int(page_no)]= base64.b64decode(uri.split(",", 1)[1])
+        logger.info("Rendered %s page images of %s from its docling json", len(pages), folder)
+        return pages
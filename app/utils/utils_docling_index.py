@@ -0,0 +1,94 @@
+from app.config import BACKEND_FASTAPI_LOG, DOCLING_HASH_IMAGESTORE, DOCLING_HASH_INDEX_DB
+from app.utils.utils_logging import initialize_logging, logger
+from typing import Dict, Optional
+import json
+import os
+import sqlite3
+import threading
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+_SCHEMA= """
+CREATE TABLE IF NOT EXISTS parsed_docs (
+    binary_hash TEXT PRIMARY KEY,
+    folder TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS legacy_imports (path TEXT PRIMARY KEY);
+"""
+
+
+class DoclingHashIndex:
+    """ Doc store folder of every document parsed by docling, keyed by its binary hash, in a shared SQLite database.
+        Inserts are single row upserts so concurrent ingestion workers (threads and parse processes) cannot overwrite each other's entries,
+        lookups are served from an in-process cache once a hash was found. Entries of the old json store are imported once.
+    """
+    def __init__(self, path: str= DOCLING_HASH_INDEX_DB, legacy_path: Optional[str]= DOCLING_HASH_IMAGESTORE):
+        self.path= path
+        self.legacy_path= legacy_path
+        self._cache: Dict[str, str]= {}
+        self._schema_ready= False
+        self._lock= threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn= sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    self._import_legacy_json(conn)
+                    self._schema_ready= True
+        return conn
+
+    def _import_legacy_json(self, conn: sqlite3.Connection):
+        """ Copy the entries of the json store written by earlier versions into the index once """
+        if not self.legacy_path or not os.path.exists(self.legacy_path) or os.stat(self.legacy_path).st_size == 0:
+            return
+        with conn:
+            if conn.execute("SELECT 1 FROM legacy_imports WHERE path = ?", (self.legacy_path,)).fetchone():
+                return
+            try:
+                with open(self.legacy_path, "r") as f:
+                    entries= json.load(f)
+                conn.executemany("INSERT OR IGNORE INTO parsed_docs (binary_hash, folder) VALUES (?, ?)", [(str(key), value) for key, value in entries.items()])
+                logger.info("Imported %s parsed documents from the legacy docling hash store %s", len(entries), self.legacy_path)
+            except Exception as e:
+                logger.error("Could not import legacy docling hash store %s: %s", self.legacy_path, str(e))
+            conn.execute("INSERT OR IGNORE INTO legacy_imports (path) VALUES (?)", (self.legacy_path,))
+
+    def get(self, binary_hash) -> Optional[str]:
+        """ Doc store folder of a parsed document, None if it was not parsed yet """
+        binary_hash= str(binary_hash)
+        folder= self._cache.get(binary_hash)
+        if folder is not None:
+            return folder
+        # misses are not cached, another worker may insert the document any time
+        conn= self._connect()
+        try:
+            row= conn.execute("SELECT folder FROM parsed_docs WHERE binary_hash = ?", (binary_hash,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        self._cache[binary_hash]= row[0]
+        return row[0]
+
+    def __contains__(self, binary_hash) -> bool:
+        return self.get(binary_hash) is not None
+
+    def add(self, binary_hash, folder: str):
+        """ Record the doc store folder of a parsed document """
+        binary_hash= str(binary_hash)
+        conn= self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO parsed_docs (binary_hash, folder) VALUES (?, ?)", (binary_hash, folder))
+        finally:
+            conn.close()
+        self._cache[binary_hash]= folder
+
+
+# process wide instance, every parse worker process has its own
+docling_hash_index= DoclingHashIndex()
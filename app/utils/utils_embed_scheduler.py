@@ -0,0 +1,127 @@
+from app.config import BACKEND_FASTAPI_LOG, EMBED_MAX_CONCURRENCY, EMBED_QUERY_RESERVED, EMBED_MAX_RETRIES, EMBED_RETRY_BACKOFF
+from app.utils.utils_logging import initialize_logging, logger
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+import asyncio
+import httpx
+import random
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+# request priorities
+QUERY= 0
+BULK= 1
+
+
+class _PriorityLimiter:
+    """ Concurrency limit of one embedding backend.
+        Waiting query requests are always granted before waiting bulk requests, and bulk requests never hold more than bulk_limit slots.
+    """
+    def __init__(self, limit: int, bulk_limit: int):
+        self.limit= limit
+        self.bulk_limit= bulk_limit
+        self.active= 0
+        self.active_bulk= 0
+        self._waiters: Dict[int, Deque[asyncio.Future]]= {QUERY: deque(), BULK: deque()}
+
+    def _can_run(self, priority: int) -> bool:
+        if self.active >= self.limit:
+            return False
+        return priority == QUERY or self.active_bulk < self.bulk_limit
+
+    def _take(self, priority: int):
+        self.active+=1
+        if priority == BULK:
+            self.active_bulk+=1
+
+    def _wake(self):
+        for priority in (QUERY, BULK):
+            waiters= self._waiters[priority]
+            while waiters and self._can_run(priority):
+                future= waiters.popleft()
+                if not future.done():
+                    self._take(priority)
+                    future.set_result(None)
+
+    async def acquire(self, priority: int):
+        ahead= self._waiters[QUERY] if priority == QUERY else (self._waiters[QUERY] or self._waiters[BULK])
+        if not ahead and self._can_run(priority):
+            self._take(priority)
+            return
+        future= asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was granted while the caller got cancelled
+                self.release(priority)
+            else:
+                self._waiters[priority].remove(future)
+            raise
+
+    def release(self, priority: int):
+        self.active-=1
+        if priority == BULK:
+            self.active_bulk-=1
+        self._wake()
+
+
+class EmbeddingScheduler:
+    """ Bounds the concurrent requests per embedding backend url (one vLLM port per model in port_vllm_col, or the ollama server)
+        and retries transient failures (connection errors, 429, 5xx) with exponential backoff.
+        Query embeddings use priority QUERY so live chats do not queue behind a large ingestion.
+    """
+    def __init__(self, max_concurrency: int= EMBED_MAX_CONCURRENCY, query_reserved: int= EMBED_QUERY_RESERVED, max_retries: int= EMBED_MAX_RETRIES, backoff: float= EMBED_RETRY_BACKOFF):
+        self.max_concurrency= max(1, max_concurrency)
+        self.bulk_limit= max(1, self.max_concurrency - query_reserved)
+        self.max_retries= max_retries
+        self.backoff= backoff
+        self._limiters: Dict[str, _PriorityLimiter]= {}
+
+    def _limiter(self, key: str) -> _PriorityLimiter:
+        limiter= self._limiters.get(key)
+        if limiter is None:
+            limiter= _PriorityLimiter(limit=self.max_concurrency, bulk_limit=self.bulk_limit)
+            self._limiters[key]= limiter
+        return limiter
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return isinstance(error, httpx.TransportError)
+
+    async def run(self, key: str, request: Callable[[], Awaitable[Any]], priority: int= BULK) -> Any:
+        """ Run request (a coroutine factory, called again on retry) within the concurrency limit of key
+
+        Args:
+            key (str): embedding backend url
+            request: callable returning the request coroutine
+            priority (int): QUERY or BULK
+        """
+        limiter= self._limiter(key)
+        attempt= 0
+        while True:
+            await limiter.acquire(priority)
+            try:
+                return await request()
+            except Exception as e:
+                if attempt >= self.max_retries or not EmbeddingScheduler._retryable(e):
+                    raise
+                error= e
+            finally:
+                limiter.release(priority)
+            # back off without holding a slot
+            delay= self.backoff * (2 ** attempt) * (1 + random.random())
+            attempt+=1
+            logger.warning("Embedding request to %s failed (%s), retry %s/%s in %.1fs", key, str(error), attempt, self.max_retries, delay)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {key: {"active": limiter.active, "active_bulk": limiter.active_bulk, "waiting_query": len(limiter._waiters[QUERY]), "waiting_bulk": len(limiter._waiters[BULK])}
+                for key, limiter in self._limiters.items()}
+
+
+# process wide instance shared by query embedding and ingestion
+embedding_scheduler= EmbeddingScheduler()
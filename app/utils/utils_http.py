@@ -0,0 +1,51 @@
+from app.config import (BACKEND_FASTAPI_LOG, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP_CONNECT_TIMEOUT,
+                        HTTP_READ_TIMEOUT, HTTP_POOL_TIMEOUT, HTTP2_ENABLED)
+from app.utils.utils_logging import initialize_logging, logger
+from typing import Dict
+from urllib.parse import urlsplit
+import httpx
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+# one keep-alive client per backend origin (scheme, host, port), so every vLLM port gets its own connection limit
+_HTTP_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    """ HTTP/2 needs the optional h2 package, fall back to HTTP/1.1 keep-alive without it """
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2_ENABLED is set but h2 is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """ Return the shared async client for the backend serving url, creating it on first use
+
+    Args:
+        url (str): full request url of the embedding or rerank backend
+    """
+    parts= urlsplit(url)
+    origin= f"{parts.scheme}://{parts.netloc}"
+    client= _HTTP_CLIENTS.get(origin)
+    if client is None or client.is_closed:
+        client= httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+        )
+        _HTTP_CLIENTS[origin]= client
+        logger.info("Created shared http client for %s", origin)
+    return client
+
+
+async def close_http_clients():
+    """ Close every shared client, called on shutdown of the FastAPI lifespan """
+    clients= list(_HTTP_CLIENTS.values())
+    _HTTP_CLIENTS.clear()
+    for client in clients:
+        await client.aclose()
@@ -1,11 +1,16 @@
 from app.Ingestion_workflows.docling_parse_process import Docling_parser
 from app.Ingestion_workflows.milvus_ingest import ingest2milvus
-from app.config import MILVUS_URI, TOKEN, BACKEND_FASTAPI_LOG, col_mod, DOC_NAME_METADATA, MILVUS_ROOT_ROLE
+from app.config import MILVUS_URI, TOKEN, BACKEND_FASTAPI_LOG, col_mod, DOC_NAME_METADATA, MILVUS_ROOT_ROLE, FILES_DB, DOCLING_PREWARM
+from app.utils.utils_cache import answer_cache
 from app.utils.utils_logging import initialize_logging, logger
-from pymilvus import connections, Collection, AsyncMilvusClient, MilvusClient
+from app.utils.utils_milvus import MilvusClientPool, pooled_client, pooled_async_client
 from pymilvus.exceptions import MilvusException
+from datasets import Dataset
+from typing import List, Optional
+from uuid import uuid4
 import os
 import asyncio
+import shutil
 lock = asyncio.Lock()
 # logging config
 initialize_logging(BACKEND_FASTAPI_LOG)
@@ -43,50 +48,107 @@ class FileUploadValidator:
 #         return False, "Error while processing, document was not saved"
 
 
-async def milvus_db_as_excel(collection_name: str):
+async def milvus_db_as_excel(collection_name: str, milvus_pool: Optional[MilvusClientPool]= None):
     logger.info(" Internal API called to retrieve collection %s",collection_name)
+    res= []
     try:
-        connections.connect(
-                        alias="default",
-                        uri=MILVUS_URI,
-                        token=TOKEN,
-                        )
-        collection = Collection(collection_name)
-        res = collection.query(expr="id >=0", output_fields=["id","metadata", "text_concat", "text"])
-        connections.disconnect("default")
+        async with pooled_async_client(milvus_pool, token=TOKEN) as async_client:
+            res = await async_client.query(collection_name=collection_name, filter="id >=0", output_fields=["id","metadata", "text_concat", "text"])
     except Exception as e:
         logger.error(str(e),exc_info=True)
     return res
 
-async def ingest(parsed_doc, file: str, user_name: str, ingest_collection: str, user_milvus_pass: str, conv_id: str):
-    """ Postprocess docling parsed data and ingest it to milvus
+def stage_file(file_path: str, validator: FileUploadValidator) -> str:
+    """ Validate a file to be ingested and copy it to FILES_DB, returns the path of the copy
 
     Args:
-        filename (str): filename which is parsed
-        user_name (str): user_name
+        file_path (str): uploaded file
+        validator (FileUploadValidator): size and format check
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    is_valid, message = validator.validate_file(file_path)
+    if not is_valid:
+        raise ValueError(message)
+    os.makedirs(FILES_DB, exist_ok=True)
+    filename = os.path.basename(file_path)
+    destination = os.path.join(FILES_DB, filename)
+    if os.path.exists(destination):
+        base, ext = os.path.splitext(filename)
+        destination = os.path.join(FILES_DB, f"{base}_{uuid4().hex}{ext}")
+    shutil.copy(file_path, destination)
+    return destination
+
+def init_parse_worker(prewarm: bool= DOCLING_PREWARM):
+    """ Initializer of an ingestion pipeline worker process: creates the DocumentConverter reused for all its documents, loading the models if prewarm """
+    Docling_parser.get_converter(warm=prewarm)
+
+def parse_page_range(file: str, page_range: tuple) -> str:
+    """ Parse one page range of a sharded pdf, runs in an ingestion pipeline worker process. Returns the path of the parsed fragment """
+    return Docling_parser.parse_docling_range(source=file, page_range=page_range)
+
+def parse_document(file: str, collection_name: str, fragment_paths: Optional[List[str]]= None):
+    """ Parse a file with docling (or stitch its parsed page range files) and post process it, runs in an ingestion pipeline worker process """
+    return Docling_parser().docling_ingest(file=file, collection_name=collection_name, fragment_paths=fragment_paths)
+
+def remove_files(paths: List[str]):
+    """ Remove intermediate files, missing ones are ignored """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def chunk_document(parsed_doc, ingest_collection: str) -> Dataset:
+    """ Chunk a parsed document for a collection, blocking (run in a worker thread) """
+    return ingest2milvus.chunk(parsed_doc, collection_name=ingest_collection)
+
+async def store_chunks(chunked_parsed: Dataset, file: str, ingest_collection: str, user_milvus_pass: str, conv_id: str, milvus_pool: Optional[MilvusClientPool]= None):
+    """ Embed and insert the chunks of a document into milvus
+
+    Args:
+        chunked_parsed (Dataset): chunks of the document from chunk_document
+        file (str): filename which is parsed
         ingest_collection (str): collection to ingest to
         user_milvus_pass (str): user milvus password
         conv_id (str): session_id
+        milvus_pool: app wide client pool holding the connection for user_milvus_pass
     """
-    # chunk and ingest to milvus
-    logger.info("Chunking document of %s elements post parsing for collection %s for session: %s", len(parsed_doc), ingest_collection, conv_id)
-    chunked_parsed= await asyncio.to_thread(ingest2milvus.chunk, parsed_doc, collection_name=ingest_collection)
     milvus_ingestor= ingest2milvus()
     data= await milvus_ingestor.preprocess_chunks(dataset=chunked_parsed)
     logger.info("ingesting %s rows for session: %s to collection %s", len(chunked_parsed), conv_id, ingest_collection)
-    response, message= await milvus_ingestor.milvus_ingest(uri= MILVUS_URI, token= user_milvus_pass, data= data, collection_name=ingest_collection)
+    response, message= await milvus_ingestor.milvus_ingest(uri= MILVUS_URI, token= user_milvus_pass, data= data, collection_name=ingest_collection, milvus_pool=milvus_pool)
     logger.info(" Milvus reponse to ingestion of %s for session: %s is %s", file, conv_id, message)
+    if response:
+        # cached answers of this collection may miss the new document
+        await answer_cache.bump_version(ingest_collection)
     return response, message
 
-async def check_admin(user: str):
+async def ingest(parsed_doc, file: str, user_name: str, ingest_collection: str, user_milvus_pass: str, conv_id: str, milvus_pool: Optional[MilvusClientPool]= None):
+    """ Postprocess docling parsed data and ingest it to milvus
+
+    Args:
+        filename (str): filename which is parsed
+        user_name (str): user_name
+        ingest_collection (str): collection to ingest to
+        user_milvus_pass (str): user milvus password
+        conv_id (str): session_id
+        milvus_pool: app wide client pool holding the connection for user_milvus_pass
+    """
+    # chunk and ingest to milvus
+    logger.info("Chunking document of %s elements post parsing for collection %s for session: %s", len(parsed_doc), ingest_collection, conv_id)
+    chunked_parsed= await asyncio.to_thread(chunk_document, parsed_doc, ingest_collection)
+    return await store_chunks(chunked_parsed, file=file, ingest_collection=ingest_collection, user_milvus_pass=user_milvus_pass, conv_id=conv_id, milvus_pool=milvus_pool)
+
+async def check_admin(user: str, milvus_pool: Optional[MilvusClientPool]= None):
     """ Check if user has admin privileges or not
     """
-    client= MilvusClient(uri=MILVUS_URI, token= TOKEN)
-    if MILVUS_ROOT_ROLE in client.describe_user(user_name=user)["roles"]:
+    async with pooled_client(milvus_pool, token=TOKEN) as client:
+        user_description= await asyncio.to_thread(client.describe_user, user_name=user)
+    if MILVUS_ROOT_ROLE in user_description["roles"]:
         admin_access_flag= True
     else: 
         admin_access_flag= False
-    client.close()
     return admin_access_flag
 
 async def combine_per_doc_metadata(read_collection, doc_list, date_list):
@@ -116,11 +178,11 @@ async def remove_duplicates_by_key(dict_list):
         logger.error("error occured while getting metadata to display in the document tab of frontend: %s" , str(e))
     return [{k: deduped[k]} for k in sorted(deduped)]
 
-async def get_doc_in_collection(read_collection: str, uri= MILVUS_URI, token=TOKEN):
+async def get_doc_in_collection(read_collection: str, uri= MILVUS_URI, token=TOKEN, milvus_pool: Optional[MilvusClientPool]= None):
     async with lock:
-        async_client= AsyncMilvusClient(uri, token= token)
         try:
-            existing_data= await async_client.query(collection_name=read_collection, filter="id >=0", output_fields=["id","metadata"])
+            async with pooled_async_client(milvus_pool, token=token, uri=uri) as async_client:
+                existing_data= await async_client.query(collection_name=read_collection, filter="id >=0", output_fields=["id","metadata"])
         except MilvusException as e: 
             logger.warning(str(e))
             raise MilvusException(message=str(e))
@@ -132,7 +194,6 @@ async def get_doc_in_collection(read_collection: str, uri= MILVUS_URI, token=TOK
             metadata_list_date=[i.strip() for i in metadata_date.split("AND")]
             metadata_list= await combine_per_doc_metadata(read_collection=read_collection, doc_list=metadata_list_doc, date_list=metadata_list_date)
             doc_list.extend(metadata_list)
-        await async_client.close()
         final_doc_list= await remove_duplicates_by_key(doc_list)
         return final_doc_list
 
@@ -0,0 +1,158 @@
+from app.config import BACKEND_FASTAPI_LOG, INGEST_JOB_STATUS_TTL, INGEST_JOB_CLAIM_IDLE, INGEST_JOB_MAX_ATTEMPTS
+from app.utils.utils_logging import initialize_logging, logger
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from typing import Any, Dict, List, Optional
+import asyncio
+import orjson
+import os
+import socket
+import time
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+INGEST_STATUS_QUEUED = "queued"
+INGEST_STATUS_PROCESSING = "processing"
+INGEST_STATUS_COMPLETED = "completed"
+INGEST_STATUS_FAILED = "failed"
+
+
+class IngestionJobQueue:
+    """ Batch ingestion jobs and their status in redis, so queued and running jobs survive a backend restart.
+        Jobs are entries of the stream ingest:jobs read through a consumer group and acknowledged only once they completed or failed (at-least-once).
+        Entries of a crashed backend stay pending and are claimed again after claim_idle seconds, entries of running jobs
+        are kept fresh by a heartbeat. A job delivered more than max_attempts times is marked failed.
+        The status of every job is a hash ingest:job:{job_id} which expires status_ttl seconds after the job finished,
+        listed through the sorted sets ingest:job_index (all jobs) and ingest:job_index:{conv_id} (score = enqueue time).
+    """
+    def __init__(self, status_ttl: int= INGEST_JOB_STATUS_TTL, claim_idle: float= INGEST_JOB_CLAIM_IDLE, max_attempts: int= INGEST_JOB_MAX_ATTEMPTS,
+                 prefix: str= "ingest:", group: str= "ingest_workers"):
+        self.status_ttl= status_ttl
+        self.claim_idle= claim_idle
+        self.max_attempts= max_attempts
+        self.prefix= prefix
+        self.stream= prefix + "jobs"
+        self.group= group
+        self.consumer= f"{socket.gethostname()}:{os.getpid()}"
+        self.redis: Optional[Redis]= None
+        self._in_flight: Dict[str, bytes]= {}
+        self._heartbeat: Optional[asyncio.Task]= None
+
+    def _status_key(self, job_id: str) -> str:
+        return self.prefix + "job:" + job_id
+
+    def _index_key(self, conv_id: Optional[str]= None) -> str:
+        return self.prefix + "job_index" + (":" + conv_id if conv_id else "")
+
+    async def start(self, redis: Redis):
+        """ Create the consumer group and start the heartbeat of running jobs, called by the FastAPI lifespan """
+        self.redis= redis
+        try:
+            await redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        # forget consumers of earlier backend processes once nothing is pending for them
+        for consumer in await redis.xinfo_consumers(self.stream, self.group):
+            if consumer["pending"] == 0 and consumer["idle"] > self.claim_idle * 1000:
+                await redis.xgroup_delconsumer(self.stream, self.group, consumer["name"])
+        self._heartbeat= asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat= None
+
+    async def enqueue(self, job: Dict[str, Any]):
+        """ Store the queued status of a new job and add it to the stream """
+        now= time.time()
+        status= {"job_id": job["job_id"], "filename": job["filename"], "conv_id": job["conv_id"], "ingest_collection": job["ingest_collection"],
+                 "status": INGEST_STATUS_QUEUED, "message": "Waiting", "attempts": 0, "created": now}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._status_key(job["job_id"]), mapping=status)
+            pipe.zadd(self._index_key(), {job["job_id"]: now})
+            pipe.zadd(self._index_key(job["conv_id"]), {job["job_id"]: now})
+            pipe.xadd(self.stream, {"job": orjson.dumps(job)})
+            await pipe.execute()
+
+    async def get(self) -> Dict[str, Any]:
+        """ Next job to process: first a pending job left behind by a crashed worker, otherwise a new one (blocks until there is one) """
+        while True:
+            _, entries, *_ = await self.redis.xautoclaim(self.stream, self.group, self.consumer, min_idle_time=int(self.claim_idle * 1000), start_id="0-0", count=1)
+            if not entries:
+                response= await self.redis.xreadgroup(self.group, self.consumer, streams={self.stream: ">"}, count=1, block=5000)
+                entries= response[0][1] if response else []
+            for entry_id, fields in entries:
+                if not fields:
+                    # entry deleted while pending
+                    await self.redis.xack(self.stream, self.group, entry_id)
+                    continue
+                job= orjson.loads(fields[b"job"])
+                attempts= await self.redis.hincrby(self._status_key(job["job_id"]), "attempts", 1)
+                if attempts > self.max_attempts:
+                    logger.error("Ingestion job %s for %s was started %s times, giving up", job["job_id"], job.get("filename"), attempts - 1)
+                    await self._finish(job["job_id"], entry_id, status=INGEST_STATUS_FAILED, message="Ingestion interrupted too many times")
+                    continue
+                if attempts > 1:
+                    logger.warning("Resuming ingestion job %s for %s (attempt %s)", job["job_id"], job.get("filename"), attempts)
+                self._in_flight[job["job_id"]]= entry_id
+                return job
+
+    async def update(self, job_id: str, **updates: Any):
+        """ Update the status of a running job """
+        await self.redis.hset(self._status_key(job_id), mapping=updates)
+
+    async def done(self, job_id: str, status: str, message: str):
+        """ Store the final status of a job and acknowledge it, the status expires after status_ttl """
+        await self._finish(job_id, self._in_flight.pop(job_id, None), status=status, message=message)
+
+    async def _finish(self, job_id: str, entry_id: Optional[bytes], status: str, message: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._status_key(job_id), mapping={"status": status, "message": message, "finished": time.time()})
+            pipe.expire(self._status_key(job_id), self.status_ttl)
+            if entry_id is not None:
+                pipe.xack(self.stream, self.group, entry_id)
+                pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.claim_idle / 3)
+            if not self._in_flight:
+                continue
+            try:
+                # claiming own entries resets their idle time so other workers do not take over running jobs
+                await self.redis.xclaim(self.stream, self.group, self.consumer, min_idle_time=0, message_ids=list(self._in_flight.values()), justid=True)
+            except Exception as e:
+                logger.warning("Ingestion job heartbeat failed: %s", str(e))
+
+    async def status(self, conv_id: Optional[str]= None) -> List[Dict[str, Any]]:
+        """ Status of all jobs (or the jobs of one conversation) which have not expired, oldest first """
+        index_key= self._index_key(conv_id)
+        job_ids= [job_id.decode("utf-8") for job_id in await self.redis.zrange(index_key, 0, -1)]
+        if not job_ids:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for job_id in job_ids:
+                pipe.hgetall(self._status_key(job_id))
+            statuses= await pipe.execute()
+        jobs, expired= [], []
+        for job_id, status in zip(job_ids, statuses):
+            if not status:
+                expired.append(job_id)
+                continue
+            jobs.append({"job_id": job_id, "filename": status[b"filename"].decode("utf-8"), "conv_id": status[b"conv_id"].decode("utf-8"),
+                         "ingest_collection": status[b"ingest_collection"].decode("utf-8"), "status": status[b"status"].decode("utf-8"),
+                         "message": status[b"message"].decode("utf-8")})
+        if expired:
+            # drop expired jobs from the index lazily
+            await self.redis.zrem(index_key, *expired)
+        return jobs
+
+
+# process wide instance, started by the FastAPI lifespan
+ingestion_jobs= IngestionJobQueue()
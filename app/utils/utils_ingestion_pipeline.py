@@ -0,0 +1,162 @@
+from app.config import BACKEND_FASTAPI_LOG, INGEST_PARSE_WORKERS, INGEST_CHUNK_WORKERS, INGEST_STORE_WORKERS, INGEST_STAGE_QUEUE_SIZE, DOCLING_PREWARM, DOCLING_SHARD_PAGES
+from app.Ingestion_workflows.docling_parse_process import Docling_parser
+from app.utils.utils_ingestion_jobs import IngestionJobQueue, INGEST_STATUS_PROCESSING, INGEST_STATUS_COMPLETED, INGEST_STATUS_FAILED
+from app.utils.utils_ingestion import FileUploadValidator, stage_file, init_parse_worker, parse_page_range, parse_document, remove_files, chunk_document, store_chunks
+from app.utils.utils_logging import initialize_logging, logger
+from app.utils.utils_milvus import MilvusClientPool
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import asyncio
+import multiprocessing
+import os
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+
+class IngestionPipeline:
+    """ Staged ingestion of queued batch jobs so several documents are in flight at once:
+        parse: docling parsing in a process pool (keeps the event loop and the GIL free for chat traffic),
+               pdfs longer than shard_pages are split into page ranges parsed by several worker processes and stitched back together
+               from the fragment files they wrote
+        chunk: chunking in a thread pool
+        store: embedding and milvus insertion as async tasks
+        Every stage has its own number of workers, stages are connected by bounded queues so a fast stage waits for a slow one
+        instead of piling parsed documents up in memory.
+    """
+    def __init__(self, parse_workers: int= INGEST_PARSE_WORKERS, chunk_workers: int= INGEST_CHUNK_WORKERS, store_workers: int= INGEST_STORE_WORKERS,
+                 queue_size: int= INGEST_STAGE_QUEUE_SIZE, validator: Optional[FileUploadValidator]= None, prewarm: bool= DOCLING_PREWARM,
+                 shard_pages: int= DOCLING_SHARD_PAGES):
+        self.parse_workers= max(1, parse_workers)
+        self.chunk_workers= max(1, chunk_workers)
+        self.store_workers= max(1, store_workers)
+        self.queue_size= max(1, queue_size)
+        self.validator= validator or FileUploadValidator(max_size_mb=50)
+        self.prewarm= prewarm
+        self.shard_pages= shard_pages
+        self._process_pool: Optional[ProcessPoolExecutor]= None
+        self._thread_pool: Optional[ThreadPoolExecutor]= None
+        self._tasks: List[asyncio.Task]= []
+
+    def start(self, jobs: IngestionJobQueue, milvus_pool: Optional[MilvusClientPool]= None):
+        """ Start the stage workers, called by the FastAPI lifespan
+
+        Args:
+            jobs (IngestionJobQueue): queued batch jobs and their status, a job is marked done once it completed or failed
+            milvus_pool (MilvusClientPool): app wide client pool
+        """
+        # spawn: workers must not inherit the event loop, open sockets or threads of the server process
+        # every worker process builds its DocumentConverter once in the initializer and keeps it warm for all later documents
+        self._process_pool= ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_parse_worker, initargs=(self.prewarm,))
+        self._thread_pool= ThreadPoolExecutor(max_workers=self.chunk_workers, thread_name_prefix="ingest_chunk")
+        self._jobs= jobs
+        self._milvus_pool= milvus_pool
+        parsed= asyncio.Queue(maxsize=self.queue_size)
+        chunked= asyncio.Queue(maxsize=self.queue_size)
+        self._tasks= ([asyncio.create_task(self._parse_worker(parsed)) for _ in range(self.parse_workers)]
+                      + [asyncio.create_task(self._chunk_worker(parsed, chunked)) for _ in range(self.chunk_workers)]
+                      + [asyncio.create_task(self._store_worker(chunked)) for _ in range(self.store_workers)])
+        if self.prewarm:
+            self._tasks.append(asyncio.create_task(self._prewarm_workers()))
+        logger.info("Ingestion pipeline started with %s parse, %s chunk and %s store workers", self.parse_workers, self.chunk_workers, self.store_workers)
+
+    async def _prewarm_workers(self):
+        """ Start all parse worker processes now so the docling models are loaded before the first job arrives """
+        loop= asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._process_pool, os.getpid) for _ in range(self.parse_workers)))
+            logger.info("Docling parse workers started and warmed up")
+        except Exception as e:
+            logger.error("Warming up docling parse workers failed: %s", str(e), exc_info=True)
+
+    async def _fail(self, job: Dict[str, Any], exc: Exception):
+        logger.error(
+            "Batch ingestion failed for %s in conversation %s: %s",
+            job.get("filename"),
+            job.get("conv_id"),
+            str(exc),
+            exc_info=True,
+        )
+        await self._jobs.done(job["job_id"], status=INGEST_STATUS_FAILED, message=str(exc))
+
+    async def _parse_worker(self, parsed: asyncio.Queue):
+        loop= asyncio.get_running_loop()
+        while True:
+            job: Dict[str, Any]= await self._jobs.get()
+            try:
+                await self._jobs.update(job["job_id"], status=INGEST_STATUS_PROCESSING, message="Parsing")
+                destination= await asyncio.to_thread(stage_file, job["file"], self.validator)
+                parsed_doc= await self._parse(loop, destination, job["ingest_collection"])
+            except Exception as exc:
+                await self._fail(job, exc)
+                continue
+            await parsed.put((job, destination, parsed_doc))
+
+    async def _parse(self, loop: asyncio.AbstractEventLoop, file: str, collection_name: str):
+        page_ranges= await asyncio.to_thread(Docling_parser.page_ranges, file, self.shard_pages)
+        if not page_ranges:
+            return await loop.run_in_executor(self._process_pool, parse_document, file, collection_name)
+        logger.info("Parsing %s in %s page ranges of %s pages", file, len(page_ranges), self.shard_pages)
+        # shards write their fragments to files, only the paths travel between the processes
+        results= await asyncio.gather(*(loop.run_in_executor(self._process_pool, parse_page_range, file, page_range) for page_range in page_ranges),
+                                      return_exceptions=True)
+        fragment_paths= [result for result in results if isinstance(result, str)]
+        try:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return await loop.run_in_executor(self._process_pool, parse_document, file, collection_name, fragment_paths)
+        finally:
+            await asyncio.to_thread(remove_files, fragment_paths)
+
+    async def _chunk_worker(self, parsed: asyncio.Queue, chunked: asyncio.Queue):
+        loop= asyncio.get_running_loop()
+        while True:
+            job, destination, parsed_doc= await parsed.get()
+            try:
+                await self._jobs.update(job["job_id"], message="Chunking")
+                logger.info("Chunking document of %s elements post parsing for collection %s for session: %s", len(parsed_doc), job["ingest_collection"], job["conv_id"])
+                chunked_parsed= await loop.run_in_executor(self._thread_pool, chunk_document, parsed_doc, job["ingest_collection"])
+            except Exception as exc:
+                await self._fail(job, exc)
+                continue
+            finally:
+                del parsed_doc
+            await chunked.put((job, destination, chunked_parsed))
+
+    async def _store_worker(self, chunked: asyncio.Queue):
+        while True:
+            job, destination, chunked_parsed= await chunked.get()
+            try:
+                await self._jobs.update(job["job_id"], message="Embedding and inserting")
+                response, ingest_message= await store_chunks(
+                    chunked_parsed,
+                    file=destination,
+                    ingest_collection=job["ingest_collection"],
+                    user_milvus_pass=job["milvus_password"],
+                    conv_id=job["conv_id"],
+                    milvus_pool=self._milvus_pool,
+                )
+                if not response:
+                    raise RuntimeError(ingest_message)
+            except Exception as exc:
+                await self._fail(job, exc)
+                continue
+            await self._jobs.done(job["job_id"], status=INGEST_STATUS_COMPLETED, message=ingest_message or "Ingestion successful")
+
+    async def close(self):
+        """ Stop the stage workers and the worker pools, jobs in flight stay pending in the job queue and are resumed after a restart """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks= []
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool= None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool= None
+
+
+# process wide instance, the stage workers are started by the FastAPI lifespan
+ingestion_pipeline= IngestionPipeline()
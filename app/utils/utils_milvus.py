@@ -0,0 +1,199 @@
+from app.config import MILVUS_URI, TOKEN, BACKEND_FASTAPI_LOG, MILVUS_POOL_MAX_CLIENTS, MILVUS_POOL_HEALTH_INTERVAL
+from app.utils.utils_logging import initialize_logging, logger
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pymilvus import AsyncMilvusClient, MilvusClient
+from typing import AsyncIterator, Awaitable, Optional, Set
+import asyncio
+import time
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+# teardown tasks of short lived clients, referenced until they finished
+_closing: Set[asyncio.Task]= set()
+
+
+def close_in_background(close: Awaitable, name: str= "Milvus client"):
+    """ Close a client without keeping the caller (and the response) waiting for it """
+    async def run():
+        try:
+            await close
+        except Exception as e:
+            logger.warning("Error while closing %s: %s", name, str(e))
+    task= asyncio.create_task(run())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+class _PooledClients:
+    """ Sync and async Milvus clients sharing one credential """
+    def __init__(self, uri: str, token: str):
+        self.uri= uri
+        self.token= token
+        self.client: Optional[MilvusClient]= None
+        self.async_client: Optional[AsyncMilvusClient]= None
+        self.in_use= 0
+        self.last_checked= time.monotonic()
+
+    async def get_client(self) -> MilvusClient:
+        if self.client is None:
+            self.client= await asyncio.to_thread(MilvusClient, uri=self.uri, token=self.token)
+        return self.client
+
+    async def get_async_client(self) -> AsyncMilvusClient:
+        if self.async_client is None:
+            self.async_client= AsyncMilvusClient(self.uri, token=self.token)
+        return self.async_client
+
+    async def is_healthy(self, use_async: bool= False) -> bool:
+        """ Ping the server with the client the borrower is about to use, a client which was not opened yet connects fresh and is not pinged """
+        try:
+            if use_async:
+                if self.async_client is not None:
+                    # AsyncMilvusClient has no public ping, allocating a timestamp is one cheap round trip to the server
+                    await self.async_client._get_connection().alloc_timestamp(timeout=5)
+            elif self.client is not None:
+                await asyncio.to_thread(self.client.get_server_version)
+            return True
+        except Exception as e:
+            logger.warning("Milvus pooled connection failed health check: %s", str(e))
+            return False
+
+    async def close(self):
+        if self.async_client is not None:
+            try:
+                await self.async_client.close()
+            except Exception as e:
+                logger.warning("Error while closing pooled async Milvus client: %s", str(e))
+            self.async_client= None
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception as e:
+                logger.warning("Error while closing pooled Milvus client: %s", str(e))
+            self.client= None
+
+
+class MilvusClientPool:
+    """ Long lived Milvus connections keyed by credential, owned by the FastAPI lifespan.
+        The root TOKEN entry is pinned, user credentials are evicted least recently used once max_size is reached.
+        Connections idle for longer than health_check_interval seconds are pinged before reuse and reconnected if dead.
+    """
+    def __init__(self, uri: str= MILVUS_URI, root_token: str= TOKEN, max_size: int= MILVUS_POOL_MAX_CLIENTS, health_check_interval: float= MILVUS_POOL_HEALTH_INTERVAL):
+        self.uri= uri
+        self.root_token= root_token
+        self.max_size= max(1, max_size)
+        self.health_check_interval= health_check_interval
+        self._entries: "OrderedDict[str, _PooledClients]"= OrderedDict()
+        self._lock= asyncio.Lock()
+
+    async def _evict(self):
+        """ Close least recently used idle entries until the pool fits into max_size """
+        for token in list(self._entries.keys()):
+            if len(self._entries) <= self.max_size:
+                return
+            entry= self._entries[token]
+            if token == self.root_token or entry.in_use:
+                continue
+            del self._entries[token]
+            await entry.close()
+        if len(self._entries) > self.max_size:
+            logger.warning("Milvus client pool above max size %s as all connections are in use", self.max_size)
+
+    async def _checkout(self, token: Optional[str], use_async: bool= False) -> _PooledClients:
+        token= token or self.root_token
+        async with self._lock:
+            entry= self._entries.get(token)
+            if entry is None:
+                entry= _PooledClients(uri=self.uri, token=token)
+                self._entries[token]= entry
+            self._entries.move_to_end(token)
+            entry.in_use+=1
+            await self._evict()
+            # only the sole borrower checks health, later borrowers may share the entry while it is pinged
+            needs_check= entry.in_use == 1 and time.monotonic() - entry.last_checked > self.health_check_interval
+            if needs_check:
+                entry.last_checked= time.monotonic()
+        # health check outside of the pool lock so a slow ping does not block other credentials
+        if needs_check and not await entry.is_healthy(use_async):
+            entry= await self._replace(entry)
+        return entry
+
+    async def _replace(self, entry: _PooledClients) -> _PooledClients:
+        """ Swap a dead entry for a fresh one and move the checkout over to it. Other borrowers keep the dead entry
+            until they check in, the last one closes it, so no client is closed under a running request
+        """
+        async with self._lock:
+            if self._entries.get(entry.token) is entry:
+                self._entries[entry.token]= _PooledClients(uri=self.uri, token=entry.token)
+            fresh= self._entries.get(entry.token)
+            if fresh is None:
+                # pool closed during the health check
+                return entry
+            fresh.in_use+=1
+            entry.in_use-=1
+            if not entry.in_use:
+                await entry.close()
+            logger.info("Reconnected pooled Milvus connection after a failed health check")
+            return fresh
+
+    async def _checkin(self, entry: _PooledClients):
+        async with self._lock:
+            entry.in_use-=1
+            # evicted or replaced entries are closed by their last borrower
+            if self._entries.get(entry.token) is not entry and not entry.in_use:
+                await entry.close()
+
+    @asynccontextmanager
+    async def client(self, token: Optional[str]= None) -> AsyncIterator[MilvusClient]:
+        """ Borrow the pooled sync client for token (root TOKEN if not given) """
+        entry= await self._checkout(token)
+        try:
+            yield await entry.get_client()
+        finally:
+            await self._checkin(entry)
+
+    @asynccontextmanager
+    async def async_client(self, token: Optional[str]= None) -> AsyncIterator[AsyncMilvusClient]:
+        """ Borrow the pooled async client for token (root TOKEN if not given) """
+        entry= await self._checkout(token, use_async=True)
+        try:
+            yield await entry.get_async_client()
+        finally:
+            await self._checkin(entry)
+
+    async def close(self):
+        async with self._lock:
+            entries= list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            await entry.close()
+        logger.info("Closed %s pooled Milvus connections", len(entries))
+
+
+@asynccontextmanager
+async def pooled_client(milvus_pool: Optional[MilvusClientPool], token: str= TOKEN, uri: str= MILVUS_URI) -> AsyncIterator[MilvusClient]:
+    """ Borrow a sync client from the pool, or open a short lived one if no pool is available (scripts, tests) """
+    if milvus_pool is not None:
+        async with milvus_pool.client(token) as client:
+            yield client
+        return
+    client= MilvusClient(uri=uri, token=token)
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+@asynccontextmanager
+async def pooled_async_client(milvus_pool: Optional[MilvusClientPool], token: str= TOKEN, uri: str= MILVUS_URI) -> AsyncIterator[AsyncMilvusClient]:
+    """ Borrow an async client from the pool, or open a short lived one if no pool is available (scripts, tests) """
+    if milvus_pool is not None:
+        async with milvus_pool.async_client(token) as client:
+            yield client
+        return
+    client= AsyncMilvusClient(uri, token=token)
+    try:
+        yield client
+    finally:
+        close_in_background(client.close(), name="short lived async Milvus client")
@@ -1,4 +1,5 @@
-from typing import List
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -14,11 +15,13 @@ class feedback_model(BaseModel):
     LLM_response: str
     feedback: str
     feedback_comment: str
+    interaction_id: Optional[str] = None  # X-Interaction-Id header of the chat response
 
 class Message_request(BaseModel):
     """ Message template for data sent to API """
     conv_id: str
     message: str
+    collections: Optional[List[str]] = None  # read several collections at once (federated retrieval), the session collection if not given
 
 class Ingest_req(BaseModel):
     """ Message template for data sent to API """
@@ -33,6 +36,12 @@ class BatchIngestReq(BaseModel):
     files: List[str]
     ingest_collection: str
 
+class BatchQueryReq(BaseModel):
+    """ Stateless batch of questions to one collection (offline evaluation, bulk Q&A) """
+    questions: List[str]
+    collection: str
+    generate: bool = False  # also generate cited answers, otherwise only retrieve and rerank
+
 class change_session(BaseModel):
     """ When user toggles between session ids """
     old_conv_id: str
@@ -54,3 +63,17 @@ class RerankResult(BaseModel):
     text:str
     score:float
     index:int
+
+@dataclass(slots=True)
+class RetrievedChunk:
+    """ One retrieved (and possibly reranked) chunk as it flows from retrieval through the citation workflow, cite() and logging.
+        metadata is the milvus metadata dict of the chunk, text is only kept for reranked chunks which go into the prompt.
+    """
+    doc_id: str
+    score: float
+    metadata: Dict[str, Any]
+    text: Optional[str]= None
+
+    def log_entry(self) -> str:
+        """ Retrieval log representation, without the chunk text """
+        return str({"Doc_id": self.doc_id, "Metadata": self.metadata, "score": self.score})
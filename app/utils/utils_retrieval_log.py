@@ -0,0 +1,226 @@
+from app.config import BACKEND_FASTAPI_LOG, RETRIEVAL_LOG_DB, RETRIEVAL_LOG_PATH, retrieval_observe_columns
+from app.utils.utils_logging import initialize_logging, logger
+from contextlib import closing
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import pandas as pd
+import sqlite3
+import threading
+# logging config
+initialize_logging(BACKEND_FASTAPI_LOG)
+
+# sqlite column for each column of the retrieval log excel layout (retrieval_observe_columns)
+_COLUMN_MAP= {
+    "time": "time",
+    "chat_session": "chat_session",
+    "question": "question",
+    "retrievals": "retrievals",
+    "reranked_results": "reranked_results",
+    "collection": "collection",
+    "LLM_response": "llm_response",
+    "Citations": "citations",
+    "Feedback (like/dislike)": "feedback",
+    "Feedback (Comments)": "feedback_comment",
+}
+
+_SCHEMA= """
+CREATE TABLE IF NOT EXISTS retrieval_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    time TEXT, chat_session TEXT, question TEXT, retrievals TEXT, reranked_results TEXT,
+    collection TEXT, llm_response TEXT, citations TEXT,
+    feedback TEXT DEFAULT 'N/A', feedback_comment TEXT DEFAULT 'N/A'
+);
+CREATE INDEX IF NOT EXISTS idx_retrieval_log_user ON retrieval_log (user, chat_session);
+CREATE TABLE IF NOT EXISTS legacy_imports (user TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS feedback (
+    interaction_id TEXT NOT NULL,
+    user TEXT NOT NULL,
+    feedback TEXT, feedback_comment TEXT, time TEXT,
+    PRIMARY KEY (interaction_id, user)
+);
+"""
+
+
+class RetrievalLogStore:
+    """ Append-only retrieval log in a shared SQLite database.
+        Chat requests only enqueue a row, a background writer task inserts queued rows in batches.
+        Reads wait only for the queued rows of their user, not for the whole write queue.
+        The per user excel layout is still available through export_excel.
+    """
+    def __init__(self, path: str= RETRIEVAL_LOG_DB, legacy_path: str= RETRIEVAL_LOG_PATH, batch_size: int= 64):
+        self.path= path
+        self.legacy_path= legacy_path
+        self.batch_size= batch_size
+        self._queue: Optional[asyncio.Queue]= None
+        self._writer: Optional[asyncio.Task]= None
+        self._imported_users= set()
+        self._schema_ready= False
+        self._lock= threading.Lock()
+        # queued rows per user, the condition is notified after every written batch
+        self._pending: Dict[str, int]= {}
+        self._written: Optional[asyncio.Condition]= None
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn= sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(_SCHEMA)
+                    # stores created before interaction ids were logged
+                    if "interaction_id" not in [column[1] for column in conn.execute("PRAGMA table_info(retrieval_log)")]:
+                        conn.execute("ALTER TABLE retrieval_log ADD COLUMN interaction_id TEXT")
+                    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_retrieval_log_interaction ON retrieval_log (interaction_id)")
+                    self._schema_ready= True
+        return conn
+
+    def _import_legacy_excel(self, conn: sqlite3.Connection, user: str):
+        """ Copy the rows of a user's old excel log into the store once, so exports keep the full history """
+        if user in self._imported_users:
+            return
+        if conn.execute("SELECT 1 FROM legacy_imports WHERE user = ?", (user,)).fetchone():
+            self._imported_users.add(user)
+            return
+        legacy_file= self.legacy_path.format(user=user)
+        try:
+            if os.path.exists(legacy_file):
+                df= pd.read_excel(legacy_file, dtype=str).fillna("")
+                rows= [{"user": user, **{column: row.get(excel_column, "") for excel_column, column in _COLUMN_MAP.items()}} for row in df.to_dict(orient="records")]
+                # rows and import marker are committed together, a half done import is rolled back with the transaction
+                conn.execute("SAVEPOINT legacy_import")
+                try:
+                    RetrievalLogStore._insert(conn, rows)
+                    conn.execute("INSERT OR IGNORE INTO legacy_imports (user) VALUES (?)", (user,))
+                except Exception:
+                    conn.execute("ROLLBACK TO legacy_import")
+                    raise
+                finally:
+                    conn.execute("RELEASE legacy_import")
+                logger.info("Imported %s legacy retrieval log rows of user %s", len(rows), user)
+            else:
+                conn.execute("INSERT OR IGNORE INTO legacy_imports (user) VALUES (?)", (user,))
+            self._imported_users.add(user)
+        except Exception as e:
+            # retried on the next access of the user
+            logger.error("Could not import legacy retrieval log %s: %s", legacy_file, str(e))
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, rows: List[Dict[str, Any]]):
+        columns= ["user", "interaction_id"] + list(_COLUMN_MAP.values())
+        conn.executemany(
+            f"INSERT INTO retrieval_log ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [tuple(row.get(column, None if column == "interaction_id" else "N/A") for column in columns) for row in rows],
+        )
+
+    def _write_rows(self, rows: List[Dict[str, Any]]):
+        with closing(self._connect()) as conn, conn:
+            for user in {row["user"] for row in rows}:
+                self._import_legacy_excel(conn, user)
+            RetrievalLogStore._insert(conn, rows)
+
+    async def _writer_loop(self):
+        while True:
+            rows= [await self._queue.get()]
+            while len(rows) < self.batch_size and not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except Exception as e:
+                logger.error("Writing %s retrieval log rows failed: %s", len(rows), str(e), exc_info=True)
+            finally:
+                for row in rows:
+                    self._pending[row["user"]]-= 1
+                    if not self._pending[row["user"]]:
+                        del self._pending[row["user"]]
+                    self._queue.task_done()
+                async with self._written:
+                    self._written.notify_all()
+
+    def start(self):
+        """ Start the background writer, called by the FastAPI lifespan """
+        self._queue= asyncio.Queue()
+        self._written= asyncio.Condition()
+        self._writer= asyncio.create_task(self._writer_loop())
+
+    async def close(self):
+        """ Flush queued rows and stop the writer """
+        if self._writer is None:
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer= None
+
+    async def log(self, row: Dict[str, Any]):
+        """ Append one interaction. row holds user, interaction_id plus the sqlite columns of _COLUMN_MAP """
+        if self._writer is not None:
+            self._pending[row["user"]]= self._pending.get(row["user"], 0) + 1
+            self._queue.put_nowait(row)
+        else:
+            await asyncio.to_thread(self._write_rows, [row])
+
+    async def _wait_for_user(self, user: str):
+        """ Wait until the rows of user queued so far are written """
+        if self._writer is None:
+            return
+        async with self._written:
+            await self._written.wait_for(lambda: user not in self._pending)
+
+    def _set_feedback(self, interaction_id: str, user: str, feedback: str, feedback_comment: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO feedback (interaction_id, user, feedback, feedback_comment, time) VALUES (?, ?, ?, ?, datetime('now'))",
+                (interaction_id, user, feedback, feedback_comment),
+            )
+
+    async def set_feedback(self, interaction_id: str, user: str, feedback: str, feedback_comment: str):
+        """ Store feedback for one logged interaction by its id, independent of whether the row was written yet """
+        await asyncio.to_thread(self._set_feedback, interaction_id, user, feedback, feedback_comment)
+
+    def _update_feedback(self, user: str, conv_id: str, llm_response: str, feedback: str, feedback_comment: str) -> int:
+        with closing(self._connect()) as conn, conn:
+            self._import_legacy_excel(conn, user)
+            cursor= conn.execute(
+                "UPDATE retrieval_log SET feedback = ?, feedback_comment = ? WHERE user = ? AND chat_session = ? AND llm_response = ?",
+                (feedback, feedback_comment, user, conv_id, llm_response),
+            )
+            return cursor.rowcount
+
+    async def update_feedback(self, user: str, conv_id: str, llm_response: str, feedback: str, feedback_comment: str) -> int:
+        """ Set feedback on the logged interactions of a session with the given response, returns number of rows updated.
+            Fallback for clients which do not send the interaction id.
+        """
+        updated= await asyncio.to_thread(self._update_feedback, user, conv_id, llm_response, feedback, feedback_comment)
+        if not updated and user in self._pending:
+            # the interaction may still sit in the write queue, retry once the queued rows of the user are written
+            await self._wait_for_user(user)
+            updated= await asyncio.to_thread(self._update_feedback, user, conv_id, llm_response, feedback, feedback_comment)
+        return updated
+
+    def _read_user(self, user: str) -> pd.DataFrame:
+        with closing(self._connect()) as conn, conn:
+            self._import_legacy_excel(conn, user)
+            columns= ", ".join(f'COALESCE(f.{column}, r.{column}) AS "{excel_column}"' if column in ("feedback", "feedback_comment") else f'r.{column} AS "{excel_column}"'
+                               for excel_column, column in _COLUMN_MAP.items())
+            df= pd.read_sql_query(f"SELECT {columns} FROM retrieval_log r LEFT JOIN feedback f ON f.interaction_id = r.interaction_id AND f.user = r.user WHERE r.user = ? ORDER BY r.id", conn, params=(user,))
+        return df[retrieval_observe_columns]
+
+    async def export_excel(self, user: str, path: Optional[str]= None) -> str:
+        """ Write the log of a user in the retrieval_observe_columns excel layout, by default to RETRIEVAL_LOG_PATH """
+        await self._wait_for_user(user)
+        path= path or self.legacy_path.format(user=user)
+        df= await asyncio.to_thread(self._read_user, user)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await asyncio.to_thread(df.to_excel, path, index=False)
+        return path
+
+
+# process wide instance, the writer task is started by the FastAPI lifespan
+retrieval_log_store= RetrievalLogStore()
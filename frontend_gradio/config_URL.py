@@ -7,6 +7,7 @@ load_dotenv(os.path.join(os.path.dirname(__file__), 'utils/dev_frontend.env'))
 API_CONV_START= "http://localhost:8000//conversation/start"
 API_VALIDATE_USER= "http://localhost:8000/validate_user/{user}"
 API_CONV_SEND=  "http://localhost:8000/conversation/{session_id_user}/message"
+API_CONV_STREAM=  "http://localhost:8000/conversation/{session_id_user}/message/stream"
 API_GET_HISTORY= "http://localhost:8000/get_conversation/{session_id_user}"
 API_LOGOUT= "http://localhost:8000/logout"
 API_GET_EXISTING_CONV= "http://localhost:8000/get_existing_conv_ids/{session_id_user}"
@@ -11,7 +11,7 @@ import pandas as pd
 from config_URL import (
     API_VALIDATE_USER,
     API_CONV_START,
-    API_CONV_SEND,
+    API_CONV_STREAM,
     API_GET_HISTORY,
     API_LOGOUT,
     API_CREATE_EMPTY_COLLECTION,
@@ -26,6 +26,7 @@ from utils.utils_helper_func import (
     get_batch_status_frontend,
     empty_batch_status_frame,
     feedback_logger,
+    iter_sse_events,
 )
 from utils.utils_logging import logger, initialize_logging, FRONTEND_LOG
 
@@ -47,6 +48,8 @@ class SessionState:
         self.poll_active = False
         self.batch_status_df = empty_batch_status_frame()
         self.poll_grace_cycles = 0
+        # bot reply -> interaction id of the backend log, sent back with feedback
+        self.interaction_ids = {}
 
     def auth_headers(self):
         if not self.access_token:
@@ -263,51 +266,62 @@ def upload_files(filepaths, request: gr.Request):
     )
 
 def send_chat(message, request: gr.Request):
-    """ Send user message to chat api and get response
+    """ Send user message to the streaming chat api and yield the reply as it is generated
 
     Args:
         message (str): user_message
         request (gr.Request): requests from user session
 
-    Returns:
-        reply: reply from chatbot
+    Yields:
+        reply: reply from chatbot so far, the last one includes the citations
     """
     session_state = session_instances.get(request.session_hash)
     if not session_state or not session_state.authenticated:
-        return "Please authenticate first."
+        yield "Please authenticate first."
+        return
     data = {"conv_id": session_state.session_id, "message": message}
+    reply = ""
     try:
-        response = requests.post(
-            API_CONV_SEND.format(
+        with requests.post(
+            API_CONV_STREAM.format(
                 session_id_user=f"{session_state.session_id}${session_state.username}"
             ),
             json=data,
             headers=session_state.auth_headers(),
-        )
-        response.raise_for_status()
-        reply = str(response.json())
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for event, payload in iter_sse_events(response):
+                if event in ("token", "citations"):
+                    reply += payload
+                    yield reply
+                elif event == "done":
+                    session_state.interaction_ids[reply] = payload["interaction_id"]
+                elif event == "error":
+                    raise RuntimeError(payload)
         logger.info(
             "Bot response successful for user: %s for session id: %s",
             session_state.username,
             session_state.session_id,
         )
-        return reply
     except Exception as e:
         logger.error(
             "Got an error during getting bot response for session id: %s: %s",
             session_state.session_id,
             str(e),
         )
-        return f"Chat error: {str(e)}"
+        yield f"Chat error: {str(e)}"
 
 def respond(message, chat_history, request: gr.Request):
-        if message:
-            response= send_chat(message, request=request)
-        else:
-            response= "What can I help you with?"
         chat_history.append(ChatMessage(role="user", content=message))
-        chat_history.append(ChatMessage(role="assistant", content=response))
-        return "",chat_history
+        if not message:
+            chat_history.append(ChatMessage(role="assistant", content="What can I help you with?"))
+            yield "", chat_history
+            return
+        chat_history.append(ChatMessage(role="assistant", content=""))
+        for reply in send_chat(message, request=request):
+            chat_history[-1] = ChatMessage(role="assistant", content=reply)
+            yield "", chat_history
 
 def handle_feedback(like_data: gr.LikeData, request:gr.Request):
     """Handle like/dislike events and show feedback input for dislikes"""
@@ -323,6 +337,7 @@ def handle_feedback(like_data: gr.LikeData, request:gr.Request):
             LLM_response=like_data.value[0],
             feedback="Positive",
             feedback_comment="N/A",
+            interaction_id=session_state.interaction_ids.get(like_data.value[0]),
             headers=session_state.auth_headers(),
         )
         if not feedback_response:
@@ -343,6 +358,7 @@ def submit_feedback(feedback_text, message_content, request:gr.Request):
             LLM_response=message_content,
             feedback="Negative",
             feedback_comment=feedback_text,
+            interaction_id=session_state.interaction_ids.get(message_content),
             headers=session_state.auth_headers(),
         )
         print(f"Feedback received for message '{message_content}': {feedback_text}")
@@ -37,6 +37,23 @@ def feedback_logger(*, headers=None, **kwargs):
     response_feedback.raise_for_status()
     return response_feedback.json()
 
+def iter_sse_events(response: requests.Response):
+    """ Parse the server-sent events of a streamed requests response
+
+    Yields:
+        (event, data) with data json decoded
+    """
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 def get_all_sessions(username: str, new_conv_id: str, headers=None) -> list:
     """ Get all sessions from redis conversation tracker followed by filtering on which ones are actually present in chat history db
 
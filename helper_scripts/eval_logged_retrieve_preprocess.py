@@ -28,20 +28,30 @@ def add_ground_truth(log_dataset, eval_path):
                 interaction["Ground Truth Contexts"]= df_eval.at[index, "Relevant Context"]
     return log_dataset 
 
-def doc_id_to_text(milvus_data, retrieval_json_data):
+def doc_id_to_text(milvus_data, retrieval_json_data, collection_name):
     """ In reranked_results, just have a string with chunk 1:.. chunk 2:
-    get the contents of these chunks from milvus collection data"""
+    get the contents of these chunks from milvus collection data.
+    Federated interactions log their Doc_id as 'collection:id', the data of these collections is fetched once and kept in milvus_data
+
+    Args:
+        milvus_data (Dict[str, pd.DataFrame]): collection data by collection name
+        retrieval_json_data (list[Dict]): logged interactions
+        collection_name (str): collection of Doc_ids without a collection prefix
+    """
     
     for retrieval in retrieval_json_data:
         results= retrieval["reranked_results"].split("\n")
         matches= []
         for res in results: 
-            match = re.search(r"'Doc_id':\s*'(\d+)'", res)
+            match = re.search(r"'Doc_id':\s*'(?:([^':]+):)?(\d+)'", res)
             if match:
-                matches.append(match.group(1))
+                matches.append((match.group(1) or collection_name, match.group(2)))
         retrieval["reranked_results"]=""
-        for match in matches: 
-            retrieval["reranked_results"]= retrieval["reranked_results"]+ '\n\n\n##' + milvus_data.loc[milvus_data["id"]==match, "text"].iloc[0]
+        for collection, match in matches: 
+            if collection not in milvus_data:
+                milvus_data[collection]= get_data(collection=collection)
+            data= milvus_data[collection]
+            retrieval["reranked_results"]= retrieval["reranked_results"]+ '\n\n\n##' + data.loc[data["id"]==match, "text"].iloc[0]
         retrieval["eval_question"]=""
         retrieval["Ground Truth Answer"]= ""
         retrieval["Ground Truth Contexts"]= ""
@@ -51,9 +61,9 @@ def userlog_to_json(path, collection_name, eval_path="./data/Evaluation dataset.
     df= pd.read_excel(path)
     df.drop(labels="retrievals", axis=1, inplace=True)
     retrieval_json= json.loads(df.to_json(orient="table"))
-    milvus_data= get_data(collection=collection_name)
+    milvus_data= {collection_name: get_data(collection=collection_name)}
     retrieval_json_data= retrieval_json["data"]
-    retrieval_log_dataset= doc_id_to_text(milvus_data=milvus_data, retrieval_json_data=retrieval_json_data)
+    retrieval_log_dataset= doc_id_to_text(milvus_data=milvus_data, retrieval_json_data=retrieval_json_data, collection_name=collection_name)
     retrieval_log_dataset_complete= add_ground_truth(log_dataset=copy.deepcopy(retrieval_log_dataset), eval_path=eval_path)
     json_name= "/".join(path.split("/")[0:-1]) + '/' + path.split("/")[-1].split(".")[0]
     with open(f'{json_name}.json', 'w', encoding="utf8") as json_file:
@@ -0,0 +1,75 @@
+"""
+1. Test batch query: questions missing in the embedding cache are encoded in one request, cached questions are not encoded again
+2. Test batch query: questions share multi-vector hybrid searches of search_size questions and results keep the order of the questions
+3. Test batch query: a collection which is not in the collections claim of the user is rejected with 403 before any retrieval, whether it exists or not
+"""
+import contextlib
+import pytest
+from fastapi import HTTPException
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.config import col_mod
+from app.main import batch_query
+from app.utils import utils_LLM
+from app.utils.utils_cache import EmbeddingCache
+from app.utils.utils_req_templates import RetrievedChunk
+
+@pytest.fixture
+def encode_calls(monkeypatch):
+    calls = []
+
+    async def encode_text(batch, model, instruct=None, priority=None):
+        calls.append(list(batch["text_concat"]))
+        batch["dense_embedding"] = [[float(len(text))] for text in batch["text_concat"]]
+        return batch
+
+    monkeypatch.setattr(utils_LLM, "embedding_cache", EmbeddingCache())
+    monkeypatch.setattr(utils_LLM.ingest2milvus, "encode_text", encode_text)
+    return calls
+
+@pytest.mark.asyncio
+async def test_embed_queries_batches_misses(encode_calls):
+    assert await utils_LLM.embed_queries(["a", "bb", "a"], model="m") == [[[1.0]], [[2.0]], [[1.0]]]
+    assert await utils_LLM.embed_queries(["bb", "ccc"], model="m") == [[[2.0]], [[3.0]]]
+    assert encode_calls == [["a", "bb"], ["ccc"]]
+
+@pytest.mark.asyncio
+async def test_batch_retrieve_multi_vector_searches(encode_calls, monkeypatch):
+    searches = []
+
+    class Client:
+        async def hybrid_search(self, collection_name, reqs, ranker, limit, output_fields):
+            questions = reqs[0].data
+            searches.append(questions)
+            return [[{"id": question, "distance": 1.0, "entity": {"text_concat": question, "metadata": {}}}] for question in questions]
+
+    @contextlib.asynccontextmanager
+    async def pooled_async_client(milvus_pool, token, uri):
+        yield Client()
+
+    async def rerank_documents(query, documents, device, top_k, model_name):
+        return [RetrievedChunk(doc_id=str(hit["id"]), score=1.0, metadata={}, text=hit["entity"]["text_concat"]) for hit in documents[0]]
+
+    class AnnSearchRequest:
+        def __init__(self, data, **kwargs):
+            self.data = data
+
+    monkeypatch.setattr(utils_LLM, "pooled_async_client", pooled_async_client)
+    monkeypatch.setattr(utils_LLM, "rerank_documents", rerank_documents)
+    monkeypatch.setattr(utils_LLM, "AnnSearchRequest", AnnSearchRequest)
+    monkeypatch.setattr(utils_LLM, "RRFRanker", lambda: None)
+    questions = ["q1", "q2", "q3", "q4", "q5"]
+    retrieved = await utils_LLM.batch_retrieve(uri="", token="", questions=questions, collection_name="support", model="m", search_size=2)
+    assert searches == [["q1", "q2"], ["q3", "q4"], ["q5"]]
+    assert [reranked[0].doc_id for _, reranked in retrieved] == questions
+    assert len(encode_calls) == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("collection", [next(iter(col_mod)), "no_such_collection"])
+async def test_batch_query_forbidden_collection(collection):
+    request = MagicMock(questions=["q1"], collection=collection, generate=False)
+    current_user = MagicMock(username="user1", admin=False, collections=[])
+    with patch("app.main.batch_retrieve", new_callable=AsyncMock) as batch_retrieve:
+        with pytest.raises(HTTPException) as excinfo:
+            await batch_query(request, current_user)
+    assert excinfo.value.status_code == 403
+    batch_retrieve.assert_not_called()
@@ -0,0 +1,104 @@
+"""
+1. Test TTL cache: least recently used entry is evicted once max size is reached
+2. Test TTL cache: expired entries are not returned
+3. Test embedding cache: whitespace variants of a question share an entry and hits/misses are counted
+4. Test embedding cache: redis tier is read on local miss and written on set
+5. Test answer cache: near identical query embeddings hit, dissimilar ones miss
+6. Test answer cache: bumping the collection version invalidates cached answers
+7. Test embedding cache: bulk lookups read redis with one MGET and bulk writes use one pipeline
+"""
+import orjson
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.utils.utils_cache import TTLCache, EmbeddingCache, AnswerCache
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(max_size=2, ttl=10)
+    with patch("app.utils.utils_cache.time.monotonic", return_value=100.0):
+        cache.set("a", 1)
+    with patch("app.utils.utils_cache.time.monotonic", return_value=111.0):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+@pytest.mark.asyncio
+async def test_embedding_cache_normalizes_and_counts():
+    cache = EmbeddingCache(max_size=4, ttl=60)
+    assert await cache.get("model", "instruct", "How do I  reset\nmy password?") is None
+    await cache.set("model", "instruct", "How do I reset my password?", [[0.1, 0.2]])
+    assert await cache.get("model", "instruct", " How do I reset my password? ") == [[0.1, 0.2]]
+    assert await cache.get("other_model", "instruct", "How do I reset my password?") is None
+    assert cache.stats() == {"hits": 1, "redis_hits": 0, "misses": 2, "size": 1}
+
+@pytest.mark.asyncio
+async def test_embedding_cache_redis_tier():
+    redis_mock = AsyncMock()
+    redis_mock.get.return_value = orjson.dumps([[0.5]])
+    cache = EmbeddingCache(max_size=4, ttl=60)
+    cache.attach_redis(redis_mock)
+    assert await cache.get("model", None, "question") == [[0.5]]
+    assert cache.stats()["redis_hits"] == 1
+    # second lookup is served from the local tier
+    assert await cache.get("model", None, "question") == [[0.5]]
+    assert redis_mock.get.await_count == 1
+    await cache.set("model", None, "other question", [[0.7]])
+    redis_mock.set.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_answer_cache_similarity_threshold():
+    cache = AnswerCache(max_size=4, ttl=60, threshold=0.95)
+    await cache.set("support", [[1.0, 0.0, 0.0]], {"final_response": "cached"})
+    assert await cache.get("support", [[0.99, 0.05, 0.0]]) == {"final_response": "cached"}
+    assert await cache.get("support", [[0.0, 1.0, 0.0]]) is None
+    assert await cache.get("compliance_center", [[1.0, 0.0, 0.0]]) is None
+    assert cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_answer_cache_invalidated_by_ingestion():
+    cache = AnswerCache(max_size=4, ttl=60, threshold=0.95)
+    await cache.set("support", [[1.0, 0.0]], {"final_response": "cached"})
+    await cache.bump_version("support")
+    assert await cache.get("support", [[1.0, 0.0]]) is None
+
+@pytest.mark.asyncio
+async def test_embedding_cache_bulk_redis_round_trips():
+    class Pipeline:
+        def __init__(self):
+            self.sets = []
+            self.executed = 0
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+        def set(self, key, value, ex):
+            self.sets.append(key)
+
+        async def execute(self):
+            self.executed += 1
+
+    pipe = Pipeline()
+    redis_mock = AsyncMock()
+    redis_mock.mget.return_value = [orjson.dumps([[0.5]]), None]
+    redis_mock.pipeline = lambda transaction: pipe
+    cache = EmbeddingCache(max_size=8, ttl=60)
+    cache.attach_redis(redis_mock)
+    await cache.set_many("model", None, {"local": [[0.1]]})
+    assert await cache.get_many("model", None, ["local", "shared", "new"]) == [[[0.1]], [[0.5]], None]
+    redis_mock.mget.assert_awaited_once()
+    assert len(redis_mock.mget.await_args.args[0]) == 2
+    assert cache.stats() == {"hits": 1, "redis_hits": 1, "misses": 1, "size": 2}
+    await cache.set_many("model", None, {"new": [[0.9]], "other": [[0.8]]})
+    assert len(pipe.sets) == 3 and pipe.executed == 2
+    redis_mock.get.assert_not_awaited()
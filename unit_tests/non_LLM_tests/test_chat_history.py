@@ -0,0 +1,27 @@
+"""
+1. Test chat history: new turns are appended to the history file as json lines
+2. Test chat history: an old SimpleChatStore file is read and converted to json lines on the first append
+"""
+import json
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from app.utils.utils_chat_history import ChatHistoryStore
+
+def test_append_writes_json_lines(tmp_path):
+    store = ChatHistoryStore(path=str(tmp_path / "{user}" / "{conv_id}.json"))
+    store.create("alice", "conv")
+    assert store.read_disk("alice", "conv") == []
+    store._append_disk("alice", "conv", [ChatMessage(role=MessageRole.USER, content="question")])
+    store._append_disk("alice", "conv", [ChatMessage(role=MessageRole.ASSISTANT, content="answer")])
+    lines = (tmp_path / "alice" / "conv.json").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"role": "user", "content": "question"}, {"role": "assistant", "content": "answer"}]
+    assert [message.content for message in store.read_disk("alice", "conv", limit=1)] == ["question"]
+
+def test_legacy_chat_store_is_converted(tmp_path):
+    store = ChatHistoryStore(path=str(tmp_path / "{user}" / "{conv_id}.json"))
+    (tmp_path / "alice").mkdir()
+    legacy = {"store": {"conv": [{"role": "user", "additional_kwargs": {}, "blocks": [{"block_type": "text", "text": "old question"}]}]}, "class_name": "SimpleChatStore"}
+    (tmp_path / "alice" / "conv.json").write_text(json.dumps(legacy))
+    assert [message.content for message in store.read_disk("alice", "conv")] == ["old question"]
+    store._append_disk("alice", "conv", [ChatMessage(role=MessageRole.ASSISTANT, content="answer")])
+    lines = (tmp_path / "alice" / "conv.json").read_text().splitlines()
+    assert [json.loads(line)["content"] for line in lines] == ["old question", "answer"]
@@ -0,0 +1,54 @@
+"""
+1. Test page image cache: least recently used pages are evicted once the cache exceeds its size in bytes
+2. Test doc store: a page image missing on disk is rendered from the docling json of its folder, unknown pages stay 404
+3. Test doc store: the cited pages gallery of a document links its pages and is answered with 304 for a matching ETag
+"""
+import base64
+import json
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.utils.utils_doc_store import DocStoreFiles, PageImageCache
+
+def test_page_image_cache_evicts_by_size():
+    cache = PageImageCache(max_bytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.set("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+    assert cache.size == 8
+
+def test_doc_store_renders_missing_page(tmp_path):
+    png = b"\x89PNG\r\n\x1a\nfake page"
+    folder = tmp_path / "abc123"
+    folder.mkdir()
+    (folder / "1.png").write_bytes(b"on disk")
+    doc = {"pages": {"1": {"image": {"uri": "data:image/png;base64," + base64.b64encode(b"json page 1").decode()}},
+                     "2": {"image": {"uri": "data:image/png;base64," + base64.b64encode(png).decode()}}}}
+    (folder / "abc123.json").write_text(json.dumps(doc))
+    app = FastAPI()
+    files = DocStoreFiles(directory=str(tmp_path))
+    app.mount("/doc_store", files, name="doc_store")
+    client = TestClient(app)
+    assert client.get("/doc_store/abc123/1.png").content == b"on disk"
+    response = client.get("/doc_store/abc123/2.png")
+    assert response.status_code == 200 and response.content == png
+    assert response.headers["content-type"] == "image/png"
+    assert client.get("/doc_store/abc123/3.png").status_code == 404
+    assert client.get("/doc_store/missing/1.png").status_code == 404
+    assert files.cache.get(("abc123", 2)) == png
+
+def test_doc_store_gallery_etag(tmp_path):
+    (tmp_path / "abc123").mkdir()
+    app = FastAPI()
+    app.mount("/doc_store", DocStoreFiles(directory=str(tmp_path)), name="doc_store")
+    client = TestClient(app)
+    response = client.get("/doc_store/abc123/gallery.html?pages=3,4,3")
+    assert response.status_code == 200
+    assert response.text.count("<img") == 2 and "src='4.png'" in response.text
+    etag = response.headers["etag"]
+    assert client.get("/doc_store/abc123/gallery.html?pages=3,4", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/doc_store/abc123/gallery.html?pages=5", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/doc_store/missing/gallery.html?pages=1").status_code == 404
+    assert client.get("/doc_store/abc123/gallery.html?pages=x").status_code == 400
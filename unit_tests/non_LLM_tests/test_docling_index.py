@@ -0,0 +1,25 @@
+"""
+1. Test docling hash index: entries of the legacy json store are imported once and found by hash
+2. Test docling hash index: entries added by one worker are visible to another instance and neither overwrites the other
+"""
+import json
+from app.utils.utils_docling_index import DoclingHashIndex
+
+def test_legacy_json_import(tmp_path):
+    legacy = tmp_path / "hash_store.json"
+    legacy.write_text(json.dumps({"123": "/doc_store/123"}))
+    index = DoclingHashIndex(path=str(tmp_path / "index.sqlite"), legacy_path=str(legacy))
+    assert index.get(123) == "/doc_store/123"
+    assert "456" not in index
+    # changes of the legacy file after the import are ignored
+    legacy.write_text(json.dumps({"456": "/doc_store/456"}))
+    assert "456" not in DoclingHashIndex(path=str(tmp_path / "index.sqlite"), legacy_path=str(legacy))
+
+def test_concurrent_workers_keep_entries(tmp_path):
+    worker_a = DoclingHashIndex(path=str(tmp_path / "index.sqlite"), legacy_path=None)
+    worker_b = DoclingHashIndex(path=str(tmp_path / "index.sqlite"), legacy_path=None)
+    assert worker_b.get("1") is None
+    worker_a.add("1", "/doc_store/1")
+    worker_b.add("2", "/doc_store/2")
+    assert worker_b.get("1") == "/doc_store/1"
+    assert worker_a.get("2") == "/doc_store/2"
@@ -0,0 +1,42 @@
+"""
+1. Test docling stitching: page range fragments of one pdf are joined with shifted references and the page numbers of the full pdf
+2. Test docling stitching: page ranges parsed by workers are written to fragment files and stitched from their paths
+"""
+from types import SimpleNamespace
+from docling_core.types.doc import DoclingDocument, DocItemLabel, ProvenanceItem, BoundingBox, Size
+from app.Ingestion_workflows.docling_parse_process import Docling_parser
+
+def _fragment(pages):
+    doc = DoclingDocument(name="manual")
+    for page_no in pages:
+        doc.add_page(page_no=page_no, size=Size(width=100, height=100))
+        prov = ProvenanceItem(page_no=page_no, bbox=BoundingBox(l=0, t=0, r=10, b=10), charspan=(0, 5))
+        group = doc.add_group(name=f"group {page_no}")
+        doc.add_heading(text=f"{page_no} Section", prov=prov, parent=group)
+        doc.add_text(label=DocItemLabel.TEXT, text=f"text of page {page_no}", prov=prov, parent=group)
+    return doc.export_to_dict()
+
+def test_stitch_fragments():
+    doc = Docling_parser.stitch_docling([_fragment([1, 2]), _fragment([3])])
+    assert sorted(doc.pages.keys()) == [1, 2, 3]
+    assert [text.self_ref for text in doc.texts] == [f"#/texts/{i}" for i in range(6)]
+    items = [(item.text, item.prov[0].page_no) for item, _ in doc.iterate_items() if hasattr(item, "text")]
+    assert items == [("1 Section", 1), ("text of page 1", 1), ("2 Section", 2), ("text of page 2", 2), ("3 Section", 3), ("text of page 3", 3)]
+    third_group = doc.body.children[2].resolve(doc)
+    assert [child.cref for child in third_group.children] == ["#/texts/4", "#/texts/5"]
+    assert doc.texts[4].parent.cref == "#/groups/2"
+
+def test_stitch_fragment_files(tmp_path, monkeypatch):
+    source = str(tmp_path / "manual.pdf")
+
+    class Converter:
+        def convert(self, source, page_range):
+            doc = DoclingDocument.model_validate(_fragment(range(page_range[0], page_range[1] + 1)))
+            return SimpleNamespace(document=doc)
+
+    monkeypatch.setattr(Docling_parser, "get_converter", staticmethod(lambda warm=False: Converter()))
+    paths = [Docling_parser.parse_docling_range(source, page_range) for page_range in [(1, 2), (3, 3)]]
+    assert paths == [source + ".pages_1-2.json", source + ".pages_3-3.json"]
+    doc = Docling_parser.stitch_docling(Docling_parser.load_fragments(paths))
+    assert sorted(doc.pages.keys()) == [1, 2, 3]
+    assert doc.texts[5].text == "text of page 3"
@@ -0,0 +1,66 @@
+"""
+1. Test embedding scheduler: concurrent requests per backend never exceed the limit and bulk requests leave the reserved slot free
+2. Test embedding scheduler: a waiting query request is served before waiting bulk requests
+3. Test embedding scheduler: transient http errors are retried, other errors are raised immediately
+"""
+import asyncio
+import httpx
+import pytest
+from app.utils.utils_embed_scheduler import EmbeddingScheduler, QUERY, BULK
+
+@pytest.mark.asyncio
+async def test_scheduler_bounds_concurrency():
+    scheduler = EmbeddingScheduler(max_concurrency=3, query_reserved=1, max_retries=0)
+    running, peak = 0, 0
+
+    async def request():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await asyncio.gather(*(scheduler.run("http://embed:8001", request, priority=BULK) for _ in range(20)))
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_scheduler_serves_queries_first():
+    scheduler = EmbeddingScheduler(max_concurrency=1, query_reserved=0, max_retries=0)
+    release = asyncio.Event()
+    order = []
+
+    async def request(name, wait=False):
+        if wait:
+            await release.wait()
+        order.append(name)
+
+    blocker = asyncio.create_task(scheduler.run("url", lambda: request("blocker", wait=True), priority=BULK))
+    await asyncio.sleep(0)
+    bulk = [asyncio.create_task(scheduler.run("url", lambda i=i: request(f"bulk{i}"), priority=BULK)) for i in range(3)]
+    await asyncio.sleep(0)
+    query = asyncio.create_task(scheduler.run("url", lambda: request("query"), priority=QUERY))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(blocker, query, *bulk)
+    assert order[:2] == ["blocker", "query"]
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_transient_errors():
+    scheduler = EmbeddingScheduler(max_concurrency=1, max_retries=2, backoff=0)
+    calls = 0
+
+    async def flaky():
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            raise httpx.ConnectError("connection refused")
+        return "ok"
+
+    assert await scheduler.run("url", flaky) == "ok"
+    assert calls == 3
+
+    async def bad_request():
+        raise httpx.HTTPStatusError("bad", request=httpx.Request("POST", "http://x"), response=httpx.Response(400))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await scheduler.run("url", bad_request)
@@ -0,0 +1,41 @@
+"""
+1. Test federated retrieval: the question is embedded once per embedding model and hits of all collections are fused with RRF, ids prefixed by collection
+2. Test federated retrieval: a collection answering after the latency budget is left out instead of delaying the answer
+"""
+import asyncio
+import pytest
+from app.utils import utils_LLM
+
+def hit(id, text):
+    return {"id": id, "distance": 0.5, "entity": {"text_concat": text, "metadata": {"Section": text}}}
+
+@pytest.fixture
+def collections(monkeypatch):
+    monkeypatch.setattr(utils_LLM, "col_mod", {"support": "big", "sales": "big", "support_small": "small"})
+    embedded = []
+
+    async def embed_query(question, model):
+        embedded.append(model)
+        return [[1.0]]
+
+    async def milvus_hybrid_search(collection_name, **kwargs):
+        if collection_name == "sales":
+            await asyncio.sleep(1)
+        return [[hit(1, f"{collection_name} first"), hit(2, f"{collection_name} second")]]
+
+    monkeypatch.setattr(utils_LLM, "embed_query", embed_query)
+    monkeypatch.setattr(utils_LLM, "milvus_hybrid_search", milvus_hybrid_search)
+    return embedded
+
+@pytest.mark.asyncio
+async def test_federated_rrf_merge(collections):
+    retrievals, results = await utils_LLM.federated_retrieve(uri="", token="", question="q", collections=["support", "support_small"], k=3, merge="rrf", budget=0.5)
+    assert sorted(collections) == ["big", "small"]
+    assert len(retrievals) == 4
+    assert [result.doc_id for result in results][:2] in (["support:1", "support_small:1"], ["support_small:1", "support:1"])
+    assert results[0].text.endswith("first") and len(results) == 3
+
+@pytest.mark.asyncio
+async def test_federated_budget_drops_slow_collection(collections):
+    retrievals, results = await utils_LLM.federated_retrieve(uri="", token="", question="q", collections=["support", "sales"], k=4, merge="rrf", budget=0.2)
+    assert {result.doc_id.split(":")[0] for result in results} == {"support"}
@@ -8,14 +8,22 @@
 7. Test milvus hybrid retrieve: mock rerank fucntion and make sure its called with correct params
 8. Test milvus hybrid retrieve: make sure func returns 2 outputs (non empty)
 9. Test milvus hybrid retrieve: test what happens if encode text or milvus client raises an exception
+10. Test message: collections of the request which are not in the collections claim of the user are rejected with 403 before any retrieval, whether they exist or not
+11. Test message: a cached answer is served for a question without chat history, the same question with chat history misses the cache
+12. Test message: the answer is returned before the turn is persisted, the next message of the session waits for it
 """
+import asyncio
 import pytest
 import json
 import pickle
 import httpx
 from unittest.mock import AsyncMock, patch, MagicMock
 from fastapi import HTTPException
-from app.main import add_message
+from app import main
+from app.main import add_message, add_message_stream, wait_for_persisted
+from app.utils.utils_cache import AnswerCache
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
 from app.config import MILVUS_URI, TOKEN, col_mod, topk_mod
 
 @pytest.mark.asyncio
@@ -25,11 +33,88 @@ async def test_add_message_invalid_conversation():
     request = MagicMock(conv_id="invalid", message="Test")
     redis_mock = AsyncMock()
     
-    # Return conversations that don't include the requested ID
-    redis_mock.get.return_value = '{"user1": ["conv123"]}'
+    # The conversation index of user1 does not include the requested ID
+    redis_mock.zscore.return_value = None
+    current_user = MagicMock(username="user1", admin=False)
     
     # Test error handling
     with pytest.raises(HTTPException) as excinfo:
-        await add_message(session_id_user, request, redis_mock)
+        await add_message(session_id_user, request, redis_mock, current_user)
     
-    assert excinfo.value.status_code == 404
\ No newline at end of file
+    assert excinfo.value.status_code == 404
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("endpoint", [add_message, add_message_stream])
+@pytest.mark.parametrize("collections", [["own_team", "other_team"], ["no_such_collection"]])
+async def test_add_message_forbidden_collection(endpoint, collections):
+    request = MagicMock(conv_id="conv1", message="Test", collections=collections)
+    redis_mock = AsyncMock()
+    redis_mock.zscore.return_value = 1.0
+    redis_mock.hget.return_value = b"own_team"
+    current_user = MagicMock(username="user1", admin=False, collections=["own_team"])
+
+    with patch("app.main.chat_history_store.load_memory", new_callable=AsyncMock) as load_memory, \
+         patch("app.main.embed_query", new_callable=AsyncMock) as embed_query:
+        with pytest.raises(HTTPException) as excinfo:
+            await endpoint("conv1$user1", request, redis_mock, current_user)
+    assert excinfo.value.status_code == 403
+    load_memory.assert_not_called()
+    embed_query.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("history, cache_hit", [([], True), ([ChatMessage(content="List the steps", role=MessageRole.USER)], False)])
+async def test_add_message_answer_cache_needs_empty_history(history, cache_hit):
+    request = MagicMock(conv_id="conv1", message="And the second one?", collections=None)
+    redis_mock = AsyncMock()
+    redis_mock.zscore.return_value = 1.0
+    current_user = MagicMock(username="user1", admin=False, collections=["support"])
+    memory = ChatMemoryBuffer.from_defaults(chat_history=list(history), tokenizer_fn=str.split)
+    cache = AnswerCache(max_size=4, ttl=60, threshold=0.95)
+    await cache.set("support", [[1.0, 0.0]], {"retrievals": [], "results": [], "response": "cached", "final_response": "cached", "citations": [1], "citation_records": []})
+    llm_response = MagicMock(response="generated")
+    model = MagicMock(memory=memory, run=AsyncMock(return_value=llm_response))
+
+    with patch("app.main.load_session", new=AsyncMock(return_value=(["support"], 5, memory, len(history), {col_mod["support"]: [[1.0, 0.0]]}))), \
+         patch.dict("app.main.col_mod", {"support": col_mod.get("support", "big")}), \
+         patch("app.main.answer_cache", cache), \
+         patch("app.main.retrieve", new=AsyncMock(return_value=([], []))) as retrieve, \
+         patch("app.main.Settings"), \
+         patch("app.main.CitationQueryEngineWorkflow", return_value=model), \
+         patch("app.main.cite", return_value=("generated", [], [])), \
+         patch("app.main.chat_history_store.save_turn", new=AsyncMock()), \
+         patch("app.main.record_interaction", new=AsyncMock()):
+        answer = await add_message("conv1$user1", request, redis_mock, current_user)
+        await wait_for_persisted("conv1")
+    assert answer == ("cached" if cache_hit else "generated")
+    assert retrieve.called != cache_hit
+
+
+@pytest.mark.asyncio
+async def test_add_message_persists_after_response():
+    request = MagicMock(conv_id="conv2", message="Question", collections=None)
+    redis_mock = AsyncMock()
+    redis_mock.zscore.return_value = 1.0
+    current_user = MagicMock(username="user1", admin=False, collections=["support"])
+    memory = ChatMemoryBuffer.from_defaults(tokenizer_fn=str.split)
+    model = MagicMock(memory=memory, run=AsyncMock(return_value=MagicMock(response="generated")))
+    release = asyncio.Event()
+    saved = []
+
+    async def save_turn(*args):
+        await release.wait()
+        saved.append(args)
+
+    with patch("app.main.load_session", new=AsyncMock(return_value=(["support"], 5, memory, 0, {col_mod["support"]: [[1.0]]}))), \
+         patch("app.main.ANSWER_CACHE_ENABLED", False), \
+         patch("app.main.retrieve", new=AsyncMock(return_value=([], []))), \
+         patch("app.main.Settings"), \
+         patch("app.main.CitationQueryEngineWorkflow", return_value=model), \
+         patch("app.main.cite", return_value=("generated", [], [])), \
+         patch("app.main.chat_history_store.save_turn", new=save_turn), \
+         patch("app.main.record_interaction", new=AsyncMock()):
+        assert await add_message("conv2$user1", request, redis_mock, current_user) == "generated"
+        assert not saved and "conv2" in main._persisting
+        release.set()
+        await wait_for_persisted("conv2")
+    assert len(saved) == 1 and "conv2" not in main._persisting
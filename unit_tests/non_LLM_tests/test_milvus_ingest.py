@@ -0,0 +1,54 @@
+"""
+1. Test deduplication lookup: a collection created before the text_hash field is backfilled once, later ingestions only filter on text_hash
+"""
+import pytest
+from app.Ingestion_workflows import milvus_ingest
+from app.Ingestion_workflows.milvus_ingest import ingest2milvus, TEXT_HASH_BACKFILLED
+
+class LegacyCollection:
+    """ Sync and async client of a collection without the text_hash field """
+    def __init__(self, texts):
+        self.rows = {id: {"id": id, "text": text, "text_concat": text, "metadata": {}, "dense_embedding": [0.0], "sparse_embedding": {}} for id, text in enumerate(texts)}
+        self.properties = {}
+        self.scans = 0
+        self.upserts = []
+
+    def describe_collection(self, collection_name):
+        return {"fields": [{"name": name} for name in ["id", "dense_embedding", "text", "text_concat", "sparse_embedding"]], "properties": dict(self.properties)}
+
+    def alter_collection_properties(self, collection_name, properties):
+        self.properties.update(properties)
+
+    def query_iterator(self, collection_name, batch_size, filter, output_fields):
+        self.scans += 1
+        batches = [[{"id": id} for id in list(self.rows)[start:start + batch_size]] for start in range(0, len(self.rows), batch_size)] + [[]]
+
+        class Iterator:
+            def next(self):
+                return batches.pop(0)
+
+            def close(self):
+                pass
+        return Iterator()
+
+    async def query(self, collection_name, ids=None, filter=None, filter_params=None, output_fields=None):
+        if ids is not None:
+            return [dict(self.rows[id]) for id in ids]
+        return [dict(row) for row in self.rows.values() if row.get("text_hash") in filter_params["hashes"]]
+
+    async def upsert(self, collection_name, data):
+        self.upserts.append(len(data))
+        for row in data:
+            assert "sparse_embedding" not in row
+            self.rows[row["id"]] = row
+
+@pytest.mark.asyncio
+async def test_find_existing_backfills_legacy_collection_once(monkeypatch):
+    monkeypatch.setattr(milvus_ingest, "_backfill_locks", {})
+    client = LegacyCollection(["a", "b", "c"])
+    data = [{"text": "b", "text_hash": ingest2milvus.text_hash("b")}]
+    existing = await ingest2milvus.find_existing(client, client, "legacy", data, batch_size=2)
+    assert [row["text"] for row in existing] == ["b"]
+    assert client.upserts == [2, 1] and client.properties == {TEXT_HASH_BACKFILLED: "true"}
+    existing = await ingest2milvus.find_existing(client, client, "legacy", [{"text": "d", "text_hash": ingest2milvus.text_hash("d")}], batch_size=2)
+    assert existing == [] and client.scans == 1 and client.upserts == [2, 1]
@@ -0,0 +1,81 @@
+"""
+1. Test Milvus client pool: a connection failing its health check is replaced, a borrower which checked out during the ping keeps its client until it checks in
+2. Test Milvus client pool: the health check pings the async client of an async borrower and does not open a sync client for it
+"""
+import asyncio
+import pytest
+from app.utils import utils_milvus
+from app.utils.utils_milvus import MilvusClientPool
+
+class Client:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+@pytest.mark.asyncio
+async def test_failed_health_check_does_not_close_shared_client(monkeypatch):
+    ping_started = asyncio.Event()
+    release_ping = asyncio.Event()
+
+    async def get_client(self):
+        if self.client is None:
+            self.client = Client()
+        return self.client
+
+    async def is_healthy(self, use_async=False):
+        ping_started.set()
+        await release_ping.wait()
+        return False
+
+    monkeypatch.setattr(utils_milvus._PooledClients, "get_client", get_client)
+    monkeypatch.setattr(utils_milvus._PooledClients, "is_healthy", is_healthy)
+    pool = MilvusClientPool(uri="", root_token="root", health_check_interval=-1)
+
+    async def check():
+        async with pool.client() as client:
+            return client
+
+    checker = asyncio.create_task(check())
+    await ping_started.wait()
+    async with pool.client() as shared:
+        release_ping.set()
+        fresh = await checker
+        assert fresh is not shared and not shared.closed
+    assert shared.closed and not fresh.closed
+    pool.health_check_interval = 3600
+    async with pool.client() as client:
+        assert client is fresh
+
+@pytest.mark.asyncio
+async def test_health_check_pings_client_in_use(monkeypatch):
+    pings = []
+
+    class Connection:
+        async def alloc_timestamp(self, timeout):
+            pings.append("async")
+
+    class AsyncClient:
+        def _get_connection(self):
+            return Connection()
+
+        async def close(self):
+            pass
+
+    async def get_async_client(self):
+        if self.async_client is None:
+            self.async_client = AsyncClient()
+        return self.async_client
+
+    async def get_client(self):
+        raise AssertionError("sync client opened for an async borrower")
+
+    monkeypatch.setattr(utils_milvus._PooledClients, "get_async_client", get_async_client)
+    monkeypatch.setattr(utils_milvus._PooledClients, "get_client", get_client)
+    pool = MilvusClientPool(uri="", root_token="root", health_check_interval=-1)
+    async with pool.async_client() as first:
+        pass
+    async with pool.async_client() as second:
+        assert second is first
+    assert pings == ["async"]
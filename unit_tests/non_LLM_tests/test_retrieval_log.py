@@ -0,0 +1,90 @@
+"""
+1. Test retrieval log: feedback by interaction id is exported with the logged interaction
+2. Test retrieval log: feedback of another user for the same interaction id does not overwrite it
+3. Test retrieval log: clients without interaction id still update feedback by matching the response
+4. Test retrieval log: concurrent first connections to a store without the interaction_id column add the column once
+5. Test retrieval log: feedback by response waits for the queued rows of its user only, not for a write of another user
+6. Test retrieval log: a failed import of a legacy excel log is retried on the next access instead of being marked as imported
+"""
+import asyncio
+import pandas as pd
+import pytest
+import sqlite3
+import threading
+from app.utils.utils_retrieval_log import RetrievalLogStore
+
+@pytest.fixture
+def store(tmp_path):
+    return RetrievalLogStore(path=str(tmp_path / "retrieval_log.sqlite"), legacy_path=str(tmp_path / "{user}_retrieve.xlsx"))
+
+@pytest.mark.asyncio
+async def test_feedback_by_interaction_id(store, tmp_path):
+    await store.log({"user": "alice", "interaction_id": "id-1", "chat_session": "conv", "llm_response": "answer"})
+    await store.set_feedback(interaction_id="id-1", user="alice", feedback="Negative", feedback_comment="wrong page")
+    df = pd.read_excel(await store.export_excel("alice", path=str(tmp_path / "export.xlsx")))
+    assert df.loc[0, "Feedback (like/dislike)"] == "Negative"
+    assert df.loc[0, "Feedback (Comments)"] == "wrong page"
+
+@pytest.mark.asyncio
+async def test_feedback_of_other_user_is_ignored(store, tmp_path):
+    await store.log({"user": "alice", "interaction_id": "id-1", "chat_session": "conv", "llm_response": "answer"})
+    await store.set_feedback(interaction_id="id-1", user="alice", feedback="Positive", feedback_comment="N/A")
+    await store.set_feedback(interaction_id="id-1", user="mallory", feedback="Negative", feedback_comment="spam")
+    df = pd.read_excel(await store.export_excel("alice", path=str(tmp_path / "export.xlsx")))
+    assert df.loc[0, "Feedback (like/dislike)"] == "Positive"
+
+@pytest.mark.asyncio
+async def test_feedback_fallback_by_response(store, tmp_path):
+    await store.log({"user": "alice", "chat_session": "conv", "llm_response": "answer"})
+    assert await store.update_feedback(user="alice", conv_id="conv", llm_response="answer", feedback="Positive", feedback_comment="N/A") == 1
+    df = pd.read_excel(await store.export_excel("alice", path=str(tmp_path / "export.xlsx")))
+    assert df.loc[0, "Feedback (like/dislike)"] == "Positive"
+
+@pytest.mark.asyncio
+async def test_concurrent_migration_of_old_store(store):
+    with sqlite3.connect(store.path) as conn:
+        conn.execute("CREATE TABLE retrieval_log (id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, time TEXT, chat_session TEXT, question TEXT, "
+                     "retrievals TEXT, reranked_results TEXT, collection TEXT, llm_response TEXT, citations TEXT, feedback TEXT DEFAULT 'N/A', feedback_comment TEXT DEFAULT 'N/A')")
+    conn.close()
+    await asyncio.gather(*(store.set_feedback(interaction_id=f"id-{i}", user="alice", feedback="Positive", feedback_comment="N/A") for i in range(8)))
+
+@pytest.mark.asyncio
+async def test_feedback_fallback_does_not_wait_for_other_users(store, monkeypatch):
+    release = threading.Event()
+    write_rows = store._write_rows
+
+    def slow_write_rows(rows):
+        if any(row["user"] == "bob" for row in rows):
+            release.wait(5)
+        write_rows(rows)
+
+    monkeypatch.setattr(store, "_write_rows", slow_write_rows)
+    store.start()
+    try:
+        await store.log({"user": "alice", "chat_session": "conv", "llm_response": "answer"})
+        await store._wait_for_user("alice")
+        await store.log({"user": "bob", "chat_session": "conv", "llm_response": "answer"})
+        updated = await asyncio.wait_for(store.update_feedback(user="alice", conv_id="conv", llm_response="answer", feedback="Positive", feedback_comment="N/A"), timeout=2)
+        assert updated == 1
+    finally:
+        release.set()
+        await store.close()
+
+@pytest.mark.asyncio
+async def test_failed_legacy_import_is_retried(store, tmp_path, monkeypatch):
+    pd.DataFrame([{"question": "old question", "LLM_response": "old answer"}]).to_excel(str(tmp_path / "alice_retrieve.xlsx"), index=False)
+    read_excel = pd.read_excel
+    calls = []
+
+    def flaky_read_excel(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("file is locked")
+        return read_excel(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_excel", flaky_read_excel)
+    await store.log({"user": "alice", "chat_session": "conv", "llm_response": "answer"})
+    df = read_excel(await store.export_excel("alice", path=str(tmp_path / "export.xlsx")))
+    assert sorted(df["LLM_response"]) == ["answer", "old answer"]
+    df = read_excel(await store.export_excel("alice", path=str(tmp_path / "export.xlsx")))
+    assert len(df) == 2 and len(calls) == 2